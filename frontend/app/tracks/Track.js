@@ -3,6 +3,7 @@ import { connect } from 'preact-redux';
 import PropTypes from 'prop-types';
 import { bindActions, fileSize, getClassName, deepGet } from '../util';
 import * as actions from './actions';
+import Waveform from './Waveform';
 
 function Track({ track, removeTrack, cancelTrack }) {
 	const { request } = track;
@@ -61,6 +62,8 @@ function Track({ track, removeTrack, cancelTrack }) {
 		<div className={getClassName(track, 'track')}>
 			<div className="name">{track.file.name}</div>
 			<div className="size">{fileSize(track.file.size)}</div>
+			<Waveform url={track.peaks} />
+			{track.preview && <audio className="preview" controls preload="none" src={track.preview} />}
 			<div className="status">{status()}</div>
 			{deleteButton()}
 		</div>
@@ -0,0 +1,44 @@
+import { h, Component } from 'preact';
+import PropTypes from 'prop-types';
+import { loadWaveform } from '../../classic/waveform';
+
+/**
+ * Canvas with the waveform of a Track, drawn from its precomputed peaks.
+ */
+export default class Waveform extends Component {
+	componentDidMount() {
+		this.load();
+	}
+
+	componentDidUpdate(prevProps) {
+		if (prevProps.url !== this.props.url) this.load();
+	}
+
+	load() {
+		if (this.canvas && this.props.url) loadWaveform(this.canvas, this.props.url);
+	}
+
+	render({ url, width, height }) {
+		if (!url) return null;
+		return (
+			<canvas
+				className="waveform"
+				width={width}
+				height={height}
+				ref={(canvas) => { this.canvas = canvas; }}
+			/>
+		);
+	}
+}
+
+Waveform.propTypes = {
+	url: PropTypes.string,
+	width: PropTypes.number,
+	height: PropTypes.number,
+};
+
+Waveform.defaultProps = {
+	url: null,
+	width: 300,
+	height: 40,
+};
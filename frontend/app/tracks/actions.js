@@ -1,4 +1,5 @@
 import api from '../api';
+import { sha256 } from '../util';
 
 import {
 	TRACK_POST_START, TRACK_POST_SUCCESS, TRACK_POST_ERROR,
@@ -7,12 +8,17 @@ import {
 } from './reducers';
 
 export function addTrack(file, group) {
-	const track = {
-		group: group.id,
-		file,
-	};
-	return api('tracks')
-		.post(track, TRACK_POST_START, TRACK_POST_SUCCESS, TRACK_POST_ERROR, TRACK_POST_PROGRESS);
+	// The server rejects the upload if its own checksum doesn't match
+	return dispatch => sha256(file).then((checksum) => {
+		const track = {
+			group: group.id,
+			file,
+		};
+		if (checksum) track.checksum = checksum;
+		const post = api('tracks')
+			.post(track, TRACK_POST_START, TRACK_POST_SUCCESS, TRACK_POST_ERROR, TRACK_POST_PROGRESS);
+		return post(dispatch);
+	});
 }
 
 export function cancelTrack(track) {
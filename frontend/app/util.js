@@ -144,3 +144,28 @@ export function updateDOM(selector, content) {
 	const nodes = document.querySelectorAll(selector);
 	[].forEach.call(nodes, node => node.innerHTML = content);
 }
+
+/**
+ * Compute the SHA-256 of a File as a hex string, to let the server verify uploads.
+ * Resolves to null in browsers without the Web Crypto API.
+ * @param  {File} file  The file that will be hashed
+ * @return {Promise}    Resolves to the hex digest or null
+ */
+export function sha256(file) {
+	const subtle = window.crypto && window.crypto.subtle;
+	if (!subtle || !window.FileReader) return Promise.resolve(null);
+
+	return new Promise((resolve) => {
+		const reader = new FileReader();
+		reader.onload = () => resolve(reader.result);
+		reader.onerror = () => resolve(null);
+		reader.readAsArrayBuffer(file);
+	})
+		.then(buffer => (buffer ? subtle.digest('SHA-256', buffer) : null))
+		.then((digest) => {
+			if (!digest) return null;
+			const bytes = new Uint8Array(digest);
+			return [].map.call(bytes, byte => `0${byte.toString(16)}`.slice(-2)).join('');
+		})
+		.catch(() => null);
+}
@@ -5,9 +5,11 @@
 import '../style/main.scss';
 
 import payAndSubmit from './stripe-payment';
+import loadWaveforms from './waveform';
 
 // Required for live reloading
 if (module.hot) module.hot.accept();
 
 // Attach to window to make accessible to inline scripts
 window.payAndSubmit = payAndSubmit;
+window.loadWaveforms = loadWaveforms;
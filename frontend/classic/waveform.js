@@ -0,0 +1,63 @@
+/**
+ * Draw waveform peaks served by the API (/api/tracks/{id}/peaks/) on a canvas.
+ * `data` holds interleaved min/max pairs in the -127 to 127 range.
+ *
+ * @param {HTMLCanvasElement} canvas - Target canvas, drawn at its current size
+ * @param {Object} peaks - Response of the peaks endpoint
+ */
+export function drawWaveform(canvas, peaks) {
+	const ctx = canvas.getContext('2d');
+	const { width, height } = canvas;
+	const length = peaks.data.length / 2;
+	const middle = height / 2;
+	const scale = middle / 127;
+
+	ctx.clearRect(0, 0, width, height);
+	ctx.fillStyle = window.getComputedStyle(canvas).color;
+
+	// Several peaks can end up in the same pixel column, keep the extremes
+	for (let x = 0; x < width; x++) {
+		const start = Math.floor(x * length / width);
+		const end = Math.max(start + 1, Math.floor((x + 1) * length / width));
+		let min = 0;
+		let max = 0;
+		for (let i = start; i < end && i < length; i++) {
+			min = Math.min(min, peaks.data[2 * i]);
+			max = Math.max(max, peaks.data[2 * i + 1]);
+		}
+		const top = middle - max * scale;
+		ctx.fillRect(x, top, 1, Math.max(1, (max - min) * scale));
+	}
+}
+
+/**
+ * Fetch the peaks for a canvas and draw them.
+ * The browser cache revalidates the response with its ETag.
+ *
+ * @param {HTMLCanvasElement} canvas - Target canvas
+ * @param {string} url - Peaks endpoint URL
+ */
+export function loadWaveform(canvas, url) {
+	const xhr = new XMLHttpRequest();
+	xhr.open('GET', `${url}?width=${canvas.width}`, true);
+	xhr.setRequestHeader('Accept', 'application/json');
+	xhr.onload = function waveformLoad() {
+		if (xhr.status !== 200) return;
+		drawWaveform(canvas, JSON.parse(xhr.responseText));
+	};
+	xhr.send();
+}
+
+/**
+ * Draw a waveform on every canvas with a data-peaks-url attribute.
+ *
+ * @example
+ * <canvas class="waveform" width="600" height="60" data-peaks-url="..."></canvas>
+ * <script>loadWaveforms();</script>
+ */
+export default function loadWaveforms(root = document) {
+	const canvases = root.querySelectorAll('canvas[data-peaks-url]');
+	Array.prototype.forEach.call(canvases, (canvas) => {
+		loadWaveform(canvas, canvas.getAttribute('data-peaks-url'));
+	});
+}
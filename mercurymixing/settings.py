@@ -1,6 +1,7 @@
 
 from __future__ import absolute_import, unicode_literals
 import os
+import tempfile
 
 from django import VERSION as DJANGO_VERSION
 from django.utils.translation import ugettext_lazy as _
@@ -135,6 +136,13 @@ AUTHENTICATION_BACKENDS = ("mezzanine.core.auth_backends.MezzanineBackend",)
 # a mode you'd pass directly to os.chmod.
 FILE_UPLOAD_PERMISSIONS = 0o644
 
+# Same as Django's default handlers, but they also compute the SHA-256 of
+# each file while it's received (see mixing.models.Track.checksum).
+FILE_UPLOAD_HANDLERS = (
+    "utils.uploads.ChecksumMemoryFileUploadHandler",
+    "utils.uploads.ChecksumTemporaryFileUploadHandler",
+)
+
 
 #############
 # DATABASES #
@@ -245,6 +253,8 @@ INSTALLED_APPS = (
     "frontend",
     "mixing",
     "mixing.purchases",
+    "mixing.jobs",
+    "mixing.reports",
     "mezzanine.boot",
     "mezzanine.conf",
     "mezzanine.core",
@@ -262,6 +272,8 @@ INSTALLED_APPS = (
 # these middleware classes will be applied in the order given, and in the
 # response phase the middleware will be applied in reverse order.
 MIDDLEWARE_CLASSES = (
+    "utils.performance.PerformanceMiddleware",
+    "utils.queries.QueryInspectorMiddleware",
     "mezzanine.core.middleware.UpdateCacheMiddleware",
 
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -336,6 +348,62 @@ ACCOUNTS_PROFILE_FORM_EXCLUDE_FIELDS = ("track_credit",)
 PRIVATE_STORAGE_ROOT = os.path.join(PROJECT_ROOT, "private_media")
 PRIVATE_STORAGE_AUTH_FUNCTION = "mixing.permissions.allow_owner_and_staff"
 
+# Backend of all private files. UniquePrivateStorage uses PRIVATE_STORAGE_ROOT,
+# S3PrivateStorage any S3 compatible service (needs boto3 and options like
+# {"bucket": "...", "endpoint_url": "..."}), and LocalObjectStorage behaves like
+# S3 on the local disk. See mixing.storage.
+PRIVATE_FILE_STORAGE = "mixing.storage.UniquePrivateStorage"
+PRIVATE_FILE_STORAGE_OPTIONS = {}
+
+# Seconds a signed download URL of an object storage stays valid
+PRIVATE_URL_EXPIRE = 60 * 5
+
+# Tracks of completed Projects are moved to archives in this directory,
+# which can live on a cheaper disk. See mixing.archive.
+ARCHIVE_STORAGE_ROOT = os.path.join(PROJECT_ROOT, "archive")
+
+# Background jobs, see mixing.jobs. Failed jobs are retried after
+# JOBS_RETRY_DELAY seconds, doubling up to JOBS_MAX_RETRY_DELAY. Jobs running
+# for longer than JOBS_TIMEOUT seconds are assumed lost and queued again.
+JOBS_RETRY_DELAY = 30
+JOBS_MAX_RETRY_DELAY = 60 * 60 * 6
+JOBS_TIMEOUT = 60 * 30
+JOBS_KEEP_DAYS = 7
+
+# The update_rollups command recomputes the daily report rollups of this many
+# days, including today. See mixing.reports.
+REPORTS_ROLLUP_DAYS = 3
+
+# Seconds the turnaround percentiles of the status transitions admin are
+# cached for.
+REPORTS_TURNAROUND_CACHE_TIMEOUT = 60 * 15
+
+# Directory of the memory mapped request histograms, one file per process,
+# see utils.performance. Empty to disable them.
+PERF_STATS_DIR = os.path.join(tempfile.gettempdir(), "mercurymixing-performance")
+
+# Add a Server-Timing header with the DB, cache and total time to responses.
+PERF_SERVER_TIMING = True
+
+# Queries slower than this many seconds are logged with a stack trace, see
+# utils.queries. None to disable.
+PERF_SLOW_QUERY_SECONDS = 0.5
+
+# With DEBUG, requests that run the same query (with different values) more
+# than this many times are logged as probable N+1 patterns.
+PERF_REPEATED_QUERIES = 2
+
+# Bearer token of the /metrics endpoint for Prometheus. Staff members can
+# always read it. Set it in local_settings.py.
+METRICS_TOKEN = ""
+
+# The cache backends of utils.performance count hits and misses per request.
+CACHES = {
+    "default": {
+        "BACKEND": "utils.performance.LocMemCache",
+    }
+}
+
 ##################
 # LOCAL SETTINGS #
 ##################
@@ -8,7 +8,7 @@ from django.views.i18n import set_language
 from mezzanine.core.views import direct_to_template
 from mezzanine.conf import settings
 
-from utils import views as util_views
+from mixing import views as mixing_views
 
 
 admin.autodiscover()
@@ -71,10 +71,21 @@ urlpatterns += [
     # CUSTOM URLS
     # -----------
 
+    # Signed URLs of mixing.storage.LocalObjectStorage
     url(
-        r"^private/(?P<path>.*)$", util_views.PrivateAttachment.as_view(),
+        r"^signed/(?P<token>[\w:.-]+)/$", mixing_views.SignedFileDownload.as_view(),
+        name="serve_signed_file"
+    ),
+    # Previews are played in the browser instead of downloaded
+    url(
+        r"^private/(?P<path>previews/.*)$", mixing_views.PrivatePreview.as_view(),
+        name="serve_private_preview"
+    ),
+    url(
+        r"^private/(?P<path>.*)$", mixing_views.PrivateFileDownload.as_view(),
         name="serve_private_file"
     ),
+    url(r"^metrics$", mixing_views.Metrics.as_view(), name="metrics"),
     url("^purchases/", include("mixing.purchases.urls", namespace="purchases")),
     url("^", include("mixing.urls")),
 
@@ -1,23 +1,34 @@
 from __future__ import unicode_literals, absolute_import
 
 from zipfile import ZipFile, ZIP_DEFLATED
+import logging
 import re
 
 from django.conf.urls import url
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
 from django.core.files.base import ContentFile
 from django.shortcuts import get_object_or_404, HttpResponse
 from django.template import Context, loader
+from django.template.defaultfilters import filesizeformat
 from django.utils.html import mark_safe
 from django.utils.six import b
 from django.utils.timezone import now, get_default_timezone
 
 from mezzanine.core.admin import StackedDynamicInlineAdmin, TabularDynamicInlineAdmin
 
-from .models import Project, Track, Comment, FinalFile
+from utils import display_filename
+
+from .archive import open_archive
+from .metrics import zip_export_duration
+from .models import Project, Song, Track, Comment, FinalFile
+from .search import search_projects
+from .track_browser import browser_songs, render_song
 
 TZ = get_default_timezone()
 
+logger = logging.getLogger(__name__)
+
 
 def to_folder_name(value):
     """
@@ -27,25 +38,54 @@ def to_folder_name(value):
     return value if len(value) else "unknown_name"
 
 
+def read_track_file(track, archive, members):
+    """
+    The content of a Track's file, from the archive if it's one of its members.
+    Tracks uploaded after the Project was archived are read from private
+    storage. None if the file is in neither.
+    """
+    name = track.file.name
+    if name in members:
+        return archive.read(name)
+    try:
+        with track.file.storage.open(name) as f:
+            return f.read()
+    except (IOError, OSError):
+        logger.warning("Missing file not exported: %s", name)
+        return None
+
+
 def serve_tracks_as_zipfile(request, pk):
     """
     Create a Zip archive with all the Tracks in a Project.
     The Tracks will be organized in folders according to Songs and Groups.
+    Archived Projects are read from their archive without restoring them.
+    Tracks without a file are left out.
     Based on https://github.com/thibault/django-zipview/
     """
     project = get_object_or_404(Project, pk=pk)
     timestamp = now().astimezone(TZ).strftime("%Y-%m-%d %H-%M-%S")
     name = "%s %s.zip" % (to_folder_name(project.title), timestamp)
     temp_file = ContentFile(b(""), name=name)
+    archive = open_archive(project)
+    source = "storage" if archive is None else "archive"
+    members = set() if archive is None else set(archive.namelist())
 
-    with ZipFile(temp_file, mode="w", compression=ZIP_DEFLATED) as zip_file:
-        for track in Track.objects.filter(group__song__project=project):
+    with zip_export_duration.time(source=source), \
+            ZipFile(temp_file, mode="w", compression=ZIP_DEFLATED) as zip_file:
+        tracks = Track.objects.filter(group__song__project=project).select_related("group__song")
+        for track in tracks:
             path = "{}/{}/{}".format(
                 to_folder_name(track.group.song.title),
                 to_folder_name(track.group.title),
-                track.file.name.split("/")[-1]
+                track.filename or display_filename(track.file.name)
             )
-            zip_file.writestr(path, track.file.read())
+            content = read_track_file(track, archive, members)
+            if content is not None:
+                zip_file.writestr(path, content)
+
+    if archive is not None:
+        archive.close()
 
     file_size = temp_file.tell()
     temp_file.seek(0)
@@ -56,6 +96,14 @@ def serve_tracks_as_zipfile(request, pk):
     return response
 
 
+def serve_song_tracks(request, pk, song_pk):
+    """
+    The Groups and Tracks of a Song for the track browser, loaded when it's opened.
+    """
+    song = get_object_or_404(Song, pk=song_pk, project=pk)
+    return HttpResponse(render_song(song))
+
+
 class CommentInlineAdmin(StackedDynamicInlineAdmin):
     model = Comment
     fields = ["created", "author", "content", "attachment"]
@@ -68,19 +116,45 @@ class FinalFileInlineAdmin(TabularDynamicInlineAdmin):
     readonly_fields = ["created"]
 
 
+def status_action(status, label):
+    """
+    An admin action that moves the selected Projects to a status in one UPDATE.
+    """
+    def set_status(modeladmin, request, queryset):
+        updated = queryset.set_status(status)
+        modeladmin.message_user(request, "%d projects marked as \"%s\"" % (updated, label))
+    set_status.__name__ = str("set_status_%s" % status)
+    set_status.short_description = "Mark as \"%s\"" % label
+    return set_status
+
+
+class ProjectChangeList(ChangeList):
+    """
+    Adds the counts of the changelist columns, see ProjectQuerySet.with_activity().
+    Other admin views don't need them.
+    """
+
+    def get_queryset(self, request):
+        return super(ProjectChangeList, self).get_queryset(request).with_activity()
+
+
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
     inlines = [FinalFileInlineAdmin, CommentInlineAdmin]
     ordering = ["priority", "-created"]
     date_hierarchy = "created"
-    list_display = ["title", "owner", "created", "status", "priority"]
+    list_display = [
+        "title", "owner", "created", "status", "priority", "track_count",
+        "storage_usage", "last_upload", "comment_count"]
+    list_select_related = ["owner"]
     list_editable = ["priority"]
     list_filter = ["status"]
     search_fields = ["title", "owner__username"]
-    readonly_fields = ["created", "updated", "track_browser"]
+    readonly_fields = ["created", "updated", "archived", "track_browser"]
     fieldsets = (
         (None, {
-            "fields": ["title", "owner", "created", "updated", "status", "priority"],
+            "fields": [
+                "title", "owner", "created", "updated", "archived", "status", "priority"],
         }),
         ("Tracks", {
             "fields": ["track_browser"],
@@ -123,15 +197,66 @@ class ProjectAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(serve_tracks_as_zipfile),
                 name="%s_%s_download" % info
             ),
+            url(
+                r"^(?P<pk>[0-9]+)/songs/(?P<song_pk>[0-9]+)/$",
+                self.admin_site.admin_view(serve_song_tracks),
+                name="%s_%s_song" % info
+            ),
         ]
         return urls + default_urls
 
+    def get_actions(self, request):
+        actions = super(ProjectAdmin, self).get_actions(request)
+        if not self.has_change_permission(request):
+            return actions
+        for status, label in Project.STATUS_CHOICES:
+            action = status_action(status, label)
+            actions[action.__name__] = (action, action.__name__, action.short_description)
+        return actions
+
+    def get_changelist(self, request, **kwargs):
+        return ProjectChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search the SearchDocuments of the Projects instead of search_fields,
+        see mixing.search. The best matches come first unless a column is sorted.
+        """
+        if not search_term.strip():
+            return queryset, False
+        queryset = search_projects(queryset, search_term)
+        if ORDER_VAR not in request.GET:
+            queryset = queryset.order_by("-search_rank", *queryset.query.order_by)
+        return queryset, False
+
+    def track_count(self, project):
+        return project.track_count
+    track_count.short_description = "Tracks"
+    track_count.admin_order_field = "track_count"
+
+    def comment_count(self, project):
+        return project.comment_count
+    comment_count.short_description = "Comments"
+    comment_count.admin_order_field = "comment_count"
+
+    def last_upload(self, project):
+        return project.last_upload
+    last_upload.short_description = "Last upload"
+    last_upload.admin_order_field = "last_upload"
+
+    def storage_usage(self, project):
+        return filesizeformat(project.storage_bytes)
+    storage_usage.short_description = "Storage used"
+    storage_usage.admin_order_field = "storage_bytes"
+
     def track_browser(self, project=None):
         """
         Generates a collapsible tree of Songs / Groups / Tracks.
+        Only the Songs are rendered here, see serve_song_tracks().
         """
         template = loader.get_template("admin/mixing/includes/track_browser.html")
-        context = Context({"project": project})
+        songs = browser_songs(project) if project and project.pk else []
+        context = Context({"project": project, "songs": songs})
         output = template.render(context)
         # Remove all newlines because Django converts them into <br>
         nonewlines = re.sub(r"[\n\r\t]+", "", output)
@@ -0,0 +1,25 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+
+
+class MixingConfig(AppConfig):
+    name = "mixing"
+    verbose_name = "Mixing"
+
+    def ready(self):
+        """
+        Stop django-cleanup from removing files inline when objects are saved
+        or deleted, which happens even if the transaction is rolled back later.
+        Deleted and replaced files are queued as StaleFiles instead, see
+        queue_files_on_delete() and SizedUpload.save().
+        """
+        signals = (
+            ("post_init", post_init), ("pre_save", pre_save),
+            ("post_save", post_save), ("post_delete", post_delete))
+        for model in self.get_models():
+            for name, signal in signals:
+                uid = "%s_django_cleanup_%s.%s" % (
+                    name, model._meta.app_label, model._meta.model_name)
+                signal.disconnect(sender=model, dispatch_uid=uid)
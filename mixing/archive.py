@@ -0,0 +1,156 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+import tempfile
+import uuid
+from datetime import timedelta
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from django.core.files import File
+from django.db import transaction
+from django.utils.timezone import now
+
+from mezzanine.conf import settings
+
+from .jobs.queue import job
+from .models import Project, Track
+from .storage import private_storage, archive_storage, local_copy
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def projects_to_archive(days=None):
+    """
+    Completed Projects that haven't been updated in ARCHIVE_AFTER_DAYS days.
+    """
+    if days is None:
+        days = settings.ARCHIVE_AFTER_DAYS
+    return Project.objects.filter(
+        status__in=Project.ALL_DONE,
+        archived__isnull=True,
+        updated__lt=now() - timedelta(days=days),
+    )
+
+
+def archived_track_names(project):
+    return set(Track.objects.filter(group__song__project=project).exclude(
+        file="").values_list("file", flat=True))
+
+
+def archive_project(project):
+    """
+    Pack the Track files of a Project into a single ZIP in archive storage and
+    remove them from private storage. The Tracks keep their file names, which
+    are used as the names inside the archive.
+    If the Project was reopened or archived by someone else in the meantime,
+    the new ZIP is removed and the files are left alone.
+    Returns the number of archived files.
+    """
+    names = sorted(archived_track_names(project))
+    archived_names = []
+
+    with tempfile.TemporaryFile() as temp_file:
+        with ZipFile(temp_file, "w", ZIP_DEFLATED, allowZip64=True) as zip_file:
+            for name in names:
+                if not private_storage.exists(name):
+                    logger.warning("Missing file not archived: %s", name)
+                    continue
+                with local_copy(private_storage, name) as path:
+                    zip_file.write(path, name)
+                archived_names.append(name)
+
+        # Make sure the archive can be read back before removing anything
+        temp_file.seek(0)
+        with ZipFile(temp_file) as zip_file:
+            corrupted = zip_file.testzip()
+            if corrupted is not None:
+                raise ArchiveError("Corrupted archive member: %s" % corrupted)
+
+        temp_file.seek(0)
+        name = "projects/%s/%s-%s.zip" % (project.owner_id, project.pk, uuid.uuid4().hex)
+        name = archive_storage.save(name, File(temp_file))
+
+    archived = now()
+    updated = Project.objects.filter(
+        pk=project.pk, status__in=Project.ALL_DONE, archived__isnull=True,
+    ).update(archive=name, archived=archived)
+    if not updated:
+        logger.info("Project %s changed while it was archived", project.pk)
+        archive_storage.delete(name)
+        return 0
+
+    project.archive = name
+    project.archived = archived
+    for archived_name in archived_names:
+        private_storage.delete(archived_name)
+    return len(archived_names)
+
+
+def open_archive(project):
+    """
+    The ZipFile with the archived Tracks of a Project, or None if it's not archived.
+    """
+    if not project.archive:
+        return None
+    return ZipFile(archive_storage.open(project.archive))
+
+
+def restore_project(project):
+    """
+    Extract the archived Track files of a Project back to private storage.
+    Files of Tracks that were deleted in the meantime are not restored.
+    The Project is cleared and its archive queued for delete_archives() in one
+    transaction, so the archive is only removed once no row points to it.
+    Returns the number of restored files.
+    """
+    if not project.archived:
+        return 0
+
+    names = archived_track_names(project)
+    restored = 0
+    if project.archive and archive_storage.exists(project.archive):
+        with open_archive(project) as zip_file:
+            for info in zip_file.infolist():
+                if info.filename not in names or private_storage.exists(info.filename):
+                    continue
+                # Names are unique, so the storage keeps them unchanged
+                private_storage.save(info.filename, File(zip_file.open(info)))
+                restored += 1
+    elif not all(private_storage.exists(name) for name in names):
+        raise ArchiveError("Archive %s not found" % project.archive)
+
+    with transaction.atomic():
+        cleared = Project.objects.filter(pk=project.pk, archive=project.archive).update(
+            archive="", archived=None)
+        if cleared and project.archive:
+            delete_archives.delay([project.archive])
+    project.archive = ""
+    project.archived = None
+    return restored
+
+
+@job()
+def restore_projects(pks):
+    """
+    Restore the archived Projects among pks. Queued by Project.save() and
+    ProjectQuerySet.set_status() when a Project waits for files again, so it
+    only runs if the status change commits.
+    """
+    for project in Project.objects.filter(pk__in=pks, archived__isnull=False):
+        restore_project(project)
+
+
+@job()
+def delete_archives(names):
+    """
+    Remove the archives of deleted and restored Projects. Empty names are
+    ignored. Queued by Project.delete() and restore_project(), so it runs in
+    the job worker once no row points to the archives anymore.
+    """
+    for name in names:
+        if name:
+            archive_storage.delete(name)
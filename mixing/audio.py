@@ -0,0 +1,140 @@
+from __future__ import unicode_literals, absolute_import, division
+
+import math
+import struct
+from collections import namedtuple
+
+
+class AudioInfo(namedtuple("AudioInfo", [
+        "format", "sample_rate", "bit_depth", "channels", "frames",
+        "data_offset", "big_endian", "float_samples"])):
+    """
+    Properties of an audio file.
+    data_offset is the position of the first PCM sample (None for FLAC).
+    """
+    __slots__ = ()
+
+    @property
+    def duration(self):
+        if not self.sample_rate:
+            return None
+        return self.frames / self.sample_rate
+
+
+class AudioFormatError(ValueError):
+    pass
+
+
+# WAV format tags
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_exact(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise AudioFormatError("Unexpected end of file")
+    return data
+
+
+def iter_chunks(f, start, endian):
+    """
+    Yields (chunk ID, chunk size, data position) for IFF-style files.
+    Chunks are skipped with seek(), so large data chunks are never read.
+    """
+    position = start
+    while True:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        chunk_id, size = struct.unpack(endian + "4sI", header)
+        yield chunk_id, size, position + 8
+        position += 8 + size + (size % 2)  # Chunks are padded to even sizes
+
+
+def parse_wav(f):
+    fmt = None
+    for chunk_id, size, position in iter_chunks(f, 12, "<"):
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", read_exact(f, 16))
+            format_tag = fmt[0]
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                # The actual format tag is the start of the SubFormat GUID
+                format_tag, = struct.unpack("<8xH", read_exact(f, 10))
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise AudioFormatError("Missing fmt chunk")
+            _, channels, sample_rate, _, block_align, bit_depth = fmt
+            frames = size // block_align if block_align else 0
+            return AudioInfo(
+                "wav", sample_rate, bit_depth, channels, frames, position, False,
+                format_tag == WAVE_FORMAT_IEEE_FLOAT)
+    raise AudioFormatError("Missing data chunk")
+
+
+def extended_to_float(data):
+    """
+    Convert an 80 bit IEEE 754 extended float (used by AIFF) to a float.
+    """
+    exponent, mantissa = struct.unpack(">HQ", data)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * math.ldexp(mantissa, exponent - 16383 - 63)
+
+
+def parse_aiff(f, compressed=False):
+    comm = None
+    for chunk_id, size, position in iter_chunks(f, 12, ">"):
+        if chunk_id == b"COMM":
+            channels, frames, bit_depth = struct.unpack(">hIh", read_exact(f, 8))
+            sample_rate = int(round(extended_to_float(read_exact(f, 10))))
+            # AIFF-C stores little endian samples with the "sowt" compression type
+            compression = read_exact(f, 4) if compressed else b"NONE"
+            big_endian = compression != b"sowt"
+            float_samples = compression in (b"fl32", b"FL32", b"fl64", b"FL64")
+            comm = (channels, frames, bit_depth, sample_rate, big_endian, float_samples)
+        elif chunk_id == b"SSND":
+            if comm is None:
+                raise AudioFormatError("Missing COMM chunk")
+            offset, _ = struct.unpack(">II", read_exact(f, 8))
+            channels, frames, bit_depth, sample_rate, big_endian, float_samples = comm
+            return AudioInfo(
+                "aiff", sample_rate, bit_depth, channels, frames,
+                position + 8 + offset, big_endian, float_samples)
+    raise AudioFormatError("Missing SSND chunk")
+
+
+def parse_flac(f):
+    # The first metadata block is always STREAMINFO
+    block_type = ord(read_exact(f, 4)[0:1]) & 0x7F
+    if block_type != 0:
+        raise AudioFormatError("Missing STREAMINFO block")
+    info = read_exact(f, 34)
+    packed, = struct.unpack(">Q", info[10:18])
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bit_depth = ((packed >> 36) & 0x1F) + 1
+    frames = packed & 0xFFFFFFFFF
+    return AudioInfo(
+        "flac", sample_rate, bit_depth, channels, frames, None, True, False)
+
+
+def read_audio_info(f):
+    """
+    Parse the header of a WAV, AIFF or FLAC file.
+    Only the header chunks are read, the audio data is skipped with seek().
+    Raises AudioFormatError if the file isn't in one of these formats.
+    """
+    f.seek(0)
+    magic = f.read(12)
+    if magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+        return parse_wav(f)
+    if magic[:4] == b"FORM" and magic[8:12] in (b"AIFF", b"AIFC"):
+        return parse_aiff(f, compressed=magic[8:12] == b"AIFC")
+    if magic[:4] == b"fLaC":
+        f.seek(4)
+        return parse_flac(f)
+    raise AudioFormatError("Unsupported audio format")
@@ -0,0 +1,162 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.db import models, transaction
+from django.db.models import Count
+
+from .files import queue_file_deletion
+from .models import Project, Song, Group, Track, Comment, FinalFile
+from .purchases.models import refund_track_credit
+from .search import update_search_index
+from .track_browser import invalidate_track_browser, invalidate_tracks
+from .usage import add_storage_usage, project_usage
+
+
+# The post_delete receivers that delete_tracks() and delete_attachments() do
+# the work of in bulk, by model. BulkDeleteTests fails when one is added.
+BULK_RECEIVERS = {
+    Track: (
+        "mixing.models.queue_files_on_delete",
+        "mixing.models.update_usage_on_delete",
+        "mixing.models.invalidate_track_browser_on_change",
+        "mixing.models.update_search_index_on_change",
+        "mixing.purchases.models.increase_track_credit_on_track_delete",
+    ),
+    Comment: (
+        "mixing.models.queue_files_on_delete",
+        "mixing.models.update_usage_on_delete",
+        "mixing.models.update_search_index_on_change",
+    ),
+    FinalFile: (
+        "mixing.models.queue_files_on_delete",
+        "mixing.models.update_usage_on_delete",
+    ),
+}
+
+
+def file_field_names(model):
+    return [f.name for f in model._meta.fields if isinstance(f, models.FileField)]
+
+
+def delete_rows(queryset):
+    """
+    Delete the rows of a queryset with a single DELETE, without loading them
+    or sending pre_delete and post_delete, so the callers must do the work of
+    the BULK_RECEIVERS themselves. queryset.delete() would send post_delete
+    for every row as soon as a model has receivers.
+    QuerySet._raw_delete() is private API of Django 1.8, the fast delete of
+    its Collector. This is the only place it is used, and BulkDeleteTests
+    pins the Django version it was checked against.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_tracks(tracks):
+    """
+    Delete a queryset of Tracks without sending the per-Track signals.
+    Credits and storage usage are updated with one UPDATE per owner and Project,
+    and the files are queued for deletion instead of being removed by django-cleanup.
+    Returns the number of deleted Tracks.
+    """
+    pks = list(tracks.values_list("pk", flat=True))
+    if not pks:
+        return 0
+    tracks = Track.objects.filter(pk__in=pks)
+
+    with transaction.atomic():
+        owners = (tracks.order_by()
+                  .values_list("group__song__project__owner")
+                  .annotate(count=Count("pk")))
+        for owner_id, count in owners:
+            refund_track_credit(owner_id, count)
+        add_storage_usage(dict(
+            (pk, -total) for pk, total in project_usage(tracks).items()))
+        invalidate_tracks(tracks)
+        project_ids = list(tracks.order_by().values_list(
+            "group__song__project", flat=True).distinct())
+        for field in file_field_names(Track):
+            queue_file_deletion(tracks.values_list(field, flat=True))
+        delete_rows(tracks)
+        update_search_index(project_ids)
+
+    return len(pks)
+
+
+def delete_attachments(queryset):
+    """
+    Delete a queryset of Comments or FinalFiles without sending per-object
+    signals, queueing all their files for deletion at once.
+    """
+    model = queryset.model
+    pks = list(queryset.values_list("pk", flat=True))
+    queryset = model.objects.filter(pk__in=pks)
+
+    with transaction.atomic():
+        usage = project_usage(queryset)
+        add_storage_usage(dict((pk, -total) for pk, total in usage.items()))
+        for field in file_field_names(model):
+            queue_file_deletion(queryset.values_list(field, flat=True))
+        delete_rows(queryset)
+        if model is Comment:  # FinalFiles aren't part of the SearchDocuments
+            update_search_index(usage)
+    return len(pks)
+
+
+def delete_project_contents(projects):
+    """
+    Delete everything that stores files in a queryset of Projects.
+    Used before deleting the Projects themselves, which leaves only
+    Songs and Groups for Django's cascade.
+    """
+    with transaction.atomic():
+        delete_tracks(Track.objects.filter(group__song__project__in=projects))
+        delete_attachments(Comment.objects.filter(project__in=projects))
+        delete_attachments(FinalFile.objects.filter(project__in=projects))
+
+
+def delete_objects(queryset):
+    """
+    Delete a queryset of Songs, Groups, or Tracks in a single transaction.
+    Tracks contained in Songs and Groups are removed via delete_tracks().
+    """
+    model = queryset.model
+    if model is Track:
+        return delete_tracks(queryset)
+
+    lookup = {"song": "group__song__in", "group": "group__in"}[model._meta.model_name]
+    pks = list(queryset.values_list("pk", flat=True))
+    with transaction.atomic():
+        delete_tracks(Track.objects.filter(**{lookup: pks}))
+        model.objects.filter(pk__in=pks).delete()
+    return len(pks)
+
+
+def move_objects(queryset, field, target):
+    """
+    Reassign all Songs, Groups or Tracks in queryset to a new parent
+    (a Project, Song or Group respectively) with a single UPDATE.
+    The storage usage of the Tracks moves to the Project of the new parent.
+    """
+    model = queryset.model
+    pks = list(queryset.values_list("pk", flat=True))
+    lookup = {Song: "group__song__in", Group: "group__in", Track: "pk__in"}[model]
+    if isinstance(target, Project):
+        target_project_id = target.pk
+    elif isinstance(target, Song):
+        target_project_id = target.project_id
+    else:
+        target_project_id = target.song.project_id
+
+    with transaction.atomic():
+        usage = project_usage(Track.objects.filter(**{lookup: pks}))
+        changes = dict((pk, -total) for pk, total in usage.items())
+        changes[target_project_id] = changes.get(target_project_id, 0) + sum(usage.values())
+        add_storage_usage(changes)
+
+        project_lookup = {Song: "project", Group: "song__project", Track: "group__song__project"}
+        source_projects = model.objects.filter(pk__in=pks).values_list(
+            project_lookup[model], flat=True)
+        project_ids = list(source_projects) + [target_project_id]
+        invalidate_track_browser(project_ids)
+        moved = model.objects.filter(pk__in=pks).update(**{field: target})
+        update_search_index(project_ids)
+        return moved
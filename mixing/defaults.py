@@ -17,6 +17,13 @@ register_setting(
     default="",
 )
 
+register_setting(
+    name="STRIPE_WEBHOOK_SECRET",
+    label="Stripe webhook signing secret",
+    editable=True,
+    default="",
+)
+
 register_setting(
     name="PURCHASE_CREDIT_PRICE",
     label="Credit price",
@@ -25,6 +32,22 @@ register_setting(
     default=10,
 )
 
+register_setting(
+    name="ARCHIVE_AFTER_DAYS",
+    label="Archive completed projects after (days)",
+    description="Tracks of completed projects that haven't been updated in this "
+                "many days are moved to the archive storage",
+    editable=True,
+    default=90,
+)
+
+register_setting(
+    name="PREVIEW_ENCODERS",
+    description="Preview encoder classes, the first available one is used",
+    editable=False,
+    default=("mixing.encoders.FFmpegEncoder", "mixing.encoders.WavEncoder"),
+)
+
 register_setting(
     name="TEMPLATE_ACCESSIBLE_SETTINGS",
     default=("PURCHASE_CREDIT_PRICE", "STRIPE_PK"),
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals, absolute_import, division
+
+import abc
+import subprocess
+import wave
+from distutils.spawn import find_executable
+
+import numpy as np
+
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from mezzanine.conf import settings
+
+from .audio import read_audio_info
+from .waveform import sample_view, to_float, BLOCK_FRAMES
+
+
+class EncoderError(Exception):
+    pass
+
+
+@six.add_metaclass(abc.ABCMeta)
+class PreviewEncoder(object):
+    """
+    Converts an audio file into a small preview for in-browser playback.
+    Subclasses are listed in the PREVIEW_ENCODERS setting and must implement encode().
+    """
+    extension = None
+    content_type = None
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    @abc.abstractmethod
+    def encode(self, source, destination):
+        """
+        Read the audio file at path `source` and write the preview to `destination`.
+        Raises EncoderError if the source can't be converted.
+        """
+
+
+class FFmpegEncoder(PreviewEncoder):
+    """
+    Stereo MP3 preview, encoded by the ffmpeg binary.
+    Reads every format ffmpeg supports, FLAC included.
+    """
+    extension = "mp3"
+    content_type = "audio/mpeg"
+    bitrate = "96k"
+
+    @classmethod
+    def is_available(cls):
+        return find_executable("ffmpeg") is not None
+
+    def encode(self, source, destination):
+        command = [
+            "ffmpeg", "-v", "error", "-nostdin", "-y", "-i", source,
+            "-vn", "-ac", "2", "-b:a", self.bitrate, "-f", "mp3", destination,
+        ]
+        try:
+            subprocess.check_output(command, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise EncoderError("ffmpeg failed: %s" % getattr(e, "output", e))
+
+
+class WavEncoder(PreviewEncoder):
+    """
+    Mono 16 bit WAV at about 22 kHz, computed with NumPy.
+    Much larger than an MP3, but doesn't need any external programs.
+    Only supports the WAV and AIFF files mixing.waveform can read.
+    """
+    extension = "wav"
+    content_type = "audio/wav"
+    target_rate = 22050
+
+    def encode(self, source, destination):
+        try:
+            with open(source, "rb") as f:
+                info = read_audio_info(f)
+            samples, scale = sample_view(source, info)
+        except ValueError as e:  # AudioFormatError, PeakFormatError
+            raise EncoderError(str(e))
+
+        # Average every `factor` frames, which doubles as a crude low-pass filter
+        factor = max(1, info.sample_rate // self.target_rate)
+        block_frames = BLOCK_FRAMES - BLOCK_FRAMES % factor
+
+        output = wave.open(destination, "wb")
+        try:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(info.sample_rate // factor)
+            for start in range(0, len(samples), block_frames):
+                block = to_float(samples[start:start + block_frames], info, scale)
+                block = block[:len(block) - len(block) % factor]
+                mono = block.mean(axis=1).reshape(-1, factor).mean(axis=1)
+                pcm = np.clip(np.round(mono * 32767), -32768, 32767).astype("<i2")
+                output.writeframes(pcm.tobytes())
+        finally:
+            output.close()
+
+
+def get_preview_encoder():
+    """
+    An instance of the first available encoder in settings.PREVIEW_ENCODERS.
+    """
+    for path in settings.PREVIEW_ENCODERS:
+        encoder_class = import_string(path)
+        if encoder_class.is_available():
+            return encoder_class()
+    raise EncoderError("No preview encoder is available")
@@ -0,0 +1,151 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import re
+
+from django.apps import apps
+from django.db import models
+
+from utils import display_filename, has_local_path
+from utils.uploads import file_checksum
+
+from .models import Comment, FinalFile, StaleFile, Track
+from .storage import private_storage
+
+
+def file_fields():
+    """
+    Yields (model, field name) for every file field in the mixing app.
+    """
+    for model in apps.get_app_config("mixing").get_models():
+        for field in model._meta.fields:
+            if isinstance(field, models.FileField):
+                yield model, field.name
+
+
+def referenced_names(names):
+    """
+    The subset of names that are still stored in a file field of some object.
+    """
+    referenced = set()
+    for model, field in file_fields():
+        lookup = {"%s__in" % field: names}
+        referenced.update(
+            model.objects.filter(**lookup).values_list(field, flat=True))
+    return referenced
+
+
+# The model and field of the uploads of each section of private storage,
+# see mixing.permissions.sharded_path()
+UPLOAD_SECTIONS = {
+    "tracks": (Track, "file"),
+    "comments": (Comment, "attachment"),
+    "finals": (FinalFile, "attachment"),
+}
+
+
+def uploaded_filename(model, field, name):
+    return (model.objects.filter(**{field: name})
+            .values_list("filename", flat=True).first())
+
+
+def original_filename(name):
+    """
+    The filename a private file was uploaded with, looked up by its stored name
+    in the field of its section. Previews are named after the upload they were
+    encoded from, with their own extension.
+    """
+    section = name.split("/", 1)[0]
+    if section == "previews":
+        for model in (Track, FinalFile):
+            filename = uploaded_filename(model, "preview", name)
+            if filename:
+                return "%s-preview%s" % (
+                    os.path.splitext(filename)[0], os.path.splitext(name)[1])
+    elif section in UPLOAD_SECTIONS:
+        model, field = UPLOAD_SECTIONS[section]
+        filename = uploaded_filename(model, field, name)
+        if filename:
+            return filename
+    return display_filename(name)
+
+
+def queue_file_deletion(names):
+    """
+    Schedule files in private storage to be removed by sweep_stale_files().
+    Empty names (e.g. Comments without attachment) are ignored.
+    """
+    StaleFile.objects.bulk_create([StaleFile(name=name) for name in names if name])
+
+
+# Names built by mixing.permissions.sharded_path(), with the two shard directories
+SHARDED_NAME = re.compile(r"^[^/]+/\d+/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$")
+
+
+def remove_empty_shards(name):
+    """
+    Remove the ab/cd directories of a deleted file when nothing else is left
+    in them, so the sharded tree doesn't keep thousands of empty directories.
+    Object storages have no directories to remove.
+    """
+    if not SHARDED_NAME.match(name) or not has_local_path(private_storage):
+        return
+    directory = os.path.dirname(private_storage.path(name))
+    for _ in range(2):
+        try:
+            os.rmdir(directory)
+        except OSError:  # Not empty, or already gone
+            return
+        directory = os.path.dirname(directory)
+
+
+def sweep_stale_files(batch_size=100):
+    """
+    Remove a batch of queued files from private storage.
+    Files that are still referenced by an object (e.g. a Track that has been
+    re-uploaded with the same name) are left alone.
+    Returns a (files removed, bytes reclaimed) tuple, or None if the queue is empty.
+    """
+    stale_files = list(StaleFile.objects.order_by("pk")[:batch_size])
+    if not stale_files:
+        return None
+
+    names = set(f.name for f in stale_files)
+    names -= referenced_names(names)
+
+    removed = reclaimed = 0
+    for name in names:
+        try:
+            size = private_storage.size(name)
+        except OSError:  # Already gone
+            continue
+        private_storage.delete(name)
+        remove_empty_shards(name)
+        removed += 1
+        reclaimed += size
+
+    StaleFile.objects.filter(pk__in=[f.pk for f in stale_files]).delete()
+    return removed, reclaimed
+
+
+# Results of verify_checksum()
+CHECKSUM_OK = "ok"
+CHECKSUM_NEW = "new"
+CHECKSUM_MISMATCH = "mismatch"
+CHECKSUM_MISSING = "missing"
+
+
+def verify_checksum(name, checksum, throttle=None):
+    """
+    Hash a file in private storage and compare it with its stored checksum.
+    Returns (result, actual checksum), where result is one of the CHECKSUM_* constants.
+    CHECKSUM_NEW means there was no stored checksum to compare with.
+    """
+    try:
+        with private_storage.open(name) as f:
+            actual = file_checksum(f, throttle=throttle)
+    except (IOError, OSError):
+        return CHECKSUM_MISSING, None
+    if not checksum:
+        return CHECKSUM_NEW, actual
+    return (CHECKSUM_OK if actual == checksum else CHECKSUM_MISMATCH), actual
@@ -0,0 +1,31 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.contrib import admin
+from django.utils.timezone import now
+
+from .models import Job
+
+
+def retry_jobs(modeladmin, request, queryset):
+    """
+    Queue the selected Jobs again, with a fresh set of attempts.
+    """
+    updated = queryset.exclude(status=Job.STATUS_RUNNING).update(
+        status=Job.STATUS_PENDING, run_at=now(), attempts=0, finished=None)
+    modeladmin.message_user(request, "%d jobs queued again" % updated)
+retry_jobs.short_description = "Retry selected jobs"
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["name", "status", "attempts", "run_at", "created", "finished"]
+    list_filter = ["status", "name"]
+    search_fields = ["name", "key"]
+    date_hierarchy = "created"
+    actions = [retry_jobs]
+    readonly_fields = [
+        "name", "arguments", "key", "status", "attempts", "max_attempts",
+        "run_at", "created", "started", "finished", "error"]
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,30 @@
+from __future__ import unicode_literals, absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from mixing.jobs.queue import prune_jobs, requeue_stale_jobs, run_due_jobs
+
+
+class Command(BaseCommand):
+    help = "Run the queued background jobs that are due."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop", action="store_true", default=False,
+            help="Keep running and check the queue periodically")
+        parser.add_argument(
+            "--interval", type=int, default=5,
+            help="Seconds to wait between checks when running with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            requeue_stale_jobs()
+            succeeded, failed = run_due_jobs()
+            prune_jobs()
+            if succeeded or failed or not options["loop"]:
+                self.stdout.write("Ran %d jobs, %d failed" % (succeeded + failed, failed))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
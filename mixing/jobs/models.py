@@ -0,0 +1,48 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.timezone import now
+
+
+@python_2_unicode_compatible
+class Job(models.Model):
+    """
+    A call of a function decorated with mixing.jobs.queue.job(), stored to be
+    run by the run_jobs worker outside of the request.
+    """
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    name = models.CharField("Function", max_length=255, db_index=True)
+    arguments = models.TextField("Arguments", default="{}")
+    key = models.CharField(
+        "Idempotency key", max_length=255, unique=True, null=True, blank=True)
+    status = models.PositiveSmallIntegerField(
+        "Status", choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField("Attempts", default=0)
+    max_attempts = models.PositiveSmallIntegerField("Max attempts", default=5)
+    run_at = models.DateTimeField("Run at", default=now)
+    created = models.DateTimeField("Created", auto_now_add=True)
+    started = models.DateTimeField("Started", null=True)
+    finished = models.DateTimeField("Finished", null=True)
+    error = models.TextField("Last error", blank=True)
+
+    class Meta:
+        verbose_name = "job"
+        verbose_name_plural = "jobs"
+        ordering = ["-created"]
+        # Workers look for due jobs with status=STATUS_PENDING, run_at <= now
+        index_together = [("status", "run_at")]
+
+    def __str__(self):
+        return self.name
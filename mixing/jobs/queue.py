@@ -0,0 +1,169 @@
+from __future__ import unicode_literals, absolute_import
+
+import json
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from mezzanine.conf import settings
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def job(max_attempts=5, on_failure=None):
+    """
+    Decorator for functions that can be run by the worker.
+    Adds func.delay(*args, **kwargs) as a shortcut for enqueue().
+    Arguments must be JSON serializable. on_failure is called with the same
+    arguments once a Job has failed max_attempts times, to clean up after it.
+    """
+    def decorator(func):
+        func.job_max_attempts = max_attempts
+        func.job_on_failure = on_failure
+        func.delay = lambda *args, **kwargs: enqueue(func, args, kwargs)
+        return func
+    return decorator
+
+
+def job_name(func):
+    return "%s.%s" % (func.__module__, func.__name__)
+
+
+def load_job(name):
+    """
+    The function of a Job. Only functions decorated with job() can be loaded.
+    """
+    func = import_string(name)
+    if not hasattr(func, "job_max_attempts"):
+        raise ImportError("%s is not a job" % name)
+    return func
+
+
+def enqueue(func, args=(), kwargs=None, key=None, delay=0):
+    """
+    Store a call of func to be run by the worker, in `delay` seconds.
+
+    A Job with a given idempotency key is only ever created once: enqueueing the
+    same key again returns the existing Job, whatever its status.
+    Since the Job is a row in the current transaction, it's only run if the
+    transaction commits.
+    """
+    fields = {
+        "name": job_name(func),
+        "arguments": json.dumps({"args": list(args), "kwargs": kwargs or {}}),
+        "max_attempts": func.job_max_attempts,
+        "run_at": now() + timedelta(seconds=delay),
+    }
+    if key is None:
+        return Job.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(key=key, **fields)
+    except IntegrityError:
+        return Job.objects.get(key=key)
+
+
+def backoff(attempts):
+    """
+    Seconds to wait before retrying a Job that failed `attempts` times.
+    Doubles with each attempt, with some jitter so failures caused by the same
+    outage (e.g. the SMTP server) don't all retry at once.
+    """
+    delay = min(settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1), settings.JOBS_MAX_RETRY_DELAY)
+    return delay * random.uniform(1, 1.25)
+
+
+def claim_job():
+    """
+    Mark the next due Job as running and return it, or None if none is due.
+    The status is changed with a conditional UPDATE, so each Job is claimed by
+    a single worker even if several of them run at the same time.
+    """
+    while True:
+        pk = (Job.objects.filter(status=Job.STATUS_PENDING, run_at__lte=now())
+              .order_by("run_at", "pk").values_list("pk", flat=True).first())
+        if pk is None:
+            return None
+        claimed = Job.objects.filter(pk=pk, status=Job.STATUS_PENDING).update(
+            status=Job.STATUS_RUNNING, started=now(), attempts=F("attempts") + 1)
+        if claimed:
+            return Job.objects.get(pk=pk)
+
+
+def run_job(job):
+    """
+    Call the function of a claimed Job. Failed Jobs are retried later with
+    backoff() until they reach max_attempts, and then passed to the on_failure
+    handler of their function. Returns True if it succeeded.
+    """
+    func = arguments = None
+    try:
+        func = load_job(job.name)
+        arguments = json.loads(job.arguments)
+        func(*arguments.get("args", []), **arguments.get("kwargs", {}))
+    except Exception:
+        error = traceback.format_exc()
+        fields = {"error": error}
+        if job.attempts < job.max_attempts:
+            fields.update(
+                status=Job.STATUS_PENDING,
+                run_at=now() + timedelta(seconds=backoff(job.attempts)))
+        else:
+            fields.update(status=Job.STATUS_FAILED, finished=now())
+            logger.error("Job %s (%s) failed %d times\n%s", job.pk, job.name, job.attempts, error)
+        Job.objects.filter(pk=job.pk).update(**fields)
+        if "finished" in fields and arguments is not None and func.job_on_failure:
+            try:
+                func.job_on_failure(*arguments.get("args", []), **arguments.get("kwargs", {}))
+            except Exception:
+                logger.exception("Failure handler of Job %s (%s) failed", job.pk, job.name)
+        return False
+
+    Job.objects.filter(pk=job.pk).update(status=Job.STATUS_DONE, finished=now(), error="")
+    return True
+
+
+def run_due_jobs(limit=None):
+    """
+    Run due Jobs until there are none left, or `limit` of them ran.
+    Returns a (succeeded, failed) tuple.
+    """
+    succeeded = failed = 0
+    while limit is None or succeeded + failed < limit:
+        job = claim_job()
+        if job is None:
+            break
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+def requeue_stale_jobs():
+    """
+    Return Jobs that have been running for longer than JOBS_TIMEOUT to the
+    queue, e.g. after a worker was killed. Their attempt still counts.
+    """
+    stale = Job.objects.filter(
+        status=Job.STATUS_RUNNING,
+        started__lt=now() - timedelta(seconds=settings.JOBS_TIMEOUT))
+    return stale.update(status=Job.STATUS_PENDING, run_at=now())
+
+
+def prune_jobs():
+    """
+    Delete successful Jobs older than JOBS_KEEP_DAYS. Failed Jobs are kept
+    for the admin, and Jobs with an idempotency key so the key stays taken.
+    """
+    Job.objects.filter(
+        status=Job.STATUS_DONE, key__isnull=True,
+        finished__lt=now() - timedelta(days=settings.JOBS_KEEP_DAYS)).delete()
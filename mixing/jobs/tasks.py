@@ -0,0 +1,13 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.core import mail
+
+from .queue import job
+
+
+@job(max_attempts=10)
+def mail_admins(subject, message, html_message=None):
+    """
+    Send an email to the ADMINS. Errors are raised so the Job is retried.
+    """
+    mail.mail_admins(subject, message, html_message=html_message)
@@ -0,0 +1,152 @@
+from __future__ import unicode_literals, absolute_import
+
+import json
+from datetime import timedelta
+from StringIO import StringIO
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils.timezone import now
+
+from utils import notify_exception
+
+from .models import Job
+from .queue import claim_job, enqueue, job, prune_jobs, requeue_stale_jobs, run_due_jobs
+
+calls = []
+failures = []
+
+
+def record_failure(value, fail=False):
+    failures.append(value)
+
+
+@job(max_attempts=3, on_failure=record_failure)
+def record(value, fail=False):
+    calls.append(value)
+    if fail:
+        raise ValueError("Failed %s" % value)
+
+
+def not_a_job():
+    pass
+
+
+@override_settings(ADMINS=[("Admin", "admin@example.com")])
+class JobTests(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        del failures[:]
+
+    def make_due(self):
+        Job.objects.filter(status=Job.STATUS_PENDING).update(run_at=now())
+
+    def test_enqueue_and_run(self):
+        first = record.delay(1)
+        enqueue(record, [2], delay=60)
+        self.assertEqual(first.name, "mixing.jobs.tests.record")
+        self.assertEqual(json.loads(first.arguments), {"args": [1], "kwargs": {}})
+
+        self.assertEqual(run_due_jobs(), (1, 0))
+        self.assertEqual(calls, [1])
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), (Job.STATUS_DONE, 1))
+        self.assertIsNotNone(first.finished)
+
+        # Nothing else is due yet
+        self.assertEqual(run_due_jobs(), (0, 0))
+        self.make_due()
+        self.assertEqual(run_due_jobs(), (1, 0))
+        self.assertEqual(calls, [1, 2])
+
+    def test_retries(self):
+        failing = record.delay(1, fail=True)
+        self.assertEqual(run_due_jobs(), (0, 1))
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Job.STATUS_PENDING, 1))
+        self.assertIn("ValueError: Failed 1", failing.error)
+        self.assertEqual(failures, [])
+        first_delay = failing.run_at - now()
+        self.assertGreater(first_delay, timedelta(seconds=20))
+
+        # The delay doubles with each attempt
+        self.make_due()
+        run_due_jobs()
+        failing.refresh_from_db()
+        self.assertGreater(failing.run_at - now(), first_delay + timedelta(seconds=20))
+
+        self.make_due()
+        run_due_jobs()
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Job.STATUS_FAILED, 3))
+        self.assertEqual(calls, [1, 1, 1])
+        # The failure handler runs once, with the Job's arguments
+        self.assertEqual(failures, [1])
+        self.make_due()
+        self.assertEqual(run_due_jobs(), (0, 0))
+
+    def test_idempotency_key(self):
+        first = enqueue(record, [1], key="charge:1")
+        second = enqueue(record, [2], key="charge:1")
+        self.assertEqual(first, second)
+        run_due_jobs()
+        self.assertEqual(enqueue(record, [3], key="charge:1"), first)
+        self.assertEqual(run_due_jobs(), (0, 0))
+        self.assertEqual(calls, [1])
+
+    def test_claimed_once(self):
+        record.delay(1)
+        claimed = claim_job()
+        self.assertEqual(claimed.status, Job.STATUS_RUNNING)
+        self.assertIsNone(claim_job())
+
+        # A worker that died while running it
+        Job.objects.filter(pk=claimed.pk).update(started=now() - timedelta(days=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(claim_job().attempts, 2)
+
+    def test_only_decorated_functions(self):
+        bogus = Job.objects.create(name="mixing.jobs.tests.not_a_job", max_attempts=1)
+        self.assertEqual(run_due_jobs(), (0, 1))
+        bogus.refresh_from_db()
+        self.assertEqual(bogus.status, Job.STATUS_FAILED)
+        self.assertIn("is not a job", bogus.error)
+
+    def test_prune(self):
+        done = record.delay(1)
+        keyed = enqueue(record, [2], key="keep")
+        run_due_jobs()
+        Job.objects.update(finished=now() - timedelta(days=30))
+        prune_jobs()
+        self.assertEqual(list(Job.objects.values_list("pk", flat=True)), [keyed.pk])
+        self.assertNotEqual(done.pk, keyed.pk)
+
+    def test_notify_exception(self):
+        request = RequestFactory().get("/")
+        try:
+            raise ValueError("Payment failed")
+        except ValueError as e:
+            notify_exception(request, e)
+        self.assertEqual(mail.outbox, [])
+
+        out = StringIO()
+        call_command("run_jobs", stdout=out)
+        self.assertIn("Ran 1 jobs, 0 failed", out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("Payment failed", mail.outbox[0].subject)
+
+    def test_smtp_errors_are_retried(self):
+        from .tasks import mail_admins
+        mail_admins.delay("Subject", "Message")
+        with mock.patch("django.core.mail.mail_admins", side_effect=IOError("No SMTP")):
+            self.assertEqual(run_due_jobs(), (0, 1))
+        self.make_due()
+        self.assertEqual(run_due_jobs(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
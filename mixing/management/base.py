@@ -0,0 +1,100 @@
+from __future__ import unicode_literals, absolute_import
+
+import multiprocessing
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mixing.models import Track, FinalFile, DERIVED_FILES
+from mixing.processing import (
+    pool_item, compute_peaks_for, save_peaks, encode_preview_for, save_preview)
+
+MODELS = {model._meta.model_name: model for model in (Track, FinalFile)}
+
+# The worker (called in a pool of processes) and save function (called with
+# the worker's output in this process) of each field in DERIVED_FILES
+PROCESSORS = {
+    "peaks": (compute_peaks_for, save_peaks),
+    "preview": (encode_preview_for, save_preview),
+}
+
+
+class DerivedFileCommand(BaseCommand):
+    """
+    Base for commands that create a file from every uploaded Track and FinalFile.
+    Subclasses define field, one of the keys of PROCESSORS.
+    """
+    field = None
+    message = "Processed %d files"
+
+    def __init__(self, *args, **kwargs):
+        if self.field not in PROCESSORS:
+            raise ImproperlyConfigured("Unknown derived file field: %r" % self.field)
+        super(DerivedFileCommand, self).__init__(*args, **kwargs)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=multiprocessing.cpu_count(),
+            help="Number of worker processes (1 runs everything in this process)")
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="Number of files fetched from the database at once")
+        parser.add_argument(
+            "--all", action="store_true", default=False,
+            help="Process all files again, not just the new ones")
+        parser.add_argument(
+            "--loop", action="store_true", default=False,
+            help="Keep running and check for new files periodically")
+        parser.add_argument(
+            "--interval", type=int, default=30,
+            help="Seconds to wait between checks when running with --loop")
+
+    def handle(self, *args, **options):
+        pool = None
+        if options["workers"] > 1:
+            # Forked workers must not share the parent's database connections
+            for connection in connections.all():
+                connection.close()
+            pool = multiprocessing.Pool(options["workers"])
+
+        try:
+            while True:
+                processed = sum(self.process(model, pool, options) for model in MODELS.values())
+                if processed or not options["loop"]:
+                    self.stdout.write(self.message % processed)
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def process(self, model, pool, options):
+        source = model.PEAKS_SOURCE
+        queryset = model.objects.exclude(**{source: ""}).order_by("pk")
+        if not options["all"]:
+            timestamp_field = dict(DERIVED_FILES)[self.field]
+            queryset = queryset.filter(**{"%s__isnull" % timestamp_field: True})
+
+        processed = last_pk = 0
+        while True:
+            objects = list(queryset.filter(pk__gt=last_pk).only(
+                "pk", source)[:options["batch_size"]])
+            if not objects:
+                return processed
+            last_pk = objects[-1].pk
+
+            items = [pool_item(obj) for obj in objects]
+            worker, save = PROCESSORS[self.field]
+            if pool is not None:
+                results = pool.imap_unordered(worker, items)
+            else:
+                results = map(worker, items)
+
+            # Workers only compute, the database is updated from this process
+            for label, pk, name, result in results:
+                save(MODELS[label], pk, name, result)
+                processed += 1
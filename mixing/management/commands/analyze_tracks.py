@@ -0,0 +1,55 @@
+from __future__ import unicode_literals, absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils.pool import run_in_threads
+
+from mixing.models import Track
+from mixing.processing import analyze_track
+
+
+class Command(BaseCommand):
+    help = "Read sample rate, bit depth, channels and duration of uploaded Tracks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Number of Tracks analyzed at the same time")
+        parser.add_argument(
+            "--batch-size", type=int, default=200,
+            help="Number of Tracks fetched from the database at once")
+        parser.add_argument(
+            "--all", action="store_true", default=False,
+            help="Analyze all Tracks again, not just the new ones")
+        parser.add_argument(
+            "--loop", action="store_true", default=False,
+            help="Keep running and check for new Tracks periodically")
+        parser.add_argument(
+            "--interval", type=int, default=30,
+            help="Seconds to wait between checks when running with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            analyzed = self.analyze(options)
+            if analyzed or not options["loop"]:
+                self.stdout.write("Analyzed %d tracks" % analyzed)
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def analyze(self, options):
+        queryset = Track.objects.order_by("pk")
+        if not options["all"]:
+            queryset = queryset.filter(analyzed__isnull=True)
+
+        analyzed = last_pk = 0
+        while True:
+            pks = list(queryset.filter(pk__gt=last_pk).values_list(
+                "pk", flat=True)[:options["batch_size"]])
+            if not pks:
+                return analyzed
+            last_pk = pks[-1]
+            run_in_threads(analyze_track, pks, workers=options["workers"])
+            analyzed += len(pks)
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from mixing.archive import archive_project, projects_to_archive, ArchiveError
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the Tracks of completed Projects that have been idle for "
+        "ARCHIVE_AFTER_DAYS days into archives in ARCHIVE_STORAGE_ROOT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help="Idle days before archiving (defaults to ARCHIVE_AFTER_DAYS)")
+        parser.add_argument(
+            "--loop", action="store_true", default=False,
+            help="Keep running and check for idle Projects periodically")
+        parser.add_argument(
+            "--interval", type=int, default=60 * 60,
+            help="Seconds to wait between checks when running with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            projects = files = 0
+            for project in projects_to_archive(options["days"]).order_by("pk"):
+                try:
+                    files += archive_project(project)
+                except (ArchiveError, IOError, OSError):
+                    logger.exception("Could not archive project %s", project.pk)
+                    continue
+                projects += 1
+            if projects or not options["loop"]:
+                self.stdout.write("Archived %d projects (%d files)" % (projects, files))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,16 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.core.management.base import BaseCommand
+
+from utils.metrics import remove_stale_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove the stats files of processes that have exited from PERF_STATS_DIR. "
+        "Runs before gunicorn starts, so scrapes don't read more files with every restart."
+    )
+
+    def handle(self, *args, **options):
+        removed = remove_stale_files()
+        self.stdout.write("Removed %d stats files" % removed)
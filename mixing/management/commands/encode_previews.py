@@ -0,0 +1,12 @@
+from __future__ import unicode_literals, absolute_import
+
+from mixing.management.base import DerivedFileCommand
+
+
+class Command(DerivedFileCommand):
+    help = (
+        "Encode low bitrate previews of uploaded Tracks and FinalFiles. "
+        "Files are encoded in a pool of worker processes."
+    )
+    field = "preview"
+    message = "Encoded previews for %d files"
@@ -0,0 +1,12 @@
+from __future__ import unicode_literals, absolute_import
+
+from mixing.management.base import DerivedFileCommand
+
+
+class Command(DerivedFileCommand):
+    help = (
+        "Compute waveform peaks for uploaded Tracks and FinalFiles. "
+        "Files are decoded in a pool of worker processes."
+    )
+    field = "peaks"
+    message = "Extracted peaks for %d files"
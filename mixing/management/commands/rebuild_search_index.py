@@ -0,0 +1,21 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.core.management.base import BaseCommand
+
+from mixing.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the SearchDocuments used by the Project admin search. "
+        "Needed once after the search_document migration."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of Projects rebuilt per transaction")
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index(options["batch_size"])
+        self.stdout.write("Rebuilt the search documents of %d projects" % count)
@@ -0,0 +1,27 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.core.management.base import BaseCommand
+
+from mixing.usage import SIZED_MODELS, measure_missing_sizes, reconcile_usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Record the size of files uploaded before sizes existed and fix the "
+        "storage usage counters of Projects and users that don't match them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of files measured per query")
+
+    def handle(self, *args, **options):
+        for model in SIZED_MODELS:
+            measured = measure_missing_sizes(model, options["batch_size"])
+            if measured:
+                self.stdout.write("%s: measured %d files" % (model.__name__, measured))
+
+        fixed_projects, fixed_profiles = reconcile_usage()
+        self.stdout.write("Fixed the storage usage of %d projects and %d users" % (
+            fixed_projects, fixed_profiles))
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utils import has_local_path
+from utils.pool import iter_in_threads
+from utils.throttle import TokenBucket
+
+from mixing.files import queue_file_deletion
+from mixing.scrub import partitions, scrub_partition
+from mixing.storage import private_storage
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare private storage with the database. Reports files without rows "
+        "(orphans) and rows without files (missing). With --repair, orphans "
+        "are queued for the sweep_storage command."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Number of owner directories scanned at the same time")
+        parser.add_argument(
+            "--rate", type=float, default=1000,
+            help="Maximum directory entries read per second for all workers "
+                 "(0 for no limit)")
+        parser.add_argument(
+            "--min-age", type=float, default=24,
+            help="Ignore files modified in the last MIN_AGE hours")
+        parser.add_argument(
+            "--repair", action="store_true", default=False,
+            help="Queue orphaned files for deletion")
+
+    def handle(self, *args, **options):
+        if not has_local_path(private_storage):
+            raise CommandError("Only local private storage can be scrubbed")
+        throttle = TokenBucket(options["rate"]) if options["rate"] > 0 else None
+        min_age = options["min_age"] * 60 * 60
+
+        def scrub(owner_id):
+            return scrub_partition(owner_id, throttle, min_age)
+
+        # Each owner is reported and repaired as soon as it has been scanned,
+        # so only the lists of the owners being scanned are kept in memory
+        orphan_count = missing_count = 0
+        for orphans, missing in iter_in_threads(scrub, partitions(), options["workers"]):
+            for name in orphans:
+                self.stdout.write("Orphan: %s" % name)
+            for name in missing:
+                logger.warning("Missing file: %s", name)
+                self.stdout.write("Missing: %s" % name)
+            if options["repair"]:
+                queue_file_deletion(orphans)
+            orphan_count += len(orphans)
+            missing_count += len(missing)
+
+        self.stdout.write("%d orphans%s, %d missing files" % (
+            orphan_count, " queued for deletion" if options["repair"] else "",
+            missing_count))
@@ -0,0 +1,99 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import re
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Case, When, Value, CharField
+
+from utils import has_local_path
+
+from mixing.files import file_fields
+from mixing.permissions import sharded_path
+from mixing.storage import private_storage
+
+# Paths created before sharding: /{section}/{owner ID}/{filename}
+FLAT_PATH = re.compile(r"^(?P<section>[^/]+)/(?P<owner_id>\d+)/(?P<filename>[^/]+)$")
+
+
+class Command(BaseCommand):
+    help = (
+        "Move private files from the flat /{section}/{owner ID}/ layout to "
+        "sharded directories. Safe to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of rows updated per transaction")
+
+    def handle(self, *args, **options):
+        if not has_local_path(private_storage):
+            raise CommandError("Files can only be moved in local private storage")
+        for model, field in file_fields():
+            moved, missing = self.shard(model, field, options["batch_size"])
+            self.stdout.write("%s.%s: moved %d files, %d missing" % (
+                model.__name__, field, moved, missing))
+
+    def new_name(self, model, field, pk, name):
+        """
+        The sharded name for a file, or None if it's already sharded.
+        The UUID is derived from the row, so an interrupted run produces
+        the same names when resumed.
+        """
+        match = FLAT_PATH.match(name)
+        if not match:
+            return None
+        key = "%s.%s:%s:%s" % (model._meta.app_label, model.__name__, field, pk)
+        uid = uuid.uuid5(uuid.NAMESPACE_URL, str(key)).hex
+        return sharded_path(
+            match.group("section"), match.group("owner_id"),
+            match.group("filename"), uid=uid)
+
+    def move(self, old_name, new_name):
+        """
+        Move a single file. Returns False if the file can't be found.
+        """
+        old_path = private_storage.path(old_name)
+        new_path = private_storage.path(new_name)
+        if os.path.exists(new_path):  # Moved on a previous, interrupted run
+            return True
+        if not os.path.exists(old_path):
+            return False
+        directory = os.path.dirname(new_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        os.rename(old_path, new_path)
+        return True
+
+    def shard(self, model, field, batch_size):
+        """
+        Walk all rows by primary key and update them one batch at a time.
+        """
+        moved = missing = 0
+        last_pk = 0
+        queryset = model.objects.exclude(**{field: ""}).order_by("pk")
+
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list("pk", field)[:batch_size])
+            if not rows:
+                return moved, missing
+            last_pk = rows[-1][0]
+
+            renames = {}
+            for pk, name in rows:
+                new_name = self.new_name(model, field, pk, name)
+                if new_name is None:
+                    continue
+                if self.move(name, new_name):
+                    renames[pk] = new_name
+                else:
+                    missing += 1
+
+            if renames:
+                whens = [When(pk=pk, then=Value(name)) for pk, name in renames.items()]
+                model.objects.filter(pk__in=renames.keys()).update(**{
+                    field: Case(*whens, output_field=CharField())
+                })
+                moved += len(renames)
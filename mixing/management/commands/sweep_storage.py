@@ -0,0 +1,45 @@
+from __future__ import unicode_literals, absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from mixing.files import sweep_stale_files
+
+
+class Command(BaseCommand):
+    help = "Remove files that have been queued for deletion from private storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="Number of files removed per batch")
+        parser.add_argument(
+            "--loop", action="store_true", default=False,
+            help="Keep running and check the queue periodically")
+        parser.add_argument(
+            "--interval", type=int, default=30,
+            help="Seconds to wait between checks when running with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            removed, reclaimed = self.sweep(options["batch_size"])
+            if removed or not options["loop"]:
+                self.stdout.write("Removed %d stale files (%s reclaimed)" % (
+                    removed, filesizeformat(reclaimed)))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def sweep(self, batch_size):
+        """
+        Process batches until the queue is empty.
+        """
+        removed = reclaimed = 0
+        while True:
+            result = sweep_stale_files(batch_size=batch_size)
+            if result is None:
+                return removed, reclaimed
+            removed += result[0]
+            reclaimed += result[1]
@@ -0,0 +1,87 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from utils.pool import run_in_threads
+from utils.throttle import TokenBucket
+
+from mixing.files import (
+    verify_checksum, CHECKSUM_NEW, CHECKSUM_MISMATCH, CHECKSUM_MISSING)
+from mixing.models import Track, FinalFile
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Hash uploaded Tracks and FinalFiles again and compare them with the "
+        "checksum stored at upload time, to detect corrupted files. Files "
+        "without a checksum (uploaded before checksums existed) get one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Number of files hashed at the same time")
+        parser.add_argument(
+            "--rate", type=float, default=20,
+            help="Maximum read rate in MB per second for all workers (0 for no limit)")
+        parser.add_argument(
+            "--batch-size", type=int, default=200,
+            help="Number of files fetched from the database at once")
+        parser.add_argument(
+            "--days", type=int, default=0,
+            help="Skip files that have been verified in the last DAYS days")
+
+    def handle(self, *args, **options):
+        rate = options["rate"] * 1000 * 1000
+        throttle = TokenBucket(rate) if rate > 0 else None
+
+        totals = Counter()
+        for model in (Track, FinalFile):
+            totals.update(self.verify(model, throttle, options))
+
+        self.stdout.write("Verified %d files: %d corrupted, %d missing, %d new checksums" % (
+            sum(totals.values()), totals[CHECKSUM_MISMATCH], totals[CHECKSUM_MISSING],
+            totals[CHECKSUM_NEW]))
+
+    def verify(self, model, throttle, options):
+        source = model.PEAKS_SOURCE
+        queryset = model.objects.exclude(**{source: ""}).order_by("pk")
+        if model is Track:  # Archived files are not in private storage
+            queryset = queryset.filter(group__song__project__archived__isnull=True)
+        if options["days"]:
+            cutoff = now() - timedelta(days=options["days"])
+            queryset = queryset.exclude(verified__gte=cutoff)
+
+        def check(row):
+            pk, name, checksum = row
+            return (pk, name) + verify_checksum(name, checksum, throttle)
+
+        results = Counter()
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list(
+                "pk", source, "checksum")[:options["batch_size"]])
+            if not rows:
+                return results
+            last_pk = rows[-1][0]
+
+            verified = []
+            for pk, name, result, actual in run_in_threads(
+                    check, rows, workers=options["workers"]):
+                results[result] += 1
+                if result == CHECKSUM_NEW:
+                    model.objects.filter(pk=pk, **{source: name}).update(checksum=actual)
+                if result in (CHECKSUM_MISMATCH, CHECKSUM_MISSING):
+                    logger.error("%s %s: %s is %s", model.__name__, pk, name, result)
+                    self.stdout.write("%s %s: %s is %s" % (model.__name__, pk, name, result))
+                else:
+                    verified.append(pk)
+
+            model.objects.filter(pk__in=verified).update(verified=now())
@@ -0,0 +1,60 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.db.models import Count
+from django.utils.timezone import now
+
+from utils.metrics import Counter, Gauge, Histogram
+# Registers the request and upload metrics
+import utils.performance  # noqa
+import utils.uploads  # noqa
+
+zip_export_duration = Histogram(
+    "mixing_zip_export_duration_seconds", "Time to build the Zip archive of a Project's Tracks.",
+    (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), labelnames=["source"])
+
+credit_operations = Counter(
+    "mixing_credit_operations_total", "Changes of track credit by operation.",
+    labelnames=["operation"])
+credits = Counter(
+    "mixing_credits_total", "Track credit added or taken by operation.",
+    labelnames=["operation"])
+
+stripe_duration = Histogram(
+    "mixing_stripe_request_duration_seconds", "Latency of Stripe API calls.",
+    (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30), labelnames=["call", "outcome"])
+
+
+def add_credits(operation, amount):
+    """
+    Count a change of track credit, see mixing.purchases.models.add_to_profile().
+    """
+    credit_operations.inc(operation=operation)
+    credits.inc(amount, operation=operation)
+
+
+def job_counts():
+    from .jobs.models import Job
+    counts = dict(Job.objects.order_by().values_list("status").annotate(count=Count("pk")))
+    return [({"status": label.lower()}, counts.get(status, 0))
+            for status, label in Job.STATUS_CHOICES]
+
+
+def due_jobs():
+    from .jobs.models import Job
+    return [({}, Job.objects.filter(status=Job.STATUS_PENDING, run_at__lte=now()).count())]
+
+
+def pending_purchases():
+    from .purchases.models import Purchase
+    return [({}, Purchase.objects.filter(status=Purchase.STATUS_PENDING).count())]
+
+
+def stale_files():
+    from .models import StaleFile
+    return [({}, StaleFile.objects.count())]
+
+
+Gauge("mixing_jobs", "Jobs by status.", job_counts, labelnames=["status"])
+Gauge("mixing_jobs_due", "Pending Jobs that are due to run.", due_jobs)
+Gauge("mixing_purchases_pending", "Purchases waiting for their Stripe charge.", pending_purchases)
+Gauge("mixing_stale_files", "Files queued for the storage sweeper.", stale_files)
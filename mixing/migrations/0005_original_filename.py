@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import mixing.permissions
+import private_storage.fields
+import mixing.storage
+
+
+def populate_filenames(apps, schema_editor):
+    """
+    Use the stored filename (minus any unique prefix) for existing rows.
+    """
+    fields = [("Track", "file"), ("Comment", "attachment"), ("FinalFile", "attachment")]
+    for model_name, field in fields:
+        model = apps.get_model("mixing", model_name)
+        rows = model.objects.exclude(**{field: ""}).values_list("pk", field)
+        for pk, name in rows.iterator():
+            filename = re.sub(r"^[0-9a-f]{32}-", "", name.split("/")[-1])
+            model.objects.filter(pk=pk).update(filename=filename)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0004_stale_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='filename',
+            field=models.CharField(verbose_name='Filename', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='finalfile',
+            name='filename',
+            field=models.CharField(verbose_name='Filename', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='filename',
+            field=models.CharField(verbose_name='Filename', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='attachment',
+            field=private_storage.fields.PrivateFileField(storage=mixing.storage.UniquePrivateStorage(), upload_to=mixing.permissions.private_comment_path, max_length=255, blank=True, verbose_name='Attachment', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='finalfile',
+            name='attachment',
+            field=private_storage.fields.PrivateFileField(storage=mixing.storage.UniquePrivateStorage(), upload_to=mixing.permissions.private_final_path, max_length=255, verbose_name='Attachment', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='track',
+            name='file',
+            field=private_storage.fields.PrivateFileField(storage=mixing.storage.UniquePrivateStorage(), upload_to=mixing.permissions.private_track_path, max_length=255, verbose_name='File', db_index=True),
+        ),
+        migrations.RunPython(populate_filenames, migrations.RunPython.noop),
+    ]
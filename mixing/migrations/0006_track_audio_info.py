@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0005_original_filename'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='analyzed',
+            field=models.DateTimeField(verbose_name='Analyzed', null=True, editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='bit_depth',
+            field=models.PositiveSmallIntegerField(verbose_name='Bit depth', null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='channels',
+            field=models.PositiveSmallIntegerField(verbose_name='Channels', null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='duration',
+            field=models.FloatField(verbose_name='Duration', null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='sample_rate',
+            field=models.PositiveIntegerField(verbose_name='Sample rate', null=True, editable=False),
+        ),
+    ]
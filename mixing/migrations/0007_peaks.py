@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import mixing.permissions
+import private_storage.fields
+import mixing.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0006_track_audio_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finalfile',
+            name='peaks',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.UniquePrivateStorage(), upload_to=mixing.permissions.private_final_path, max_length=255, blank=True, verbose_name='Peaks', db_index=True),
+        ),
+        migrations.AddField(
+            model_name='finalfile',
+            name='peaks_extracted',
+            field=models.DateTimeField(verbose_name='Peaks extracted', null=True, editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='peaks',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.UniquePrivateStorage(), upload_to=mixing.permissions.private_track_path, max_length=255, blank=True, verbose_name='Peaks', db_index=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='peaks_extracted',
+            field=models.DateTimeField(verbose_name='Peaks extracted', null=True, editable=False, db_index=True),
+        ),
+    ]
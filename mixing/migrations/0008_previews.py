@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import mixing.permissions
+import private_storage.fields
+import mixing.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0007_peaks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finalfile',
+            name='preview',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.UniquePrivateStorage(), upload_to=mixing.permissions.private_preview_path, max_length=255, blank=True, verbose_name='Preview', db_index=True),
+        ),
+        migrations.AddField(
+            model_name='finalfile',
+            name='preview_encoded',
+            field=models.DateTimeField(verbose_name='Preview encoded', null=True, editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='preview',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.UniquePrivateStorage(), upload_to=mixing.permissions.private_preview_path, max_length=255, blank=True, verbose_name='Preview', db_index=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='preview_encoded',
+            field=models.DateTimeField(verbose_name='Preview encoded', null=True, editable=False, db_index=True),
+        ),
+    ]
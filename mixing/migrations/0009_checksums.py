@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0008_previews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finalfile',
+            name='checksum',
+            field=models.CharField(verbose_name='SHA-256 checksum', max_length=64, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='finalfile',
+            name='verified',
+            field=models.DateTimeField(verbose_name='Verified', null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='checksum',
+            field=models.CharField(verbose_name='SHA-256 checksum', max_length=64, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='verified',
+            field=models.DateTimeField(verbose_name='Verified', null=True, editable=False),
+        ),
+    ]
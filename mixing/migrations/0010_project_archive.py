@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0009_checksums'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='archive',
+            field=models.CharField(verbose_name='Archive', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='archived',
+            field=models.DateTimeField(verbose_name='Archived', null=True, editable=False, db_index=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import mixing.permissions
+import private_storage.fields
+import mixing.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0010_project_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='attachment',
+            field=private_storage.fields.PrivateFileField(storage=mixing.storage.ConfiguredPrivateStorage(), upload_to=mixing.permissions.private_comment_path, max_length=255, blank=True, verbose_name='Attachment', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='finalfile',
+            name='attachment',
+            field=private_storage.fields.PrivateFileField(storage=mixing.storage.ConfiguredPrivateStorage(), upload_to=mixing.permissions.private_final_path, max_length=255, verbose_name='Attachment', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='finalfile',
+            name='peaks',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.ConfiguredPrivateStorage(), upload_to=mixing.permissions.private_final_path, max_length=255, blank=True, verbose_name='Peaks', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='finalfile',
+            name='preview',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.ConfiguredPrivateStorage(), upload_to=mixing.permissions.private_preview_path, max_length=255, blank=True, verbose_name='Preview', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='track',
+            name='file',
+            field=private_storage.fields.PrivateFileField(storage=mixing.storage.ConfiguredPrivateStorage(), upload_to=mixing.permissions.private_track_path, max_length=255, verbose_name='File', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='track',
+            name='peaks',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.ConfiguredPrivateStorage(), upload_to=mixing.permissions.private_track_path, max_length=255, blank=True, verbose_name='Peaks', db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='track',
+            name='preview',
+            field=private_storage.fields.PrivateFileField(editable=False, storage=mixing.storage.ConfiguredPrivateStorage(), upload_to=mixing.permissions.private_preview_path, max_length=255, blank=True, verbose_name='Preview', db_index=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0011_configured_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='size',
+            field=models.BigIntegerField(verbose_name='Size', null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='finalfile',
+            name='size',
+            field=models.BigIntegerField(verbose_name='Size', null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='storage_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='Storage used', editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='size',
+            field=models.BigIntegerField(verbose_name='Size', null=True, editable=False),
+        ),
+    ]
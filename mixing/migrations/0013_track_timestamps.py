@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_timestamps(apps, schema_editor):
+    """
+    Existing Tracks were uploaded some time after their Project was created,
+    which is the closest time that is known.
+    """
+    Project = apps.get_model("mixing", "Project")
+    Track = apps.get_model("mixing", "Track")
+    projects = Project.objects.filter(
+        songs__groups__tracks__created__isnull=True).values_list("pk", "created").distinct()
+    for pk, created in projects.iterator():
+        Track.objects.filter(group__song__project=pk, created__isnull=True).update(
+            created=created, updated=created)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0012_storage_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='created',
+            field=models.DateTimeField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='updated',
+            field=models.DateTimeField(null=True, editable=False),
+        ),
+        migrations.RunPython(backfill_timestamps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def populate_documents(apps, schema_editor):
+    """
+    Build the documents of existing Projects, a copy of
+    mixing.search.project_documents() as it was when this migration was written.
+    """
+    Project = apps.get_model("mixing", "Project")
+    Comment = apps.get_model("mixing", "Comment")
+    Track = apps.get_model("mixing", "Track")
+    SearchDocument = apps.get_model("mixing", "SearchDocument")
+
+    pks = list(Project.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(pks), 500):
+        parts = defaultdict(list)
+        projects = Project.objects.filter(pk__in=pks[start:start + 500]).values_list(
+            "pk", "title", "owner__username", "owner__email",
+            "owner__first_name", "owner__last_name")
+        for row in projects:
+            parts[row[0]].extend(row[1:])
+
+        comments = Comment.objects.filter(project__in=parts).values_list("project", "content")
+        for pk, content in comments:
+            parts[pk].append(content)
+
+        tracks = Track.objects.filter(group__song__project__in=parts).values_list(
+            "group__song__project", "filename", "file")
+        for pk, filename, name in tracks:
+            parts[pk].append(filename or re.sub(r"^[0-9a-f]{32}-", "", name.split("/")[-1]))
+
+        SearchDocument.objects.bulk_create([
+            SearchDocument(project_id=pk, text=" ".join(part for part in values if part).lower())
+            for pk, values in parts.items()])
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Index the documents for LIKE '%word%' searches on PostgreSQL.
+    Other databases scan the table, which is fine for development and tests.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX mixing_searchdocument_text_trgm "
+        "ON mixing_searchdocument USING gin (text gin_trgm_ops)")
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS mixing_searchdocument_text_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0013_track_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('project', models.OneToOneField(related_name='search_document', primary_key=True, serialize=False, to='mixing.Project')),
+                ('text', models.TextField(verbose_name='Text')),
+            ],
+            options={
+                'verbose_name': 'search document',
+                'verbose_name_plural': 'search documents',
+            },
+        ),
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
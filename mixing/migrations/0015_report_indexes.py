@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0014_search_document'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='project',
+            index_together=set([('created',), ('status', 'updated')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='track',
+            index_together=set([('created',)]),
+        ),
+    ]
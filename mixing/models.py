@@ -2,23 +2,139 @@ from __future__ import unicode_literals, absolute_import
 
 from django.core.urlresolvers import reverse
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Max, Value, When
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
 from django.template.defaultfilters import truncatechars
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.timezone import now
 
 from private_storage.fields import PrivateFileField
 
 from mezzanine.conf import settings
 from mezzanine.core.models import TimeStamped
 
-from utils import get_user_display
+from utils import get_user_display, display_filename
+from utils.counters import CounterFieldsMixin
+from utils.uploads import uploaded_checksum
 
 from .permissions import (
-    private_comment_path, private_final_path, private_track_path)
+    private_comment_path, private_final_path, private_preview_path, private_track_path)
+from .signals import project_status_changed
+from .storage import private_storage
+
+# The fields of the owners of Projects that are part of their SearchDocuments
+OWNER_SEARCH_FIELDS = ("username", "email", "first_name", "last_name")
+
+
+def loaded_values(instance, fields):
+    """
+    The values of some fields of an instance, without loading deferred ones.
+    Files are compared by name.
+    """
+    values = []
+    for name in fields:
+        value = instance.__dict__.get(name)
+        values.append(getattr(value, "name", value))
+    return tuple(values)
+
+
+class SearchFieldsMixin(object):
+    """
+    Model mixin that remembers the SEARCH_FIELDS (attribute names) of instances
+    loaded from the database, so update_search_index_on_change() only rebuilds
+    the SearchDocument when they changed.
+    """
+    SEARCH_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(SearchFieldsMixin, cls).from_db(db, field_names, values)
+        instance._search_values = loaded_values(instance, cls.SEARCH_FIELDS)
+        return instance
+
+
+class ProjectQuerySet(models.QuerySet):
+
+    def set_status(self, status):
+        """
+        Move all Projects to a new status with a single UPDATE that applies the
+        same active flag and priority rules as Project.save(). Archived Projects
+        that wait for files again are queued for restoring, as in save().
+        project_status_changed is sent once for the whole batch.
+        Returns the number of updated Projects.
+        """
+        fields = {"status": status, "updated": now()}
+        if status in Project.WAITING:
+            fields.update(active=True, priority=10)
+        elif status in Project.IN_PROGRESS:
+            fields.update(active=False, priority=Case(
+                When(priority=10, then=Value(9)), default=F("priority")))
+        elif status in Project.ALL_DONE:
+            fields.update(active=False, priority=10)
+
+        with transaction.atomic():
+            projects = list(self.select_for_update().order_by().values_list("pk", "status"))
+            pks = [pk for pk, _ in projects]
+            if status in Project.WAITING:
+                from .archive import restore_projects
+                archived = list(Project.objects.filter(
+                    pk__in=pks, archived__isnull=False).values_list("pk", flat=True))
+                if archived:
+                    restore_projects.delay(archived)
+            updated = Project.objects.filter(pk__in=pks).update(**fields)
+
+        previous = dict((pk, old_status) for pk, old_status in projects if old_status != status)
+        if previous:
+            project_status_changed.send(
+                sender=Project, project_ids=list(previous), status=status,
+                previous_statuses=previous)
+        return updated
+
+    def with_activity(self):
+        """
+        Annotate the number of Tracks and Comments with correlated subqueries
+        and the time of the last Track upload, so a page of Projects is still
+        a single query. The values can be used in order_by().
+        """
+        qn = connection.ops.quote_name
+        project = "%s.%s" % (qn(Project._meta.db_table), qn("id"))
+        tracks = (
+            "FROM {track} INNER JOIN {group} ON {track}.{group_id} = {group}.{id} "
+            "INNER JOIN {song} ON {group}.{song_id} = {song}.{id} "
+            "WHERE {song}.{project_id} = {project}"
+        ).format(
+            track=qn(Track._meta.db_table), group=qn(Group._meta.db_table),
+            song=qn(Song._meta.db_table), id=qn("id"), group_id=qn("group_id"),
+            song_id=qn("song_id"), project_id=qn("project_id"), project=project)
+        comments = "FROM {comment} WHERE {comment}.{project_id} = {project}".format(
+            comment=qn(Comment._meta.db_table), project_id=qn("project_id"),
+            project=project)
+        return self.annotate(last_upload=Max("songs__groups__tracks__created")).extra(select={
+            "track_count": "SELECT COUNT(*) %s" % tracks,
+            "comment_count": "SELECT COUNT(*) %s" % comments,
+        })
+
+    def delete(self):
+        """
+        Remove the Tracks, Comments and FinalFiles of the Projects in bulk first.
+        Otherwise the cascade would fetch and signal every single object.
+        Archives are removed by a background job once the rows are gone.
+        """
+        from .archive import delete_archives
+        from .bulk import delete_project_contents
+        archives = list(self.exclude(archive="").values_list("archive", flat=True))
+        with transaction.atomic():
+            delete_project_contents(self)
+            deleted = super(ProjectQuerySet, self).delete()
+            if archives:
+                delete_archives.delay(archives)
+        return deleted
 
 
 @python_2_unicode_compatible
-class Project(TimeStamped):
+class Project(SearchFieldsMixin, CounterFieldsMixin, TimeStamped):
     """
     A mixing project created by a user.
     The main organization unit for storing user-uploaded Tracks.
@@ -56,16 +172,41 @@ class Project(TimeStamped):
         validators=[MinValueValidator(0), MaxValueValidator(10)],
         help_text="Lower numbers indicate a higher priority for this project")
 
+    # Set while the Track files are stored in an archive, see mixing.archive
+    archive = models.CharField("Archive", max_length=255, blank=True, editable=False)
+    archived = models.DateTimeField("Archived", null=True, editable=False, db_index=True)
+
+    # Bytes of all Tracks, Comment attachments and FinalFiles, see mixing.usage
+    storage_bytes = models.BigIntegerField(
+        "Storage used", default=0, editable=False, db_index=True)
+    counter_fields = ["storage_bytes"]
+
+    SEARCH_FIELDS = ("title", "owner_id")
+
+    objects = ProjectQuerySet.as_manager()
+
     class Meta:
         verbose_name = "project"
         verbose_name_plural = "projects"
+        # Daily report rollups, see mixing.reports.rollups
+        index_together = [("created",), ("status", "updated")]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the stored status, so save() can tell if it changed.
+        """
+        instance = super(Project, cls).from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
+
     def save(self, *args, **kwargs):
         """
         Update the active flag and priority depending ones the status field.
+        See ProjectQuerySet.set_status() for the bulk version of these rules.
         """
         # Enable file uploads and mark as non-important
         if self.status in self.WAITING:
@@ -83,14 +224,93 @@ class Project(TimeStamped):
             self.active = False
             self.priority = 10
 
-        super(Project, self).save(*args, **kwargs)
+        previous_status = getattr(self, "_loaded_status", None)
+        with transaction.atomic():
+            super(Project, self).save(*args, **kwargs)
+            # Archived Tracks are needed again when uploads are enabled. They are
+            # restored by the job worker once the new status is committed.
+            if self.archived and self.status in self.WAITING:
+                from .archive import restore_projects
+                restore_projects.delay([self.pk])
+        self._loaded_status = self.status
+        if previous_status is not None and previous_status != self.status:
+            project_status_changed.send(
+                sender=Project, project_ids=[self.pk], status=self.status,
+                previous_statuses={self.pk: previous_status})
+
+    def delete(self, *args, **kwargs):
+        """
+        See ProjectQuerySet.delete().
+        """
+        from .archive import delete_archives
+        from .bulk import delete_project_contents
+        with transaction.atomic():
+            delete_project_contents(Project.objects.filter(pk=self.pk))
+            deleted = super(Project, self).delete(*args, **kwargs)
+            if self.archive:
+                delete_archives.delay([self.archive])
+        return deleted
 
     def get_absolute_url(self):
         return reverse("project_detail", args=[self.pk])
 
 
+class SizedUpload(models.Model):
+    """
+    Stores the size of the uploaded file and updates the storage_bytes
+    counters of its Project and owner in the same transaction as the row.
+    Deletes are counted by update_usage_on_delete() and mixing.bulk.
+    Files replaced by a save are queued as StaleFiles in the same transaction,
+    like the files of deleted objects (see queue_files_on_delete()).
+    """
+    size = models.BigIntegerField("Size", null=True, editable=False)
+
+    # The uploaded file field and the path from the model to its Project
+    SIZE_SOURCE = None
+    PROJECT_LOOKUP = "project"
+
+    class Meta:
+        abstract = True
+
+    def get_project_id(self):
+        return self.project_id
+
+    def save(self, *args, **kwargs):
+        from .usage import add_storage_usage
+        source = getattr(self, self.SIZE_SOURCE)
+        if source and not source._committed:
+            self.size = source.size
+        elif not source:
+            self.size = None
+
+        file_fields = [
+            field.name for field in self._meta.fields
+            if isinstance(field, models.FileField)]
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            file_fields = [name for name in file_fields if name in update_fields]
+
+        with transaction.atomic():
+            usage = {}
+            old_files = {}
+            if self.pk is not None:
+                # The stored row, in case the files or the Project changed
+                old = type(self)._default_manager.filter(pk=self.pk).values_list(
+                    "size", self.PROJECT_LOOKUP, *file_fields).first()
+                if old is not None:
+                    usage[old[1]] = -(old[0] or 0)
+                    old_files = dict(zip(file_fields, old[2:]))
+            super(SizedUpload, self).save(*args, **kwargs)
+            project_id = self.get_project_id()
+            usage[project_id] = usage.get(project_id, 0) + (self.size or 0)
+            add_storage_usage(usage)
+            StaleFile.objects.bulk_create([
+                StaleFile(name=name) for field, name in old_files.items()
+                if name and name != getattr(self, field).name])
+
+
 @python_2_unicode_compatible
-class Comment(TimeStamped):
+class Comment(SearchFieldsMixin, SizedUpload, TimeStamped):
     """
     A comment that a user or staff member can leave on a Project.
     Can be used to clarify details or provide references.
@@ -100,7 +320,12 @@ class Comment(TimeStamped):
         settings.AUTH_USER_MODEL, related_name="comments", verbose_name="Author")
     content = models.TextField("Content")
     attachment = PrivateFileField(
-        "Attachment", max_length=255, blank=True, upload_to=private_comment_path)
+        "Attachment", max_length=255, blank=True, upload_to=private_comment_path,
+        storage=private_storage, db_index=True)
+    filename = models.CharField("Filename", max_length=255, blank=True, editable=False)
+
+    SIZE_SOURCE = "attachment"
+    SEARCH_FIELDS = ("content", "project_id")
 
     class Meta:
         verbose_name = "comment"
@@ -113,7 +338,7 @@ class Comment(TimeStamped):
 
 
 @python_2_unicode_compatible
-class FinalFile(TimeStamped):
+class FinalFile(SizedUpload, TimeStamped):
     """
     A file resulting from the mixing process.
     Uploaded by a staff member and downloaded by the user.
@@ -121,7 +346,30 @@ class FinalFile(TimeStamped):
     project = models.ForeignKey(Project, related_name="final_files")
     title = models.CharField("Title", max_length=100, blank=True)
     attachment = PrivateFileField(
-        "Attachment", max_length=255, upload_to=private_final_path)
+        "Attachment", max_length=255, upload_to=private_final_path,
+        storage=private_storage, db_index=True)
+    filename = models.CharField("Filename", max_length=255, blank=True, editable=False)
+    checksum = models.CharField(
+        "SHA-256 checksum", max_length=64, blank=True, editable=False)
+    verified = models.DateTimeField("Verified", null=True, editable=False)
+
+    # Populated by mixing.processing.extract_peaks() after the upload
+    peaks = PrivateFileField(
+        "Peaks", max_length=255, blank=True, editable=False,
+        upload_to=private_final_path, storage=private_storage, db_index=True)
+    peaks_extracted = models.DateTimeField(
+        "Peaks extracted", null=True, editable=False, db_index=True)
+
+    # Populated by mixing.processing.encode_preview() after the upload
+    preview = PrivateFileField(
+        "Preview", max_length=255, blank=True, editable=False,
+        upload_to=private_preview_path, storage=private_storage, db_index=True)
+    preview_encoded = models.DateTimeField(
+        "Preview encoded", null=True, editable=False, db_index=True)
+
+    # The field peaks and previews are created from
+    PEAKS_SOURCE = "attachment"
+    SIZE_SOURCE = "attachment"
 
     class Meta:
         verbose_name = "final file"
@@ -132,7 +380,7 @@ class FinalFile(TimeStamped):
         if self.title:
             return self.title
         try:
-            return self.attachment.name.split("/")[-1]
+            return self.filename or display_filename(self.attachment.name)
         except AttributeError:
             return ""
 
@@ -170,21 +418,282 @@ class Group(models.Model):
 
 
 @python_2_unicode_compatible
-class Track(models.Model):
+class Track(SearchFieldsMixin, SizedUpload, TimeStamped):
     """
     The actual track, uploaded by the user to be mixed.
     Tracks are always part of a Group.
     """
     group = models.ForeignKey(Group, related_name="tracks")
-    file = PrivateFileField("File", max_length=255, upload_to=private_track_path)
+    file = PrivateFileField(
+        "File", max_length=255, upload_to=private_track_path, storage=private_storage,
+        db_index=True)
+    filename = models.CharField("Filename", max_length=255, blank=True, editable=False)
+    checksum = models.CharField(
+        "SHA-256 checksum", max_length=64, blank=True, editable=False)
+    verified = models.DateTimeField("Verified", null=True, editable=False)
+
+    # Populated by mixing.processing.analyze_track() after the upload
+    sample_rate = models.PositiveIntegerField("Sample rate", null=True, editable=False)
+    bit_depth = models.PositiveSmallIntegerField("Bit depth", null=True, editable=False)
+    channels = models.PositiveSmallIntegerField("Channels", null=True, editable=False)
+    duration = models.FloatField("Duration", null=True, editable=False)
+    analyzed = models.DateTimeField("Analyzed", null=True, editable=False, db_index=True)
+
+    # Populated by mixing.processing.extract_peaks() after the upload
+    peaks = PrivateFileField(
+        "Peaks", max_length=255, blank=True, editable=False,
+        upload_to=private_track_path, storage=private_storage, db_index=True)
+    peaks_extracted = models.DateTimeField(
+        "Peaks extracted", null=True, editable=False, db_index=True)
+
+    # Populated by mixing.processing.encode_preview() after the upload
+    preview = PrivateFileField(
+        "Preview", max_length=255, blank=True, editable=False,
+        upload_to=private_preview_path, storage=private_storage, db_index=True)
+    preview_encoded = models.DateTimeField(
+        "Preview encoded", null=True, editable=False, db_index=True)
+
+    PEAKS_SOURCE = "file"
+    SIZE_SOURCE = "file"
+    PROJECT_LOOKUP = "group__song__project"
+    SEARCH_FIELDS = ("filename", "file", "group_id")
 
     class Meta:
         verbose_name = "track"
         verbose_name_plural = "tracks"
+        index_together = [("created",)]
 
     def __str__(self):
         # Filename and extension
         try:
-            return self.file.name.split('/')[-1]
+            return self.filename or display_filename(self.file.name)
         except AttributeError:
             return ""
+
+    def get_project_id(self):
+        return self.get_project_and_owner()[0]
+
+    def get_owner_id(self):
+        return self.get_project_and_owner()[1]
+
+    def get_project_and_owner(self):
+        """
+        The (Project ID, owner ID) of the Track. Walks the Group, Song and
+        Project if they were loaded with select_related("group__song__project"),
+        otherwise they are found with a single query instead of one per level.
+        """
+        if (Track.group.is_cached(self) and Group.song.is_cached(self.group) and
+                Song.project.is_cached(self.group.song)):
+            project = self.group.song.project
+            return project.pk, project.owner_id
+        cached = getattr(self, "_project_and_owner", None)
+        if cached is None or cached[0] != self.group_id:
+            row = Project.objects.filter(songs__groups=self.group_id).values_list(
+                "pk", "owner_id").get()
+            cached = self._project_and_owner = (self.group_id,) + tuple(row)
+        return cached[1:]
+
+    def get_audio_display(self):
+        """
+        Summary of the audio properties, e.g. "44.1 kHz / 24 bit / 2 ch / 3:25".
+        """
+        if not self.sample_rate:
+            return ""
+        minutes, seconds = divmod(int(round(self.duration or 0)), 60)
+        return "%s kHz / %s bit / %s ch / %d:%02d" % (
+            "{:g}".format(self.sample_rate / 1000.0), self.bit_depth, self.channels,
+            minutes, seconds)
+
+
+@python_2_unicode_compatible
+class StaleFile(models.Model):
+    """
+    A file in private storage that is no longer needed and should be removed.
+    Removing files is deferred so it doesn't happen during the request.
+    See mixing.files.sweep_stale_files().
+    """
+    name = models.CharField("Name", max_length=255)
+    created = models.DateTimeField("Created", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "stale file"
+        verbose_name_plural = "stale files"
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class SearchDocument(models.Model):
+    """
+    The searchable text of a Project: its title, the owner's names and email,
+    Comment contents and Track filenames, lowercased. Kept up to date by
+    mixing.search.update_search_index() and indexed with pg_trgm on PostgreSQL.
+    """
+    project = models.OneToOneField(
+        Project, primary_key=True, related_name="search_document")
+    text = models.TextField("Text")
+
+    class Meta:
+        verbose_name = "search document"
+        verbose_name_plural = "search documents"
+
+    def __str__(self):
+        return truncatechars(self.text, 50)
+
+
+@receiver(pre_save, sender=Track)
+@receiver(pre_save, sender=Comment)
+@receiver(pre_save, sender=FinalFile)
+def remember_original_filename(sender, instance, **kwargs):
+    """
+    Keep the name of newly uploaded files as the user sent it.
+    Stored names are unique and slugified, see mixing.permissions.sharded_path().
+    """
+    for field in sender._meta.fields:
+        if isinstance(field, models.FileField):
+            fieldfile = getattr(instance, field.name)
+            if fieldfile and not fieldfile._committed:
+                instance.filename = display_filename(fieldfile.name)
+
+
+@receiver(pre_save, sender=Track)
+def reset_audio_info(sender, instance, **kwargs):
+    """
+    New uploads must be analyzed again, see mixing.processing.analyze_track().
+    """
+    if instance.file and not instance.file._committed:
+        instance.sample_rate = instance.bit_depth = instance.channels = None
+        instance.duration = instance.analyzed = None
+
+
+@receiver(pre_save, sender=Track)
+@receiver(pre_save, sender=FinalFile)
+def remember_checksum(sender, instance, **kwargs):
+    """
+    Store the SHA-256 of a new upload, computed by the upload handler while it
+    was received (see utils.uploads). Used by the verify_storage command.
+    """
+    source = getattr(instance, instance.PEAKS_SOURCE)
+    if source and not source._committed:
+        instance.checksum = uploaded_checksum(source.file)
+        instance.verified = None
+
+
+# Files created from the uploaded audio and the timestamp of their creation
+DERIVED_FILES = (("peaks", "peaks_extracted"), ("preview", "preview_encoded"))
+
+
+@receiver(pre_save, sender=Track)
+@receiver(pre_save, sender=FinalFile)
+def reset_derived_files(sender, instance, **kwargs):
+    """
+    Drop the peaks and preview of a replaced file, see mixing.processing.
+    SizedUpload.save() queues their files for deletion.
+    """
+    source = getattr(instance, instance.PEAKS_SOURCE)
+    if source and not source._committed:
+        for field, timestamp_field in DERIVED_FILES:
+            setattr(instance, field, "")
+            setattr(instance, timestamp_field, None)
+
+
+@receiver(post_delete, sender=Track)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=FinalFile)
+def queue_files_on_delete(sender, instance, **kwargs):
+    """
+    Queue the files of a deleted object for removal by the storage sweeper.
+    Replaces django-cleanup's post_delete handler (see MixingConfig.ready()).
+    Since the StaleFile rows are part of the transaction, files of deletes that
+    get rolled back are never removed.
+    """
+    StaleFile.objects.bulk_create([
+        StaleFile(name=getattr(instance, field.name).name)
+        for field in sender._meta.fields
+        if isinstance(field, models.FileField) and getattr(instance, field.name)
+    ])
+
+
+@receiver(post_delete, sender=Track)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=FinalFile)
+def update_usage_on_delete(sender, instance, **kwargs):
+    """
+    Subtract the size of a deleted file from the storage counters.
+    Runs in the transaction of the delete.
+    """
+    from .usage import add_storage_usage
+    if instance.size:
+        add_storage_usage({instance.get_project_id(): -instance.size})
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Track)
+def invalidate_track_browser_on_change(sender, instance, **kwargs):
+    """
+    Drop the cached track browser fragments of the Project, see mixing.track_browser.
+    """
+    from .track_browser import invalidate_track_browser
+    if sender is Track:
+        project_id = instance.get_project_id()
+    elif sender is Group:
+        project_id = instance.song.project_id
+    else:
+        project_id = instance.project_id
+    invalidate_track_browser([project_id])
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Track)
+def update_search_index_on_change(sender, instance, created=False, **kwargs):
+    """
+    Rebuild the SearchDocument of the Project, see mixing.search. Saves that
+    leave the SEARCH_FIELDS of an instance loaded from the database unchanged
+    (e.g. status changes or processing results) are skipped.
+    """
+    from .search import update_search_index
+    project_id = instance.pk if sender is Project else instance.get_project_id()
+    project_ids = [project_id]
+    if kwargs["signal"] is post_save:
+        old = getattr(instance, "_search_values", None)
+        new = instance._search_values = loaded_values(instance, sender.SEARCH_FIELDS)
+        if old == new and not created:
+            return
+        # Moved to another Project, whose document lost the instance
+        old = dict(zip(sender.SEARCH_FIELDS, old or ()))
+        if sender is Comment and old.get("project_id") not in (None, instance.project_id):
+            project_ids.append(old["project_id"])
+        elif sender is Track and old.get("group_id") not in (None, instance.group_id):
+            project_ids.extend(Group.objects.filter(pk=old["group_id"]).values_list(
+                "song__project", flat=True))
+    update_search_index(project_ids)
+
+
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def remember_owner_search_values(sender, instance, **kwargs):
+    instance._search_values = loaded_values(instance, OWNER_SEARCH_FIELDS)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_search_index_on_owner_change(sender, instance, created, update_fields, **kwargs):
+    """
+    Owner names and emails are part of the SearchDocuments of their Projects.
+    Saves of other fields, like the last_login of every login, are skipped.
+    """
+    from .search import update_search_index
+    if created:
+        return
+    if update_fields is not None and not set(update_fields) & set(OWNER_SEARCH_FIELDS):
+        return
+    old = getattr(instance, "_search_values", None)
+    new = instance._search_values = loaded_values(instance, OWNER_SEARCH_FIELDS)
+    if old != new:
+        update_search_index(Project.objects.filter(owner=instance).values_list("pk", flat=True))
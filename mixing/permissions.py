@@ -1,6 +1,7 @@
 from __future__ import unicode_literals, absolute_import
 
 import os
+import uuid
 
 from rest_framework import permissions
 
@@ -20,7 +21,8 @@ class ProjectIsActive(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         """
         Traverse the foreign keys to determine if a Project is active.
-        The obj param can be a Song, Group, or Track.
+        The obj param can be a Song, Group, or Track, loaded by the viewsets
+        with select_related() up to the Project so this doesn't query.
         """
         if request.method in permissions.SAFE_METHODS:
             return True
@@ -38,28 +40,50 @@ class ProjectIsActive(permissions.BasePermission):
 # File Permissions #
 ####################
 
+def sharded_path(section, owner_id, filename, uid=None):
+    """
+    Build a private path with the format /{section}/{owner ID}/ab/cd/{uid}-{filename}.
+    The two directory levels are taken from the UUID, so the files of a single
+    owner are spread over up to 65536 directories instead of a flat one.
+    """
+    uid = uid or uuid.uuid4().hex
+    name = "%s-%s" % (uid, slugify_filename(filename))
+    return os.path.join(section, str(owner_id), uid[:2], uid[2:4], name)
+
+
 def private_track_path(track, filename):
     """
     Determine the upload path for Track objects.
     """
-    owner_id = str(track.group.song.project.owner.id)
-    return os.path.join("tracks", owner_id, slugify_filename(filename))
+    return sharded_path("tracks", track.get_owner_id(), filename)
 
 
 def private_comment_path(comment, filename):
     """
     Determine the upload path for Comment objects.
     """
-    owner_id = str(comment.project.owner.id)
-    return os.path.join("comments", owner_id, slugify_filename(filename))
+    owner_id = comment.project.owner_id
+    return sharded_path("comments", owner_id, filename)
 
 
 def private_final_path(final_file, filename):
     """
     Determine the upload path for FinalFile objects.
     """
-    owner_id = str(final_file.project.owner.id)
-    return os.path.join("finals", owner_id, slugify_filename(filename))
+    owner_id = final_file.project.owner_id
+    return sharded_path("finals", owner_id, filename)
+
+
+def private_preview_path(obj, filename):
+    """
+    Determine the upload path for previews of Tracks and FinalFiles.
+    Unlike the Tracks themselves, previews can be played by their owner.
+    """
+    if hasattr(obj, "get_owner_id"):  # Matches a Track
+        owner_id = obj.get_owner_id()
+    else:
+        owner_id = obj.project.owner_id
+    return sharded_path("previews", owner_id, filename)
 
 
 def allow_owner_and_staff(private_file):
@@ -0,0 +1,178 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+import os
+import struct
+import tempfile
+
+from django.core.files.base import ContentFile, File
+from django.utils.timezone import now
+
+from utils import display_filename
+
+from .audio import read_audio_info, AudioFormatError
+from .encoders import get_preview_encoder, EncoderError
+from .files import queue_file_deletion
+from .models import Track, DERIVED_FILES
+from .storage import private_storage, local_copy
+from .track_browser import invalidate_tracks
+from .waveform import compute_peaks
+
+logger = logging.getLogger(__name__)
+
+
+def analyze_track(pk):
+    """
+    Read the audio header of a Track and store its properties.
+    Files that can't be parsed are marked as analyzed with empty properties.
+    Running it again for the same Track just overwrites the same values.
+    Returns True if the audio format was recognized.
+    """
+    try:
+        track = Track.objects.get(pk=pk)
+    except Track.DoesNotExist:
+        return False
+
+    info = None
+    try:
+        with track.file.storage.open(track.file.name) as f:
+            info = read_audio_info(f)
+    except (IOError, OSError, AudioFormatError, struct.error) as e:
+        logger.info("Could not analyze track %s: %s", pk, e)
+
+    fields = {"analyzed": now()}
+    if info is not None:
+        fields.update({
+            "sample_rate": info.sample_rate,
+            "bit_depth": info.bit_depth,
+            "channels": info.channels,
+            "duration": info.duration,
+        })
+
+    # Skip the update if the file was replaced in the meantime
+    if Track.objects.filter(pk=pk, file=track.file.name).update(**fields):
+        invalidate_tracks(Track.objects.filter(pk=pk))
+    return info is not None
+
+
+def peaks_source(obj):
+    """
+    The audio file of a Track or FinalFile that peaks and previews are created from.
+    """
+    return getattr(obj, obj.PEAKS_SOURCE)
+
+
+def pool_item(obj):
+    """
+    The (model label, pk, file name) tuple passed to process pool workers.
+    """
+    source = peaks_source(obj)
+    model = obj._meta.concrete_model  # Not the deferred class of only()
+    return model._meta.model_name, obj.pk, source.name
+
+
+def save_derived_file(model, pk, name, field, content=None, filename=None):
+    """
+    Store a file created from the audio file `name` of an object (e.g. its peaks)
+    and set the matching timestamp from DERIVED_FILES.
+    Nothing is stored if the audio file was replaced in the meantime.
+    With content=None the object is only marked as processed.
+    Returns True if a file was saved.
+    """
+    try:
+        obj = model.objects.get(pk=pk, **{model.PEAKS_SOURCE: name})
+    except model.DoesNotExist:
+        return False
+
+    fields = {dict(DERIVED_FILES)[field]: now()}
+    if content is not None:
+        # Always a new, unique name, so cached copies never go stale
+        upload_to = model._meta.get_field(field).upload_to
+        fields[field] = private_storage.save(upload_to(obj, filename), content)
+
+    updated = model.objects.filter(pk=pk, **{model.PEAKS_SOURCE: name}).update(**fields)
+    if not updated:
+        queue_file_deletion([fields.get(field)])
+        return False
+    queue_file_deletion([getattr(obj, field).name])
+    if model is Track:
+        invalidate_tracks(Track.objects.filter(pk=pk))
+    return content is not None
+
+
+def compute_peaks_for(item):
+    """
+    Process pool entry point: (model label, pk, file name) -> (label, pk, name, data).
+    Runs in a worker process, so it only reads the file and never touches the database.
+    data is None if the file isn't a supported audio file.
+    """
+    label, pk, name = item
+    try:
+        with local_copy(private_storage, name) as path:
+            return label, pk, name, compute_peaks(path)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        # AudioFormatError and PeakFormatError are ValueErrors, as are the
+        # errors numpy raises for files shorter than their header claims
+        logger.info("Could not extract peaks for %s %s: %s", label, pk, e)
+        return label, pk, name, None
+
+
+def save_peaks(model, pk, name, data):
+    """
+    Store the output of compute_peaks_for() and mark the object as processed.
+    """
+    content = ContentFile(data) if data is not None else None
+    filename = "%s.peaks" % display_filename(name)
+    return save_derived_file(model, pk, name, "peaks", content, filename)
+
+
+def extract_peaks(obj):
+    """
+    Compute and store the waveform peaks of a single Track or FinalFile.
+    Uses the current process, see the extract_peaks command for a process pool.
+    """
+    _, pk, name, data = compute_peaks_for(pool_item(obj))
+    return save_peaks(obj._meta.concrete_model, pk, name, data)
+
+
+def encode_preview_for(item):
+    """
+    Process pool entry point: (model label, pk, file name) -> (label, pk, name, path).
+    The returned path is a temporary file with the preview, or None if the
+    file couldn't be encoded. Like compute_peaks_for(), it never touches the database.
+    """
+    label, pk, name = item
+    encoder = get_preview_encoder()
+    handle, temp_path = tempfile.mkstemp(suffix=".%s" % encoder.extension)
+    os.close(handle)
+    try:
+        with local_copy(private_storage, name) as path:
+            encoder.encode(path, temp_path)
+    except (IOError, OSError, ValueError, struct.error, EncoderError) as e:
+        logger.info("Could not encode preview for %s %s: %s", label, pk, e)
+        os.remove(temp_path)
+        return label, pk, name, None
+    return label, pk, name, temp_path
+
+
+def save_preview(model, pk, name, temp_path):
+    """
+    Store the output of encode_preview_for() and remove the temporary file.
+    """
+    if temp_path is None:
+        return save_derived_file(model, pk, name, "preview")
+    base = os.path.splitext(display_filename(name))[0]
+    filename = "%s-preview%s" % (base, os.path.splitext(temp_path)[1])
+    try:
+        with open(temp_path, "rb") as f:
+            return save_derived_file(model, pk, name, "preview", File(f), filename)
+    finally:
+        os.remove(temp_path)
+
+
+def encode_preview(obj):
+    """
+    Encode and store the preview of a single Track or FinalFile in the current process.
+    """
+    _, pk, name, temp_path = encode_preview_for(pool_item(obj))
+    return save_preview(obj._meta.concrete_model, pk, name, temp_path)
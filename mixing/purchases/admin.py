@@ -1,15 +1,36 @@
 from __future__ import unicode_literals
 
+import json
+
 from django.contrib import admin
+from django.utils.html import format_html
 
-from .models import Purchase
+from .models import ChargePayload, Purchase
 
 
 @admin.register(Purchase)
 class PurchasAdmin(admin.ModelAdmin):
-    fields = ["created", "user", "credits", "amount", "charge_details"]
-    readonly_fields = ["created"]
-    list_display = ["user", "amount", "credits", "created"]
+    fields = [
+        "created", "user", "credits", "amount", "status", "error", "charge_id",
+        "charge_status", "card_last4", "fee", "amount_refunded", "refunded", "charge"]
+    readonly_fields = [
+        "created", "status", "error", "charge_id", "charge_status", "card_last4", "fee",
+        "amount_refunded", "refunded", "charge"]
+    list_display = [
+        "user", "amount", "credits", "status", "charge_status", "card_last4",
+        "amount_refunded", "created"]
     date_hierarchy = "created"
-    list_filter = ["user"]
+    list_filter = ["status", "charge_status", "refunded", "user"]
+    # Backed by trigram indexes on PostgreSQL, see migration 0003_user_search_index
     search_fields = ["user__username", "user__email"]
+
+    def charge(self, purchase):
+        """
+        The complete Stripe charge, only loaded on the change page.
+        """
+        try:
+            payload = purchase.charge_payload
+        except ChargePayload.DoesNotExist:
+            return ""
+        return format_html("<pre>{}</pre>", json.dumps(payload.charge, indent=2, sort_keys=True))
+    charge.short_description = "Charge details"
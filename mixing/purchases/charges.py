@@ -0,0 +1,192 @@
+from __future__ import unicode_literals, absolute_import
+
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+import stripe
+
+from django.db import transaction
+
+from mezzanine.conf import settings
+
+from mixing.jobs.queue import enqueue, job
+from mixing.metrics import stripe_duration
+
+from .models import ChargePayload, Purchase
+
+logger = logging.getLogger(__name__)
+
+# Seconds a webhook signature stays valid, as in Stripe's own libraries
+WEBHOOK_TOLERANCE = 300
+
+# The error of Purchases whose charge failed for other reasons than the card
+CHARGE_ERROR = "The payment could not be processed, please try again"
+
+
+def queue_charge(purchase):
+    """
+    Charge a pending Purchase in the job worker, so the request doesn't wait
+    for Stripe. Queued once per Purchase, whatever the number of calls.
+    """
+    return enqueue(charge_purchase, [purchase.pk], key="charge_purchase:%d" % purchase.pk)
+
+
+def charge_failed(purchase_id):
+    """
+    Fail a Purchase whose charge Job ran out of attempts, so it doesn't stay
+    pending forever with its token.
+    """
+    fail_purchase(purchase_id, CHARGE_ERROR)
+
+
+@job(max_attempts=8, on_failure=charge_failed)
+def charge_purchase(purchase_id):
+    """
+    Create the Stripe charge of a pending Purchase.
+    The charge is sent with an idempotency key, so retries after a timeout or
+    an API error return the original charge instead of charging again.
+    Declined cards and requests that can't succeed when retried (e.g. a used
+    token) fail the Purchase, other errors are raised to retry the Job.
+    """
+    purchase = Purchase.objects.get(pk=purchase_id)
+    if purchase.status != Purchase.STATUS_PENDING:
+        return
+
+    stripe.api_key = settings.STRIPE_SK
+    started = time.time()
+    outcome = "error"
+    try:
+        charge = stripe.Charge.create(
+            currency="usd",
+            amount=int(purchase.amount * 100),  # Convert to cents
+            source=purchase.stripe_token,
+            metadata={"purchase_id": purchase.pk},
+            idempotency_key="purchase-%d" % purchase.pk,
+            expand=["balance_transaction"],  # For the fee
+        )
+        outcome = charge["status"]
+    except stripe.error.CardError as e:
+        outcome, charge = "declined", None
+        error = e.json_body["error"].get("message", "Your card was declined")
+    except (stripe.error.InvalidRequestError, stripe.error.AuthenticationError,
+            stripe.error.PermissionError) as e:
+        logger.error("Charge of Purchase %s rejected: %s", purchase.pk, e)
+        outcome, charge, error = "rejected", None, CHARGE_ERROR
+    finally:
+        stripe_duration.observe(time.time() - started, call="charge_create", outcome=outcome)
+
+    if charge is None:
+        fail_purchase(purchase.pk, error)
+        return
+
+    if charge["status"] == "succeeded":
+        confirm_purchase(purchase.pk, charge)
+    elif charge["status"] == "failed":
+        fail_purchase(purchase.pk, charge.get("failure_message") or "The payment failed")
+    else:  # Confirmed later by the charge.succeeded webhook
+        Purchase.objects.filter(pk=purchase.pk).update(charge_id=charge["id"])
+
+
+def confirm_purchase(purchase_id, charge):
+    """
+    Mark a pending Purchase as paid, which adds its credit (see
+    increase_track_credit_on_purchase). The row is locked, so the job and the
+    webhook can't both confirm it. Returns True if it was pending.
+    """
+    with transaction.atomic():
+        purchase = Purchase.objects.select_for_update().get(pk=purchase_id)
+        if purchase.status != Purchase.STATUS_PENDING:
+            return False
+        purchase.status = Purchase.STATUS_PAID
+        purchase.set_charge(charge)
+        purchase.stripe_token = ""
+        purchase.save()
+        ChargePayload.store(purchase, charge)
+    return True
+
+
+def update_charge(charge):
+    """
+    Update the charge fields and payload of the Purchase of a charge, e.g.
+    after a refund. Returns True if there was such a Purchase.
+    """
+    with transaction.atomic():
+        purchase = Purchase.objects.select_for_update().filter(charge_id=charge["id"]).first()
+        if purchase is None:
+            return False
+        fields = purchase.set_charge(charge)
+        Purchase.objects.filter(pk=purchase.pk).update(**fields)
+        ChargePayload.store(purchase, charge)
+    return True
+
+
+def fail_purchase(purchase_id, error):
+    """
+    Mark a pending Purchase as failed. Returns True if it was pending.
+    """
+    return bool(Purchase.objects.filter(
+        pk=purchase_id, status=Purchase.STATUS_PENDING).update(
+            status=Purchase.STATUS_FAILED, error=error[:255], stripe_token=""))
+
+
+def verify_signature(payload, header, secret, tolerance=WEBHOOK_TOLERANCE):
+    """
+    Check the Stripe-Signature header of a webhook request: an HMAC-SHA256 of
+    "<timestamp>.<payload>" with the endpoint secret. Raises ValueError.
+    """
+    if not secret:
+        raise ValueError("STRIPE_WEBHOOK_SECRET is not set")
+    items = [item.split("=", 1) for item in header.split(",") if "=" in item]
+    timestamps = [value for key, value in items if key == "t"]
+    signatures = [value for key, value in items if key == "v1"]
+    if not timestamps or not signatures:
+        raise ValueError("Malformed signature header")
+    try:
+        timestamp = int(timestamps[0])
+    except ValueError:
+        raise ValueError("Malformed signature header")
+    if abs(time.time() - timestamp) > tolerance:
+        raise ValueError("Signature timestamp outside of the tolerance")
+
+    signed = b"%d." % timestamp + payload
+    expected = hmac.new(secret.encode("utf-8"), signed, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(str(expected), str(s)) for s in signatures):
+        raise ValueError("Invalid signature")
+
+
+def handle_event(event):
+    """
+    Apply a Stripe webhook event to its Purchase. Events can arrive more than
+    once and in any order, so they only ever move pending Purchases.
+    Refunds update the charge fields of paid Purchases.
+    Returns True if a Purchase was changed.
+    """
+    if event.get("type") == "charge.refunded":
+        return update_charge(event["data"]["object"])
+    if event.get("type") not in ("charge.succeeded", "charge.failed"):
+        return False
+    charge = event["data"]["object"]
+    purchase_id = charge.get("metadata", {}).get("purchase_id")
+    purchases = Purchase.objects.filter(status=Purchase.STATUS_PENDING)
+    if purchase_id:
+        purchases = purchases.filter(pk=purchase_id)
+    else:
+        purchases = purchases.filter(charge_id=charge["id"])
+    pk = purchases.values_list("pk", flat=True).first()
+    if pk is None:
+        return False
+
+    if event["type"] == "charge.succeeded":
+        return confirm_purchase(pk, charge)
+    return fail_purchase(pk, charge.get("failure_message") or "The payment failed")
+
+
+def parse_event(payload, header):
+    """
+    The event of a verified webhook request. Raises ValueError.
+    """
+    verify_signature(payload, header, settings.STRIPE_WEBHOOK_SECRET)
+    return json.loads(payload.decode("utf-8"))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+# Same expression as the SQL of icontains on PostgreSQL, so the admin's
+# user__username / user__email searches can use the indexes
+INDEXES = (
+    ("purchases_user_username_trgm", "username"),
+    ("purchases_user_email_trgm", "email"),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = apps.get_model(*settings.AUTH_USER_MODEL.split("."))._meta.db_table
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, column in INDEXES:
+        schema_editor.execute(
+            "CREATE INDEX %s ON %s USING gin (UPPER(%s::text) gin_trgm_ops)" % (
+                name, schema_editor.quote_name(table), schema_editor.quote_name(column)))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS %s" % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('purchases', '0002_storage_usage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchases', '0003_user_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='charge_id',
+            field=models.CharField(db_index=True, verbose_name='Stripe charge', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='error',
+            field=models.CharField(verbose_name='Error', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='status',
+            field=models.PositiveSmallIntegerField(default=1, db_index=True, verbose_name='Status', choices=[(0, 'Pending'), (1, 'Paid'), (2, 'Failed')]),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='stripe_token',
+            field=models.CharField(max_length=255, editable=False, blank=True),
+        ),
+    ]
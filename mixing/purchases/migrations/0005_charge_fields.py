@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import ast
+import json
+import zlib
+from decimal import Decimal
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def parse_charge_details(text):
+    """
+    charge_details held str() of a Stripe charge (JSON), or of a plain dict.
+    """
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            charge = parse(text)
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(charge, dict):
+            return charge
+    return None
+
+
+def charge_fields(charge):
+    """
+    The Purchase column values of a Stripe charge (a dict).
+    A copy of mixing.purchases.models.charge_fields() as of this migration.
+    """
+    card = ((charge.get("payment_method_details") or {}).get("card") or
+            charge.get("source") or {})
+    balance = charge.get("balance_transaction")
+    fee = balance.get("fee") if isinstance(balance, dict) else None
+    return {
+        "charge_id": charge.get("id") or "",
+        "charge_status": charge.get("status") or "",
+        "card_last4": (card.get("last4") or "")[-4:],
+        "fee": None if fee is None else Decimal(fee) / 100,
+        "amount_refunded": Decimal(charge.get("amount_refunded") or 0) / 100,
+        "refunded": bool(charge.get("refunded")),
+    }
+
+
+def split_charge_details(apps, schema_editor):
+    """
+    Move the charge details of existing Purchases to the new columns and to
+    compressed ChargePayloads, BATCH_SIZE rows at a time.
+    """
+    Purchase = apps.get_model("purchases", "Purchase")
+    ChargePayload = apps.get_model("purchases", "ChargePayload")
+    rows = Purchase.objects.exclude(charge_details="").order_by("pk")
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk).values_list("pk", "charge_details")[:BATCH_SIZE])
+        if not batch:
+            return
+        last_pk = batch[-1][0]
+        payloads = []
+        for pk, text in batch:
+            charge = parse_charge_details(text)
+            if charge is not None:
+                Purchase.objects.filter(pk=pk).update(**charge_fields(charge))
+            data = json.dumps(text if charge is None else charge, sort_keys=True)
+            payloads.append(ChargePayload(
+                purchase_id=pk, data=zlib.compress(data.encode("utf-8"), 9)))
+        ChargePayload.objects.bulk_create(payloads)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchases', '0004_pending_purchases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChargePayload',
+            fields=[
+                ('purchase', models.OneToOneField(related_name='charge_payload', primary_key=True, serialize=False, to='purchases.Purchase')),
+                ('data', models.BinaryField(verbose_name='Data')),
+            ],
+            options={
+                'verbose_name': 'charge payload',
+                'verbose_name_plural': 'charge payloads',
+            },
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='amount_refunded',
+            field=models.DecimalField(default=0, verbose_name='Refunded', editable=False, max_digits=6, decimal_places=2),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='card_last4',
+            field=models.CharField(verbose_name='Card', max_length=4, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='charge_status',
+            field=models.CharField(db_index=True, verbose_name='Charge status', max_length=20, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='fee',
+            field=models.DecimalField(verbose_name='Stripe fee', null=True, editable=False, max_digits=6, decimal_places=2),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='refunded',
+            field=models.BooleanField(default=False, verbose_name='Fully refunded', editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='purchase',
+            index_together=set([('status', 'created')]),
+        ),
+        migrations.RunPython(split_charge_details, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='purchase',
+            name='charge_details',
+        ),
+    ]
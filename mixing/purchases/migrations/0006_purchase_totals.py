@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+PAID = 1
+
+
+def compute_totals(apps, schema_editor):
+    """
+    Start the totals from the existing paid Purchases and Tracks.
+    """
+    UserProfile = apps.get_model("purchases", "UserProfile")
+    Purchase = apps.get_model("purchases", "Purchase")
+    Track = apps.get_model("mixing", "Track")
+    purchases = Purchase.objects.filter(status=PAID).order_by().values_list("user").annotate(
+        credits=Sum("credits"), amount=Sum("amount"))
+    for user_id, credits, amount in purchases:
+        UserProfile.objects.filter(user_id=user_id).update(
+            credits_purchased=credits, amount_paid=amount)
+    tracks = Track.objects.order_by().values_list("group__song__project__owner").annotate(
+        count=Count("pk"))
+    for user_id, count in tracks:
+        UserProfile.objects.filter(user_id=user_id).update(credits_spent=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0014_search_document'),
+        ('purchases', '0005_charge_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='amount_paid',
+            field=models.DecimalField(default=0, verbose_name='Amount paid', editable=False, max_digits=10, decimal_places=2),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='credits_purchased',
+            field=models.PositiveIntegerField(default=0, verbose_name='Credits purchased', editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='credits_spent',
+            field=models.IntegerField(default=0, verbose_name='Credits spent', editable=False),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
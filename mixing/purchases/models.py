@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
 
+import json
+import zlib
+from decimal import Decimal
+
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import F
+from django.db.models import Count, F, Q, Sum
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.utils.encoding import python_2_unicode_compatible
@@ -10,47 +14,193 @@ from django.utils.encoding import python_2_unicode_compatible
 from mezzanine.conf import settings
 from mezzanine.core.models import TimeStamped
 
+from utils.counters import CounterFieldsMixin
+
+from mixing.metrics import add_credits
+
 
 @python_2_unicode_compatible
-class UserProfile(models.Model):
+class UserProfile(CounterFieldsMixin, models.Model):
     """
     A user profile for mixing projects.
-    Stores the Track Credit balance for each user.
+    Stores the Track Credit balance, purchase totals and storage usage for each user.
     """
     user = models.OneToOneField(settings.AUTH_USER_MODEL, related_name="profile")
     track_credit = models.PositiveIntegerField("Track credit", default=0)
+    storage_bytes = models.BigIntegerField("Storage used", default=0, editable=False)
+
+    # Totals for the purchases dashboard, maintained by the receivers below
+    credits_purchased = models.PositiveIntegerField(
+        "Credits purchased", default=0, editable=False)
+    credits_spent = models.IntegerField("Credits spent", default=0, editable=False)
+    amount_paid = models.DecimalField(
+        "Amount paid", max_digits=10, decimal_places=2, default=0, editable=False)
+
+    # Maintained by mixing.usage.add_storage_usage() and add_to_profile()
+    counter_fields = ["storage_bytes", "credits_purchased", "credits_spent", "amount_paid"]
 
     def __str__(self):
         return str(self.user)
 
 
+class PurchaseQuerySet(models.QuerySet):
+
+    def revenue(self):
+        """
+        Totals of the paid Purchases as a dict: count, credits, and gross,
+        refunded, fees and net amounts. A single aggregate over the
+        (status, created) index, so filter on created to get the revenue of a period.
+        """
+        totals = self.filter(status=Purchase.STATUS_PAID).aggregate(
+            count=Count("pk"), credits=Sum("credits"), gross=Sum("amount"),
+            refunded=Sum("amount_refunded"), fees=Sum("fee"))
+        totals["credits"] = totals["credits"] or 0
+        for field in ("gross", "refunded", "fees"):
+            totals[field] = totals[field] or Decimal("0")
+        totals["net"] = totals["gross"] - totals["refunded"] - totals["fees"]
+        return totals
+
+    def needs_reconciliation(self):
+        """
+        Purchases whose credit and charge disagree: paid without a succeeded
+        charge, or with a refund.
+        """
+        return self.filter(
+            Q(status=Purchase.STATUS_PAID) &
+            (~Q(charge_status="succeeded") | Q(amount_refunded__gt=0))
+        ).exclude(charge_id="")
+
+
 @python_2_unicode_compatible
 class Purchase(TimeStamped):
     """
     A record of each credit purchase made by a user.
+    Purchases made on the dashboard start as pending and are paid by a
+    background job, see mixing.purchases.charges.
     """
+    STATUS_PENDING = 0
+    STATUS_PAID = 1
+    STATUS_FAILED = 2
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_PAID, "Paid"),
+        (STATUS_FAILED, "Failed"),
+    )
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="purchases")
     credits = models.PositiveIntegerField(
         "Credits", validators=[MinValueValidator(1)], default=1)
     amount = models.DecimalField("Amount", max_digits=6, decimal_places=2)
-    charge_details = models.TextField("Charge details", blank=True)
+    status = models.PositiveSmallIntegerField(
+        "Status", choices=STATUS_CHOICES, default=STATUS_PAID, db_index=True)
+    error = models.CharField("Error", max_length=255, blank=True, editable=False)
+
+    # The single-use Stripe token of a pending Purchase, cleared once charged
+    stripe_token = models.CharField(max_length=255, blank=True, editable=False)
+
+    # Fields of the Stripe charge, see set_charge(). The whole charge is in ChargePayload.
+    charge_id = models.CharField(
+        "Stripe charge", max_length=255, blank=True, editable=False, db_index=True)
+    charge_status = models.CharField(
+        "Charge status", max_length=20, blank=True, editable=False, db_index=True)
+    card_last4 = models.CharField("Card", max_length=4, blank=True, editable=False)
+    fee = models.DecimalField(
+        "Stripe fee", max_digits=6, decimal_places=2, null=True, editable=False)
+    amount_refunded = models.DecimalField(
+        "Refunded", max_digits=6, decimal_places=2, default=0, editable=False)
+    refunded = models.BooleanField("Fully refunded", default=False, editable=False)
+
+    objects = PurchaseQuerySet.as_manager()
 
     class Meta:
         ordering = ["-created"]
+        index_together = [("status", "created")]
 
     def __str__(self):
         return str(self.user)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the stored status, so the credit is only added when it changes.
+        """
+        instance = super(Purchase, cls).from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
+
+    def save(self, *args, **kwargs):
+        super(Purchase, self).save(*args, **kwargs)
+        self._loaded_status = self.status
+
+    def set_charge(self, charge):
+        """
+        Copy the fields of a Stripe charge to their columns.
+        Amounts in the charge are in cents.
+        """
+        fields = charge_fields(charge)
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return fields
+
+
+def charge_fields(charge):
+    """
+    The Purchase column values of a Stripe charge (a dict).
+    The fee is only known if the balance_transaction was expanded.
+    """
+    card = ((charge.get("payment_method_details") or {}).get("card") or
+            charge.get("source") or {})
+    balance = charge.get("balance_transaction")
+    fee = balance.get("fee") if isinstance(balance, dict) else None
+    return {
+        "charge_id": charge.get("id") or "",
+        "charge_status": charge.get("status") or "",
+        "card_last4": (card.get("last4") or "")[-4:],
+        "fee": None if fee is None else Decimal(fee) / 100,
+        "amount_refunded": Decimal(charge.get("amount_refunded") or 0) / 100,
+        "refunded": bool(charge.get("refunded")),
+    }
+
+
+class ChargePayload(models.Model):
+    """
+    The complete Stripe charge of a Purchase as compressed JSON.
+    Kept out of the Purchase table so lists of Purchases never load it.
+    """
+    purchase = models.OneToOneField(
+        Purchase, primary_key=True, related_name="charge_payload")
+    data = models.BinaryField("Data")
+
+    class Meta:
+        verbose_name = "charge payload"
+        verbose_name_plural = "charge payloads"
+
+    @classmethod
+    def store(cls, purchase, charge):
+        data = zlib.compress(json.dumps(charge, sort_keys=True).encode("utf-8"), 9)
+        cls.objects.update_or_create(purchase=purchase, defaults={"data": data})
+
+    @property
+    def charge(self):
+        return json.loads(zlib.decompress(bytes(self.data)).decode("utf-8"))
+
 
 @receiver(post_save, sender=Purchase)
 def increase_track_credit_on_purchase(sender, instance, created, **kwargs):
     """
-    Increase the user's track credit on each new Purchase.
+    Increase the user's track credit on each new paid Purchase, or when a
+    pending Purchase is paid. Never more than once per Purchase, since a paid
+    Purchase can't go back to pending.
     """
-    profile, _ = UserProfile.objects.get_or_create(user=instance.user)
-    if created:
-        profile.track_credit = F("track_credit") + instance.credits
-        profile.save()
+    was_pending = getattr(instance, "_loaded_status", None) == Purchase.STATUS_PENDING
+    if instance.status == Purchase.STATUS_PAID and (created or was_pending):
+        add_to_profile(
+            instance.user_id, track_credit=instance.credits,
+            credits_purchased=instance.credits, amount_paid=instance.amount)
+        add_credits("purchase", instance.credits)
+    else:
+        UserProfile.objects.get_or_create(user=instance.user)
 
 
 @receiver(post_delete, sender="mixing.Track")
@@ -58,10 +208,7 @@ def increase_track_credit_on_track_delete(sender, instance, **kwargs):
     """
     Increase the user's track credit when a Track is deleted.
     """
-    user = instance.group.song.project.owner
-    profile, _ = UserProfile.objects.get_or_create(user=user)
-    profile.track_credit = F("track_credit") + 1
-    profile.save()
+    refund_track_credit(instance.get_owner_id(), 1)
 
 
 @receiver(pre_save, sender="mixing.Track")
@@ -72,7 +219,33 @@ def decrease_track_credit_on_track_add(sender, instance, **kwargs):
     and the saving of the track will be prevented.
     """
     if instance.pk is None:  # Only fire for new objects
-        user = instance.group.song.project.owner
-        profile, _ = UserProfile.objects.get_or_create(user=user)
-        profile.track_credit = F("track_credit") - 1
-        profile.save()
+        add_to_profile(instance.get_owner_id(), track_credit=-1, credits_spent=1)
+        add_credits("spend", 1)
+
+
+def add_to_profile(user_id, **amounts):
+    """
+    Add amounts to the credit and counter fields of a user's profile with a
+    single UPDATE, creating the profile if it doesn't exist yet.
+    """
+    updated = UserProfile.objects.filter(user_id=user_id).update(
+        **dict((field, F(field) + amount) for field, amount in amounts.items()))
+    if not updated:
+        UserProfile.objects.create(user_id=user_id, **amounts)
+
+
+def refund_track_credit(user_id, amount):
+    """
+    Give back track credit for several deleted Tracks with a single UPDATE.
+    Used by bulk operations, which skip the per-Track signals above.
+    """
+    add_to_profile(user_id, track_credit=amount, credits_spent=-amount)
+    add_credits("refund", amount)
+
+
+def add_storage_bytes(user_id, amount):
+    """
+    Change the storage usage of a user with a single UPDATE.
+    See mixing.usage.add_storage_usage().
+    """
+    add_to_profile(user_id, storage_bytes=amount)
@@ -1,5 +1,15 @@
 from __future__ import unicode_literals, print_function
 
+import hashlib
+import hmac
+import json
+import threading
+import time
+from decimal import Decimal
+from importlib import import_module
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from urlparse import parse_qs
+
 try:
     from unittest import mock
 except ImportError:
@@ -9,17 +19,25 @@ import stripe
 
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
 
-from utils import status, create_temp_file, get_uid
+from utils import add_site_permission, status, create_temp_file, get_uid
 
+from mixing.bulk import delete_objects
+from mixing.jobs.models import Job
+from mixing.jobs.queue import run_due_jobs
 from mixing.models import Project, Song, Group, Track
+from .charges import CHARGE_ERROR, queue_charge
 from .models import Purchase, UserProfile
 
 User = get_user_model()
 login_url = reverse("login")
 profile_url = reverse("profile_update")
 purchase_url = reverse("purchases:dashboard")
+webhook_url = reverse("purchases:stripe_webhook")
 
 
 def create_track(owner):
@@ -52,7 +70,7 @@ class PurchaseTests(TestCase):
     @mock.patch.object(stripe.Charge, "create")
     @override_settings(PURCHASE_CREDIT_PRICE=10)
     def test_purchase_adds_credit(self, mock_create):
-        mock_create.return_value = {"message": "Mocked"}
+        mock_create.return_value = {"id": "ch_1", "status": "succeeded"}
         data = {
             "stripe_token": "test_token",
             "credits": 10,
@@ -63,6 +81,10 @@ class PurchaseTests(TestCase):
 
         self.assertRedirects(response, purchase_url)  # Means successful submission
         self.assertEquals(Purchase.objects.count(), 1)
+        self.assertFalse(mock_create.called)  # Charged by the job worker
+
+        run_due_jobs()
+        self.assertEqual(mock_create.call_args[1]["amount"], 10000)
         self.user.profile.refresh_from_db()
         self.assertEquals(self.user.profile.track_credit, 10)
 
@@ -99,3 +121,323 @@ class PurchaseTests(TestCase):
         track.delete()
         self.user.profile.refresh_from_db()
         self.assertEquals(self.user.profile.track_credit, 10)
+
+
+class DashboardTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username=get_uid(30), password="test")
+        self.client.login(username=self.user.username, password="test")
+
+    def create_purchases(self, count, **kwargs):
+        Purchase.objects.bulk_create([
+            Purchase(user=self.user, credits=1, amount=10, **kwargs) for _ in range(count)])
+
+    def test_totals(self):
+        Purchase.objects.create(user=self.user, credits=3, amount=30)
+        pending = Purchase.objects.create(
+            user=self.user, credits=5, amount=50, status=Purchase.STATUS_PENDING)
+        track = create_track(owner=self.user)
+        create_track(owner=self.user)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(
+            (profile.credits_purchased, profile.credits_spent, profile.track_credit),
+            (3, 2, 1))
+        self.assertEqual(profile.amount_paid, Decimal("30"))
+
+        track.delete()
+        pending.status = Purchase.STATUS_PAID
+        pending.save()
+        delete_objects(Track.objects.filter(group__song__project__owner=self.user))
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(
+            (profile.credits_purchased, profile.credits_spent, profile.track_credit),
+            (8, 0, 8))
+        self.assertEqual(profile.amount_paid, Decimal("80"))
+
+        response = self.client.get(purchase_url)
+        self.assertContains(response, "<tr><th>Credits purchased</th><td>8</td></tr>")
+        self.assertContains(response, "<tr><th>Total paid</th><td>$80.00</td></tr>")
+
+    def test_pagination(self):
+        self.create_purchases(25)
+        response = self.client.get(purchase_url)
+        self.assertEqual(len(response.context["purchases"].object_list), 20)
+        response = self.client.get(purchase_url, {"page": 2})
+        self.assertEqual(len(response.context["purchases"].object_list), 5)
+
+    def test_project_pagination(self):
+        Project.objects.bulk_create([
+            Project(owner=self.user, title="Project %d" % i, storage_bytes=i)
+            for i in range(25)])
+        response = self.client.get(purchase_url)
+        projects = response.context["projects"].object_list
+        self.assertEqual(len(projects), 20)
+        self.assertEqual(projects[0].storage_bytes, 24)
+        response = self.client.get(purchase_url, {"projects_page": 2})
+        self.assertEqual(len(response.context["projects"].object_list), 5)
+        self.assertEqual(len(response.context["purchases"].object_list), 0)
+
+    def test_constant_queries(self):
+        self.create_purchases(2)
+        # A page of Projects takes a query unless there are none at all
+        UserProfile.objects.filter(user=self.user).update(track_credit=1)
+        create_track(owner=self.user)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(purchase_url)
+        self.create_purchases(200)
+        UserProfile.objects.filter(user=self.user).update(track_credit=1)
+        create_track(owner=self.user)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(purchase_url)
+        self.assertEqual(len(many), len(few))
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    """
+    Answers POST /v1/charges like the Stripe API, including idempotency keys.
+    """
+
+    def do_POST(self):
+        server = self.server
+        params = parse_qs(self.rfile.read(int(self.headers["Content-Length"])))
+        key = self.headers.get("Idempotency-Key")
+        server.requests.append((key, params))
+        mode = server.modes.pop(0) if server.modes else "succeed"
+
+        if mode == "decline":
+            return self.respond(402, {"error": {
+                "type": "card_error", "code": "card_declined",
+                "message": "Your card was declined."}})
+        if mode == "invalid":
+            return self.respond(400, {"error": {
+                "type": "invalid_request_error",
+                "message": "You cannot use a Stripe token more than once."}})
+        if mode == "error" or key not in server.charges:
+            if mode == "error":
+                return self.respond(500, {"error": {"type": "api_error", "message": "Oops"}})
+            server.charges[key] = {
+                "id": "ch_%d" % (len(server.charges) + 1),
+                "object": "charge",
+                "amount": int(params["amount"][0]),
+                "status": "pending" if mode == "pending" else "succeeded",
+                "metadata": {"purchase_id": params["metadata[purchase_id]"][0]},
+                "source": {"object": "card", "brand": "Visa", "last4": "4242"},
+                "amount_refunded": 0,
+                "refunded": False,
+            }
+            expand = [v for k, values in params.items() if k.startswith("expand") for v in values]
+            balance = {"id": "txn_1", "fee": 117}
+            server.charges[key]["balance_transaction"] = (
+                balance if "balance_transaction" in expand else balance["id"])
+        if mode == "lost":  # Charged, but the response never arrives
+            return self.respond(504, {"error": {"type": "api_error", "message": "Timeout"}})
+        self.respond(200, server.charges[key])
+
+    def respond(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeStripe(HTTPServer):
+    """
+    A local Stripe API. `modes` scripts the next responses: "succeed",
+    "pending", "decline", "invalid", "error" or "lost".
+    """
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeStripeHandler)
+        self.requests = []
+        self.charges = {}
+        self.modes = []
+        self.url = "http://127.0.0.1:%d" % self.server_port
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class StripeChargeTests(TestCase):
+
+    def setUp(self):
+        self.stripe = FakeStripe()
+        self.stripe.start()
+        self.addCleanup(self.stripe.stop)
+        patcher = mock.patch.object(stripe, "api_base", self.stripe.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username=get_uid(30), password="test")
+        self.purchase = Purchase.objects.create(
+            user=self.user, credits=3, amount=30, status=Purchase.STATUS_PENDING,
+            stripe_token="tok_visa")
+        queue_charge(self.purchase)
+
+    def assertCredit(self, credits, status=Purchase.STATUS_PAID):
+        self.assertEqual(Purchase.objects.get(pk=self.purchase.pk).status, status)
+        self.assertEqual(UserProfile.objects.get(user=self.user).track_credit, credits)
+
+    def run_jobs(self):
+        Job.objects.filter(status=Job.STATUS_PENDING).update(run_at=now())
+        return run_due_jobs()
+
+    def send_event(self, event_type, charge, secret="whsec_test"):
+        payload = json.dumps({"type": event_type, "data": {"object": charge}})
+        timestamp = int(time.time())
+        signature = hmac.new(
+            secret.encode("utf-8"), b"%d.%s" % (timestamp, payload), hashlib.sha256)
+        return self.client.post(
+            webhook_url, payload, content_type="application/json",
+            HTTP_STRIPE_SIGNATURE="t=%d,v1=%s" % (timestamp, signature.hexdigest()))
+
+    def test_charge(self):
+        self.assertCredit(0, Purchase.STATUS_PENDING)
+        self.assertEqual(self.run_jobs(), (1, 0))
+        self.assertCredit(3)
+        key, params = self.stripe.requests[0]
+        self.assertEqual(key, "purchase-%d" % self.purchase.pk)
+        self.assertEqual(params["amount"], ["3000"])
+        purchase = Purchase.objects.get(pk=self.purchase.pk)
+        self.assertEqual((purchase.charge_id, purchase.stripe_token), ("ch_1", ""))
+
+        # Queueing it again does nothing
+        queue_charge(purchase)
+        self.assertEqual(self.run_jobs(), (0, 0))
+        self.assertEqual(len(self.stripe.requests), 1)
+
+    def test_retry_after_lost_response(self):
+        self.stripe.modes = ["lost", "error"]
+        self.assertEqual(self.run_jobs(), (0, 1))
+        self.assertEqual(self.run_jobs(), (0, 1))
+        self.assertCredit(0, Purchase.STATUS_PENDING)
+        self.assertEqual(self.run_jobs(), (1, 0))
+
+        # Three requests with the same key, a single charge
+        self.assertEqual(len(set(key for key, _ in self.stripe.requests)), 1)
+        self.assertEqual(len(self.stripe.requests), 3)
+        self.assertEqual(len(self.stripe.charges), 1)
+        self.assertCredit(3)
+
+    def test_declined(self):
+        self.stripe.modes = ["decline"]
+        self.assertEqual(self.run_jobs(), (1, 0))
+        self.assertCredit(0, Purchase.STATUS_FAILED)
+        self.assertEqual(
+            Purchase.objects.get(pk=self.purchase.pk).error, "Your card was declined.")
+
+    def test_invalid_request(self):
+        # Not retried, the same token would be rejected again
+        self.stripe.modes = ["invalid"]
+        self.assertEqual(self.run_jobs(), (1, 0))
+        self.assertCredit(0, Purchase.STATUS_FAILED)
+        purchase = Purchase.objects.get(pk=self.purchase.pk)
+        self.assertEqual((purchase.error, purchase.stripe_token), (CHARGE_ERROR, ""))
+        self.assertEqual(len(self.stripe.requests), 1)
+
+    def test_out_of_attempts(self):
+        self.stripe.modes = ["error"] * 8
+        for attempt in range(7):
+            self.assertEqual(self.run_jobs(), (0, 1))
+            self.assertCredit(0, Purchase.STATUS_PENDING)
+        self.assertEqual(self.run_jobs(), (0, 1))
+        self.assertEqual(Job.objects.get().status, Job.STATUS_FAILED)
+        self.assertCredit(0, Purchase.STATUS_FAILED)
+        purchase = Purchase.objects.get(pk=self.purchase.pk)
+        self.assertEqual((purchase.error, purchase.stripe_token), (CHARGE_ERROR, ""))
+
+    def test_webhook_confirms_once(self):
+        self.stripe.modes = ["pending"]
+        self.run_jobs()
+        self.assertCredit(0, Purchase.STATUS_PENDING)
+        charge = dict(list(self.stripe.charges.values())[0], status="succeeded")
+
+        response = self.send_event("charge.succeeded", charge)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCredit(3)
+        # Stripe delivers events at least once
+        self.send_event("charge.succeeded", charge)
+        self.send_event("charge.failed", charge)
+        self.assertCredit(3)
+
+    def test_webhook_and_job_race(self):
+        charge = {"id": "ch_1", "metadata": {"purchase_id": str(self.purchase.pk)}}
+        self.send_event("charge.succeeded", charge)
+        self.assertCredit(3)
+        self.run_jobs()  # Doesn't call Stripe for a paid Purchase
+        self.assertEqual(self.stripe.requests, [])
+        self.assertCredit(3)
+
+    def test_webhook_signature(self):
+        charge = {"id": "ch_1", "metadata": {"purchase_id": str(self.purchase.pk)}}
+        response = self.send_event("charge.succeeded", charge, secret="wrong")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(webhook_url, "{}", content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertCredit(0, Purchase.STATUS_PENDING)
+
+    def test_charge_fields(self):
+        self.run_jobs()
+        purchase = Purchase.objects.get(pk=self.purchase.pk)
+        self.assertEqual(purchase.charge_status, "succeeded")
+        self.assertEqual(purchase.card_last4, "4242")
+        self.assertEqual(purchase.fee, Decimal("1.17"))
+        self.assertEqual(purchase.charge_payload.charge["source"]["brand"], "Visa")
+
+        charge = dict(list(self.stripe.charges.values())[0], amount_refunded=1000)
+        self.send_event("charge.refunded", charge)
+        purchase = Purchase.objects.get(pk=self.purchase.pk)
+        self.assertEqual((purchase.amount_refunded, purchase.refunded), (Decimal("10"), False))
+        self.assertEqual(purchase.charge_payload.charge["amount_refunded"], 1000)
+
+        revenue = Purchase.objects.filter(user=self.user).revenue()
+        self.assertEqual(revenue["count"], 1)
+        self.assertEqual(revenue["net"], Decimal("30") - Decimal("10") - Decimal("1.17"))
+        self.assertEqual(list(Purchase.objects.needs_reconciliation()), [purchase])
+
+    def test_admin_loads_payload_on_demand(self):
+        self.run_jobs()
+        staff = User.objects.create_user(username=get_uid(30), password="staff")
+        staff.is_staff = True
+        staff.is_superuser = True
+        staff.save()
+        add_site_permission(staff)
+        self.client.login(username=staff.username, password="staff")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:purchases_purchase_changelist"))
+        self.assertContains(response, "4242")
+        self.assertFalse(any("chargepayload" in q["sql"] for q in queries.captured_queries))
+
+        response = self.client.get(
+            reverse("admin:purchases_purchase_change", args=[self.purchase.pk]))
+        self.assertContains(response, "txn_1")
+
+
+class ChargeDetailsMigrationTests(TestCase):
+
+    def test_parse_charge_details(self):
+        migration = import_module("mixing.purchases.migrations.0005_charge_fields")
+        charge = {"id": "ch_1", "status": "succeeded", "refunded": True, "amount_refunded": 500,
+                  "source": {"last4": "1881"}}
+        parsed = migration.parse_charge_details(json.dumps(charge, indent=2))
+        self.assertEqual(parsed, charge)
+        self.assertEqual(migration.parse_charge_details(str({"id": "ch_2"})), {"id": "ch_2"})
+        self.assertIsNone(migration.parse_charge_details("Not a charge"))
+
+        fields = migration.charge_fields(parsed)
+        self.assertEqual(fields["card_last4"], "1881")
+        self.assertEqual(fields["amount_refunded"], Decimal("5"))
+        self.assertIsNone(fields["fee"])
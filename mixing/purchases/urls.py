@@ -6,4 +6,5 @@ from . import views
 
 urlpatterns = [
     url(r"^$", views.PurchaseDashboard.as_view(), name="dashboard"),
+    url(r"^stripe/webhook/$", views.StripeWebhook.as_view(), name="stripe_webhook"),
 ]
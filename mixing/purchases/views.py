@@ -1,19 +1,21 @@
 from __future__ import unicode_literals
 
-import stripe
-
 from django import forms
 from django.contrib.messages import success
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.csrf import csrf_exempt
 
 from mezzanine.conf import settings
+from mezzanine.utils.views import paginate
 
-from utils import notify_exception
+from mixing.models import Project
 
-from .models import Purchase
+from .charges import handle_event, parse_event, queue_charge
+from .models import Purchase, UserProfile
 
 
 class PurchaseForm(forms.ModelForm):
@@ -50,6 +52,7 @@ class PurchaseDashboard(generic.edit.FormMixin, generic.TemplateView):
     """
     form_class = PurchaseForm
     template_name = "purchases/dashboard.html"
+    paginate_by = 20
 
     @method_decorator(login_required)
     def dispatch(self, *args, **kwargs):
@@ -62,55 +65,64 @@ class PurchaseDashboard(generic.edit.FormMixin, generic.TemplateView):
 
     def get_context_data(self, **kwargs):
         """
-        Add previous Purchases and PurchaseForm to the context.
+        Add a page of previous Purchases, a page of Projects by storage usage,
+        the purchase totals and storage usage of the profile and the
+        PurchaseForm to the context. Totals are counters kept on the profile
+        (see mixing.purchases.models.add_to_profile()), so the page costs the
+        same whatever the number of Purchases and Projects.
         """
+        profile, _ = UserProfile.objects.get_or_create(user=self.request.user)
+        purchases = Purchase.objects.filter(user=self.request.user).only(
+            "created", "credits", "amount", "status", "error")
+        projects = Project.objects.filter(owner=self.request.user).only(
+            "title", "storage_bytes").order_by("-storage_bytes", "pk")
         kwargs.setdefault("form", self.get_form())
         kwargs.update({
-            "purchases": Purchase.objects.filter(user=self.request.user),
+            "purchases": paginate(
+                purchases, self.request.GET.get("page", 1), self.paginate_by,
+                settings.MAX_PAGING_LINKS),
+            "profile": profile,
+            "projects": paginate(
+                projects, self.request.GET.get("projects_page", 1), self.paginate_by,
+                settings.MAX_PAGING_LINKS),
         })
         return super(PurchaseDashboard, self).get_context_data(**kwargs)
 
-    def create_charge(self, data):
-        """
-        Connect to the Stripe API and create the charge.
-        """
-        stripe.api_key = settings.STRIPE_SK
-
-        try:
-            charge = stripe.Charge.create(
-                currency="usd",
-                amount=data.get("amount", 0) * 100,  # Convert to cents
-                source=data.get("stripe_token"),
-            )
-
-        except stripe.error.CardError as e:
-            error = e.json_body["error"]
-            raise forms.ValidationError(error.get("message", "Your card was declined"))
-
-        except stripe.error.StripeError as e:
-            notify_exception(self.request, e)
-            raise forms.ValidationError("An error occurred during payment")
-
-        return charge
-
     def post(self, request, *args, **kwargs):
         """
-        Validate the form and create the charge.
+        Validate the form and record a pending Purchase.
+        The charge is created by a background job, see mixing.purchases.charges.
         """
         form = self.get_form()
 
         if not form.is_valid():
             return self.form_invalid(form)
 
-        try:
-            charge = self.create_charge(form.cleaned_data)
-        except forms.ValidationError as stripe_error:
-            form.add_error(field=None, error=stripe_error)
-            return self.form_invalid(form)
-
         purchase = form.save(commit=False)
-        purchase.charge_details = str(charge)
         purchase.user = request.user
-        purchase.save()
-        success(request, "Purchase completed successfully", fail_silently=True)
+        purchase.status = Purchase.STATUS_PENDING
+        purchase.stripe_token = form.cleaned_data["stripe_token"]
+        with transaction.atomic():
+            purchase.save()
+            queue_charge(purchase)
+        success(request, "Your payment is being processed, the credits will be added "
+                         "in a moment", fail_silently=True)
         return HttpResponseRedirect(request.path)
+
+
+class StripeWebhook(generic.View):
+    """
+    Receives Stripe events to confirm or fail pending Purchases.
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, *args, **kwargs):
+        return super(StripeWebhook, self).dispatch(*args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            event = parse_event(request.body, request.META.get("HTTP_STRIPE_SIGNATURE", ""))
+        except ValueError:
+            return HttpResponseBadRequest()
+        handle_event(event)
+        return HttpResponse()
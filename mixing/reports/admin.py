@@ -0,0 +1,91 @@
+from __future__ import unicode_literals, absolute_import
+
+from datetime import timedelta
+
+from django.contrib import admin
+from django.db.models import Sum
+
+from mixing.models import Project
+
+from .models import DailyRollup, StatusTransition
+from .turnaround import turnaround_report
+
+# Windows in days of the turnaround percentiles of the status transitions admin
+TURNAROUND_WINDOWS = (7, 30, 90)
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    """
+    The report of revenue and usage. Only reads DailyRollups, see mixing.reports.rollups.
+    """
+    list_display = [
+        "date", "purchases", "revenue", "net_revenue", "credits_sold", "credits_consumed",
+        "projects_created", "projects_completed", "average_turnaround"]
+    date_hierarchy = "date"
+    list_per_page = 31
+    readonly_fields = [f.name for f in DailyRollup._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        """
+        Add the totals of the filtered days and the latest status snapshot.
+        """
+        response = super(DailyRollupAdmin, self).changelist_view(request, extra_context)
+        context = getattr(response, "context_data", None)
+        if not context or "cl" not in context:
+            return response
+        totals = context["cl"].queryset.aggregate(
+            purchases=Sum("purchases"), revenue=Sum("revenue"), refunded=Sum("refunded"),
+            fees=Sum("fees"), credits_sold=Sum("credits_sold"),
+            credits_consumed=Sum("credits_consumed"), projects_created=Sum("projects_created"),
+            projects_completed=Sum("projects_completed"), turnaround=Sum("turnaround"))
+        if totals["projects_completed"]:
+            totals["average_turnaround"] = timedelta(
+                seconds=totals["turnaround"] // totals["projects_completed"])
+        latest = DailyRollup.objects.exclude(projects_by_status="{}").first()
+        if latest is not None:
+            counts = latest.get_projects_by_status()
+            context["projects_by_status"] = [
+                (label, counts.get(status, 0)) for status, label in Project.STATUS_CHOICES]
+            context["status_date"] = latest.date
+        context["totals"] = totals
+        return response
+
+    def net_revenue(self, rollup):
+        return rollup.net_revenue
+    net_revenue.short_description = "Net revenue"
+
+    def average_turnaround(self, rollup):
+        return rollup.average_turnaround or ""
+    average_turnaround.short_description = "Average turnaround"
+
+
+@admin.register(StatusTransition)
+class StatusTransitionAdmin(admin.ModelAdmin):
+    """
+    The log of Project status changes, which is append-only, and the
+    percentiles of the time spent in each status, see mixing.reports.turnaround.
+    """
+    list_display = ["created", "project", "from_status", "to_status"]
+    list_filter = ["to_status"]
+    list_select_related = ["project"]
+    date_hierarchy = "created"
+    raw_id_fields = ["project"]
+    readonly_fields = [f.name for f in StatusTransition._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = dict(extra_context or {}, turnaround=[
+            (days, turnaround_report(days)) for days in TURNAROUND_WINDOWS])
+        return super(StatusTransitionAdmin, self).changelist_view(request, extra_context)
@@ -0,0 +1,42 @@
+from __future__ import unicode_literals, absolute_import
+
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mixing.reports.rollups import rollup_days, update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Update the daily rollups of the reports. Recomputes the last few days, "
+        "or every day since --since to backfill."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since", help="Backfill every day since this date (YYYY-MM-DD)")
+        parser.add_argument(
+            "--loop", action="store_true", default=False,
+            help="Keep running and update the rollups periodically")
+        parser.add_argument(
+            "--interval", type=int, default=600,
+            help="Seconds to wait between updates when running with --loop")
+
+    def handle(self, *args, **options):
+        if options["since"]:
+            try:
+                since = datetime.strptime(options["since"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--since must be a date like 2017-01-31")
+            days = rollup_days(since)
+            self.stdout.write("Backfilled %d days" % days)
+            return
+
+        while True:
+            days = update_rollups()
+            if not options["loop"]:
+                self.stdout.write("Updated %d days" % days)
+                break
+            time.sleep(options["interval"])
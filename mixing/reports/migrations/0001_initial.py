@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateField(unique=True, verbose_name='Date')),
+                ('purchases', models.PositiveIntegerField(default=0, verbose_name='Purchases')),
+                ('revenue', models.DecimalField(default=0, verbose_name='Revenue', max_digits=10, decimal_places=2)),
+                ('refunded', models.DecimalField(default=0, verbose_name='Refunded', max_digits=10, decimal_places=2)),
+                ('fees', models.DecimalField(default=0, verbose_name='Fees', max_digits=10, decimal_places=2)),
+                ('credits_sold', models.PositiveIntegerField(default=0, verbose_name='Credits sold')),
+                ('credits_consumed', models.PositiveIntegerField(default=0, verbose_name='Credits consumed')),
+                ('projects_created', models.PositiveIntegerField(default=0, verbose_name='Projects created')),
+                ('projects_completed', models.PositiveIntegerField(default=0, verbose_name='Projects completed')),
+                ('turnaround', models.BigIntegerField(default=0, help_text='Time from creation to completion, summed over the completed Projects', verbose_name='Total turnaround (seconds)')),
+                ('projects_by_status', models.TextField(default='{}', verbose_name='Projects by status')),
+                ('computed', models.DateTimeField(auto_now=True, verbose_name='Computed')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'verbose_name': 'daily rollup',
+                'verbose_name_plural': 'daily rollups',
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def log_current_statuses(apps, schema_editor, batch_size=1000):
+    """
+    Start the history of existing Projects with their current status, since
+    their last update, which is the closest to when they entered it.
+    """
+    Project = apps.get_model("mixing", "Project")
+    StatusTransition = apps.get_model("reports", "StatusTransition")
+    projects = Project.objects.order_by("pk").values_list("pk", "status", "updated", "created")
+    last = 0
+    while True:
+        batch = list(projects.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            break
+        StatusTransition.objects.bulk_create([
+            StatusTransition(
+                project_id=pk, to_status=status,
+                created=updated or created or django.utils.timezone.now())
+            for pk, status, updated, created in batch])
+        last = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixing', '0015_report_indexes'),
+        ('reports', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusTransition',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('from_status', models.PositiveIntegerField(blank=True, null=True, verbose_name='From status', choices=[(1, 'Waiting for files'), (2, 'In progress'), (3, 'Mixing complete'), (4, 'Waiting for revision files'), (5, 'Revision in progress'), (6, 'Revision complete')])),
+                ('to_status', models.PositiveIntegerField(verbose_name='To status', choices=[(1, 'Waiting for files'), (2, 'In progress'), (3, 'Mixing complete'), (4, 'Waiting for revision files'), (5, 'Revision in progress'), (6, 'Revision complete')])),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created')),
+                ('project', models.ForeignKey(related_name='status_transitions', to='mixing.Project')),
+            ],
+            options={
+                'ordering': ['-created', '-pk'],
+                'verbose_name': 'status transition',
+                'verbose_name_plural': 'status transitions',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='statustransition',
+            index_together=set([('created',), ('project', 'created')]),
+        ),
+        migrations.RunPython(log_current_statuses, migrations.RunPython.noop),
+    ]
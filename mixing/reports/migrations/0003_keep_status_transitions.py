@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0002_status_transitions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='statustransition',
+            name='project',
+            field=models.ForeignKey(related_name='status_transitions', on_delete=django.db.models.deletion.DO_NOTHING, db_constraint=False, to='mixing.Project', null=True),
+        ),
+    ]
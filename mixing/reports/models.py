@@ -0,0 +1,114 @@
+from __future__ import unicode_literals, absolute_import
+
+import json
+from datetime import timedelta
+
+from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.timezone import now
+
+from mixing.models import Project
+from mixing.signals import project_status_changed
+
+
+@python_2_unicode_compatible
+class DailyRollup(models.Model):
+    """
+    The totals of one day, computed from Purchases, Tracks and Projects by
+    mixing.reports.rollups. Reports read these rows only.
+    """
+    date = models.DateField("Date", unique=True)
+
+    # Paid Purchases created on this day
+    purchases = models.PositiveIntegerField("Purchases", default=0)
+    revenue = models.DecimalField("Revenue", max_digits=10, decimal_places=2, default=0)
+    refunded = models.DecimalField("Refunded", max_digits=10, decimal_places=2, default=0)
+    fees = models.DecimalField("Fees", max_digits=10, decimal_places=2, default=0)
+    credits_sold = models.PositiveIntegerField("Credits sold", default=0)
+
+    # One credit per Track uploaded on this day
+    credits_consumed = models.PositiveIntegerField("Credits consumed", default=0)
+
+    projects_created = models.PositiveIntegerField("Projects created", default=0)
+    projects_completed = models.PositiveIntegerField("Projects completed", default=0)
+    turnaround = models.BigIntegerField(
+        "Total turnaround (seconds)", default=0,
+        help_text="Time from creation to completion, summed over the completed Projects")
+
+    # {status: count} of all Projects when the day was last rolled up
+    projects_by_status = models.TextField("Projects by status", default="{}")
+
+    computed = models.DateTimeField("Computed", auto_now=True)
+
+    class Meta:
+        verbose_name = "daily rollup"
+        verbose_name_plural = "daily rollups"
+        ordering = ["-date"]
+
+    def __str__(self):
+        return str(self.date)
+
+    @property
+    def net_revenue(self):
+        return self.revenue - self.refunded - self.fees
+
+    @property
+    def average_turnaround(self):
+        if not self.projects_completed:
+            return None
+        return timedelta(seconds=self.turnaround // self.projects_completed)
+
+    def get_projects_by_status(self):
+        return dict((int(status), count) for status, count in
+                    json.loads(self.projects_by_status).items())
+
+
+@python_2_unicode_compatible
+class StatusTransition(models.Model):
+    """
+    One status change of a Project. Rows are only ever added, by the
+    receivers below, so the log is the history of every Project's status.
+    The first row of a Project has no from_status.
+    Rows outlive their Project: deletes neither cascade nor check the key,
+    and the nullable key makes select_related() keep them (with no Project).
+    """
+    project = models.ForeignKey(
+        Project, related_name="status_transitions", null=True,
+        on_delete=models.DO_NOTHING, db_constraint=False)
+    from_status = models.PositiveIntegerField(
+        "From status", choices=Project.STATUS_CHOICES, null=True, blank=True)
+    to_status = models.PositiveIntegerField("To status", choices=Project.STATUS_CHOICES)
+    created = models.DateTimeField("Created", default=now)
+
+    class Meta:
+        verbose_name = "status transition"
+        verbose_name_plural = "status transitions"
+        ordering = ["-created", "-pk"]
+        index_together = [("project", "created"), ("created",)]
+
+    def __str__(self):
+        return "%s: %s" % (self.project_id, self.get_to_status_display())
+
+
+@receiver(post_save, sender=Project)
+def log_initial_status(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        StatusTransition.objects.create(
+            project=instance, to_status=instance.status, created=instance.created or now())
+
+
+@receiver(project_status_changed, sender=Project)
+def log_status_transitions(sender, project_ids, status, previous_statuses=None, **kwargs):
+    """
+    Log the Projects changed by Project.save() or ProjectQuerySet.set_status(),
+    which covers ProjectSubmit, the admin and the staff API. One query.
+    """
+    previous_statuses = previous_statuses or {}
+    created = now()
+    StatusTransition.objects.bulk_create([
+        StatusTransition(
+            project_id=pk, from_status=previous_statuses.get(pk),
+            to_status=status, created=created)
+        for pk in project_ids])
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals, absolute_import
+
+import json
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count
+from django.utils.timezone import localtime, make_aware, now
+
+from mezzanine.conf import settings
+
+from mixing.models import Project, Track
+from mixing.purchases.models import Purchase
+
+from .models import DailyRollup, StatusTransition
+
+
+def day_range(day):
+    """
+    The start and end of a day in the current time zone, as aware datetimes.
+    """
+    start = make_aware(datetime.combine(day, time.min))
+    end = make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
+
+
+def rollup_day(day):
+    """
+    Recompute the DailyRollup of a day. Every query is limited to the rows
+    created on that day, so the cost doesn't grow with history. Completions
+    are the StatusTransitions to a completed status.
+    The projects_by_status snapshot can only be taken while the day is
+    current, so past days keep the one they have.
+    """
+    start, end = day_range(day)
+    revenue = Purchase.objects.filter(created__gte=start, created__lt=end).revenue()
+    completed = StatusTransition.objects.filter(
+        to_status__in=Project.ALL_DONE, created__gte=start, created__lt=end,
+    ).exclude(from_status__in=Project.ALL_DONE).values_list("project__created", "created")
+    turnaround = [done - created for created, done in completed if created]
+
+    fields = {
+        "purchases": revenue["count"],
+        "revenue": revenue["gross"],
+        "refunded": revenue["refunded"],
+        "fees": revenue["fees"],
+        "credits_sold": revenue["credits"],
+        "credits_consumed": Track.objects.filter(created__gte=start, created__lt=end).count(),
+        "projects_created": Project.objects.filter(created__gte=start, created__lt=end).count(),
+        "projects_completed": len(turnaround),
+        "turnaround": int(sum(t.total_seconds() for t in turnaround)),
+    }
+    if day == localtime(now()).date():
+        counts = Project.objects.order_by().values_list("status").annotate(count=Count("pk"))
+        fields["projects_by_status"] = json.dumps(dict(counts))
+    rollup, _ = DailyRollup.objects.update_or_create(date=day, defaults=fields)
+    return rollup
+
+
+def rollup_days(since, until=None):
+    """
+    Recompute the DailyRollups from `since` to `until` (today by default).
+    Returns the number of days.
+    """
+    until = until or localtime(now()).date()
+    day = since
+    while day <= until:
+        rollup_day(day)
+        day += timedelta(days=1)
+    return (until - since).days + 1
+
+
+def update_rollups():
+    """
+    Recompute the last REPORTS_ROLLUP_DAYS days, which covers late changes
+    like refunds and completions shortly after midnight. Older days only
+    change with a backfill.
+    """
+    today = localtime(now()).date()
+    return rollup_days(today - timedelta(days=settings.REPORTS_ROLLUP_DAYS - 1), today)
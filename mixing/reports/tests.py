@@ -0,0 +1,192 @@
+from __future__ import unicode_literals, absolute_import
+
+from datetime import timedelta
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localtime, now
+
+from utils import add_site_permission, create_temp_file, get_uid, status
+
+from mixing.files import sweep_stale_files
+from mixing.models import Project
+from mixing.purchases.models import Purchase
+
+from .models import DailyRollup, StatusTransition
+from .rollups import rollup_day, update_rollups
+from .turnaround import CACHE_KEY, compute_turnaround
+
+User = get_user_model()
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.today = localtime(now()).date()
+        self.user = User.objects.create_user(username=get_uid(30), password="test")
+        Purchase.objects.create(
+            user=self.user, credits=9, amount=90, status=Purchase.STATUS_PENDING)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_rollup_day(self):
+        # Compared to the day before these objects, other tests may leave rows behind
+        before = DailyRollup.objects.get(pk=rollup_day(self.today).pk)
+        Purchase.objects.create(user=self.user, credits=3, amount=30)
+        Purchase.objects.create(user=self.user, credits=1, amount=10, amount_refunded=10)
+        project = Project.objects.create(title="Project", owner=self.user)
+        group = project.songs.create(title="Song").groups.create(title="Group")
+        group.tracks.create(file=create_temp_file("kick.wav", "audio/x-wav"))
+        done = Project.objects.create(
+            title="Done", owner=self.user, status=Project.STATUS_COMPLETE)
+        Project.objects.filter(pk=done.pk).update(created=now() - timedelta(days=2, hours=1))
+
+        rollup = rollup_day(self.today)
+        self.assertEqual(rollup.purchases - before.purchases, 2)
+        self.assertEqual(rollup.credits_sold - before.credits_sold, 4)
+        self.assertEqual(rollup.revenue - before.revenue, Decimal("40"))
+        self.assertEqual(rollup.net_revenue - before.net_revenue, Decimal("30"))
+        self.assertEqual(rollup.credits_consumed - before.credits_consumed, 1)
+        self.assertEqual(rollup.projects_created - before.projects_created, 1)
+        self.assertEqual(rollup.projects_completed - before.projects_completed, 1)
+        self.assertGreaterEqual(rollup.turnaround - before.turnaround, 2 * 24 * 60 * 60)
+        by_status = rollup.get_projects_by_status()
+        self.assertEqual(
+            by_status[Project.STATUS_COMPLETE],
+            before.get_projects_by_status().get(Project.STATUS_COMPLETE, 0) + 1)
+
+        # Its snapshot can't be taken anymore for the day before
+        yesterday = rollup_day(self.today - timedelta(days=1))
+        self.assertEqual(yesterday.projects_by_status, "{}")
+
+    def test_update_and_backfill(self):
+        self.assertEqual(update_rollups(), 3)
+        self.assertEqual(DailyRollup.objects.count(), 3)
+        since = self.today - timedelta(days=9)
+        out = StringIO()
+        call_command("update_rollups", since=since.isoformat(), stdout=out)
+        self.assertIn("Backfilled 10 days", out.getvalue())
+        self.assertFalse(DailyRollup.objects.filter(date__lt=since).exists())
+
+    def test_report_reads_rollups_only(self):
+        staff = User.objects.create_user(username=get_uid(30), password="staff")
+        staff.is_staff = True
+        staff.is_superuser = True
+        staff.save()
+        add_site_permission(staff)
+        self.client.login(username=staff.username, password="staff")
+        url = reverse("admin:reports_dailyrollup_changelist")
+
+        Project.objects.create(title="Project", owner=self.user)
+        update_rollups()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.context["totals"]["purchases"],
+            DailyRollup.objects.aggregate(total=Sum("purchases"))["total"])
+        self.assertContains(response, "Projects by status on")
+        tables = ("purchases_purchase", "mixing_track", "mixing_project")
+        self.assertFalse(any(
+            table in query["sql"] for query in queries.captured_queries for table in tables))
+
+
+class StatusTransitionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username=get_uid(30), password="test")
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_log(self):
+        project = Project.objects.create(title="Project", owner=self.user)
+        project.status = Project.STATUS_IN_PROGRESS
+        project.save()
+        project.save()  # No change, no row
+        Project.objects.filter(pk=project.pk).set_status(Project.STATUS_COMPLETE)
+        self.assertEqual(
+            list(project.status_transitions.order_by("pk").values_list("from_status", "to_status")),
+            [(None, Project.STATUS_FILES_PENDING),
+             (Project.STATUS_FILES_PENDING, Project.STATUS_IN_PROGRESS),
+             (Project.STATUS_IN_PROGRESS, Project.STATUS_COMPLETE)])
+
+    def test_deleted_project(self):
+        project = Project.objects.create(title="Project", owner=self.user)
+        project.status = Project.STATUS_IN_PROGRESS
+        project.save()
+        pk = project.pk
+        Project.objects.filter(pk=pk).delete()
+        self.assertEqual(StatusTransition.objects.filter(project_id=pk).count(), 2)
+
+        # As listed by the admin
+        transitions = StatusTransition.objects.select_related("project")
+        self.assertEqual([t.project for t in transitions if t.project_id == pk], [None, None])
+
+    def log(self, project, *stays):
+        """
+        Replace the history of a Project with (status, hours since start) rows.
+        """
+        project.status_transitions.all().delete()
+        for status, hours in stays:
+            StatusTransition.objects.create(
+                project=project, to_status=status, created=self.start + timedelta(hours=hours))
+
+    def test_compute_turnaround(self):
+        # In the future, so rows left by other tests aren't in the window
+        self.start = now() + timedelta(days=365)
+        for hours in (2, 4, 6, 8, 40):
+            project = Project.objects.create(title="Project", owner=self.user)
+            self.log(
+                project, (Project.STATUS_FILES_PENDING, -10),
+                (Project.STATUS_IN_PROGRESS, 1), (Project.STATUS_COMPLETE, 1 + hours))
+        # Still in progress, and a stay that ended before the window
+        project = Project.objects.create(title="Project", owner=self.user)
+        self.log(project, (Project.STATUS_FILES_PENDING, -30), (Project.STATUS_IN_PROGRESS, -20))
+
+        report = compute_turnaround(self.start, self.start + timedelta(days=3))
+        statuses = dict(report["statuses"])
+        pending = statuses["Waiting for files"]
+        self.assertEqual(pending["count"], 5)
+        self.assertEqual(pending["p50"], timedelta(hours=11))
+        turnaround = report["turnaround"]
+        self.assertEqual(turnaround["count"], 5)
+        self.assertEqual(turnaround["p50"], timedelta(hours=6))
+        self.assertEqual(turnaround["mean"], timedelta(hours=12))
+        self.assertEqual(turnaround["p90"], timedelta(hours=27, minutes=12))
+        self.assertEqual(statuses["In progress"], turnaround)
+        self.assertEqual(statuses["Mixing complete"]["count"], 0)
+        self.assertIsNone(statuses["Mixing complete"]["p50"])
+
+    def test_admin_caches_report(self):
+        staff = User.objects.create_user(username=get_uid(30), password="staff")
+        staff.is_staff = True
+        staff.is_superuser = True
+        staff.save()
+        add_site_permission(staff)
+        self.client.login(username=staff.username, password="staff")
+        url = reverse("admin:reports_statustransition_changelist")
+        cache.delete_many([CACHE_KEY % days for days in (7, 30, 90)])
+
+        def exports(queries):
+            return [q for q in queries.captured_queries if "IN (SELECT" in q["sql"]]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "Turnaround (in progress to complete)")
+        self.assertTrue(exports(queries))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(exports(queries))
@@ -0,0 +1,100 @@
+from __future__ import unicode_literals, absolute_import
+
+from datetime import timedelta
+
+import numpy as np
+
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from mezzanine.conf import settings
+
+from mixing.models import Project
+
+from .models import StatusTransition
+
+CACHE_KEY = "reports:turnaround:%d"
+
+
+def export_transitions(since, until, batch_size=5000):
+    """
+    The StatusTransitions needed to measure the stays that ended between
+    `since` and `until`: those of the Projects that changed status in the
+    window, up to `until`, so the start of each stay is included.
+    Exported in batches of pk ranges, as (project, status, epoch seconds)
+    NumPy arrays.
+    """
+    window = StatusTransition.objects.filter(created__gte=since, created__lt=until)
+    transitions = StatusTransition.objects.filter(
+        project__in=window.values("project"), created__lt=until,
+    ).order_by("pk").values_list("pk", "project", "to_status", "created")
+
+    projects, statuses, times = [], [], []
+    last = 0
+    while True:
+        batch = list(transitions.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            break
+        for _, project, to_status, created in batch:
+            projects.append(project)
+            statuses.append(to_status)
+            times.append((created - since).total_seconds())
+        last = batch[-1][0]
+    return (
+        np.array(projects, dtype=np.int64), np.array(statuses, dtype=np.int64),
+        np.array(times, dtype=np.float64))
+
+
+def summarize(durations):
+    """
+    The count, mean, p50 and p90 of some durations in seconds, as timedeltas.
+    """
+    if not len(durations):
+        return {"count": 0, "mean": None, "p50": None, "p90": None}
+    p50, p90 = np.percentile(durations, [50, 90])
+    return {
+        "count": len(durations),
+        "mean": timedelta(seconds=int(durations.mean())),
+        "p50": timedelta(seconds=int(p50)),
+        "p90": timedelta(seconds=int(p90)),
+    }
+
+
+def compute_turnaround(since, until):
+    """
+    How long Projects stayed in each status, over the stays that ended in the
+    window, and the mixing turnaround: stays in progress that ended with the
+    work completed. Returns {"statuses": [(label, summary)], "turnaround": summary}.
+    """
+    projects, statuses, times = export_transitions(since, until)
+    # Each Project's transitions in order, consecutive rows are its stays
+    order = np.lexsort((times, projects))
+    projects, statuses, times = projects[order], statuses[order], times[order]
+    same = projects[1:] == projects[:-1]
+    ended = same & (times[1:] >= 0)
+    durations = (times[1:] - times[:-1])[ended]
+    stayed_in = statuses[:-1][ended]
+    moved_to = statuses[1:][ended]
+
+    completed = np.in1d(stayed_in, Project.IN_PROGRESS) & np.in1d(moved_to, Project.ALL_DONE)
+    return {
+        "statuses": [
+            (label, summarize(durations[stayed_in == status]))
+            for status, label in Project.STATUS_CHOICES],
+        "turnaround": summarize(durations[completed]),
+    }
+
+
+def turnaround_report(days):
+    """
+    compute_turnaround() for the last `days` days, cached for
+    REPORTS_TURNAROUND_CACHE_TIMEOUT seconds.
+    """
+    key = CACHE_KEY % days
+    report = cache.get(key)
+    if report is None:
+        until = now()
+        report = compute_turnaround(until - timedelta(days=days), until)
+        report["computed"] = until
+        cache.set(key, report, settings.REPORTS_TURNAROUND_CACHE_TIMEOUT)
+    return report
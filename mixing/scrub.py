@@ -0,0 +1,129 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import time
+
+try:
+    from os import scandir
+except ImportError:  # Python 2
+    from scandir import scandir
+
+from .bulk import file_field_names
+from .files import referenced_names
+from .models import Project, Track, Comment, FinalFile, StaleFile
+from .storage import private_storage
+
+# How to find the owner of each model with files
+OWNER_LOOKUPS = (
+    (Track, "group__song__project__owner"),
+    (Comment, "project__owner"),
+    (FinalFile, "project__owner"),
+)
+
+
+def walk_files(path, throttle=None):
+    """
+    Yield (path, modification time) for all files under a directory.
+    One throttle token is used per directory entry, which limits the
+    amount of metadata I/O on busy disks.
+    """
+    try:
+        entries = list(scandir(path))
+    except OSError:  # Removed in the meantime
+        return
+    for entry in entries:
+        if throttle is not None:
+            throttle.consume(1)
+        if entry.is_dir(follow_symlinks=False):
+            for item in walk_files(entry.path, throttle):
+                yield item
+        elif entry.is_file(follow_symlinks=False):
+            yield entry.path, entry.stat(follow_symlinks=False).st_mtime
+
+
+def partitions():
+    """
+    Split private storage in independent units of work: one per owner ID
+    (covering all sections) plus None for anything not stored in an owner directory.
+    Owners come from both the database and the directories on disk.
+    """
+    owners = set(Project.objects.values_list("owner_id", flat=True).distinct())
+    root = private_storage.location
+    if os.path.isdir(root):
+        for section in scandir(root):
+            if section.is_dir(follow_symlinks=False):
+                owners.update(
+                    int(entry.name) for entry in scandir(section.path)
+                    if entry.name.isdigit() and entry.is_dir(follow_symlinks=False))
+    return sorted(owners) + [None]
+
+
+def stored_names(owner_id):
+    """
+    Stream the names of all files that belong to an owner from the database.
+    """
+    for model, lookup in OWNER_LOOKUPS:
+        queryset = model.objects.filter(**{lookup: owner_id})
+        if model is Track:  # Archived files are not in private storage
+            queryset = queryset.filter(group__song__project__archived__isnull=True)
+        rows = queryset.values_list(*file_field_names(model))
+        for row in rows.iterator():
+            for name in row:
+                if name:
+                    yield name
+
+
+def owner_directories(owner_id):
+    """
+    The directories of an owner in every section (None: the files outside them).
+    """
+    root = private_storage.location
+    if not os.path.isdir(root):
+        return
+    for section in scandir(root):
+        if not section.is_dir(follow_symlinks=False):
+            continue
+        if owner_id is not None:
+            yield os.path.join(section.path, str(owner_id))
+            continue
+        for entry in scandir(section.path):
+            if not (entry.name.isdigit() and entry.is_dir(follow_symlinks=False)):
+                yield entry.path
+
+
+def scrub_partition(owner_id, throttle=None, min_age=0):
+    """
+    Compare the files on disk with the database rows for one partition.
+    Memory use is bounded by the number of files of a single owner.
+    Returns (orphans, missing): files without rows and rows without files.
+    Files modified in the last min_age seconds are never orphans, since
+    their rows may still be in an open transaction.
+    """
+    root = private_storage.location
+    cutoff = time.time() - min_age
+
+    on_disk = {}
+    for directory in owner_directories(owner_id):
+        if os.path.isfile(directory):  # Top level files of a section
+            directory_files = [(directory, os.path.getmtime(directory))]
+        else:
+            directory_files = walk_files(directory, throttle)
+        for path, mtime in directory_files:
+            on_disk[os.path.relpath(path, root).replace(os.sep, "/")] = mtime
+
+    missing = []
+    if owner_id is not None:
+        for name in stored_names(owner_id):
+            if on_disk.pop(name, None) is None and not private_storage.exists(name):
+                missing.append(name)
+
+    # Files are kept if anything at all still references them,
+    # and files that are already queued for deletion are skipped
+    candidates = [name for name, mtime in on_disk.items() if mtime < cutoff]
+    orphans = []
+    for start in range(0, len(candidates), 500):
+        batch = candidates[start:start + 500]
+        known = referenced_names(batch)
+        known.update(StaleFile.objects.filter(name__in=batch).values_list("name", flat=True))
+        orphans.extend(name for name in batch if name not in known)
+    return sorted(orphans), sorted(missing)
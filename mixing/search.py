@@ -0,0 +1,89 @@
+from __future__ import unicode_literals, absolute_import
+
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from utils import display_filename
+
+from .models import Project, Comment, Track, SearchDocument
+
+
+def project_documents(project_ids):
+    """
+    The {project ID: text} SearchDocuments of some Projects, built with three
+    queries whatever the number of Comments and Tracks.
+    """
+    parts = defaultdict(list)
+    projects = Project.objects.filter(pk__in=project_ids).values_list(
+        "pk", "title", "owner__username", "owner__email",
+        "owner__first_name", "owner__last_name")
+    for row in projects:
+        parts[row[0]].extend(row[1:])
+
+    comments = Comment.objects.filter(project__in=parts).values_list("project", "content")
+    for pk, content in comments:
+        parts[pk].append(content)
+
+    tracks = Track.objects.filter(group__song__project__in=parts).values_list(
+        "group__song__project", "filename", "file")
+    for pk, filename, name in tracks:
+        parts[pk].append(filename or display_filename(name))
+
+    return dict(
+        (pk, " ".join(part for part in values if part).lower())
+        for pk, values in parts.items())
+
+
+def update_search_index(project_ids):
+    """
+    Rebuild the SearchDocuments of some Projects.
+    Documents of Projects that no longer exist are removed.
+    """
+    project_ids = set(project_ids)
+    if not project_ids:
+        return
+    documents = project_documents(project_ids)
+    with transaction.atomic():
+        SearchDocument.objects.filter(project__in=project_ids).delete()
+        SearchDocument.objects.bulk_create([
+            SearchDocument(project_id=pk, text=text) for pk, text in documents.items()])
+
+
+def rebuild_search_index(batch_size=500):
+    """
+    Rebuild the SearchDocuments of all Projects. Returns the number of Projects.
+    """
+    pks = list(Project.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(pks), batch_size):
+        update_search_index(pks[start:start + batch_size])
+    return len(pks)
+
+
+def search_projects(queryset, term):
+    """
+    Filter a queryset of Projects to the ones whose SearchDocument contains
+    all words of the search term, ranked by relevance as `search_rank`.
+
+    Documents are lowercased, so the filters are case-sensitive LIKE queries
+    that the pg_trgm index can serve (icontains compares UPPER() values, which
+    the index doesn't cover). On PostgreSQL the rank is the trigram similarity
+    of the document and the term, elsewhere matches in the title rank first.
+    """
+    words = term.lower().split()
+    for word in words:
+        queryset = queryset.filter(search_document__text__contains=word)
+    if not words:
+        return queryset
+
+    if connection.vendor == "postgresql":
+        return queryset.extra(
+            select={"search_rank": "similarity(mixing_searchdocument.text, %s)"},
+            select_params=[" ".join(words)])
+    title = " ".join(words)
+    return queryset.annotate(search_rank=Case(
+        When(title__iexact=title, then=Value(3)),
+        When(title__istartswith=title, then=Value(2)),
+        When(title__icontains=title, then=Value(1)),
+        default=Value(0), output_field=IntegerField()))
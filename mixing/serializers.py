@@ -1,10 +1,13 @@
 from __future__ import unicode_literals, absolute_import
 
+from django.core.urlresolvers import reverse
+
 from rest_framework import serializers
 
-from utils import get_user_display
+from utils import get_user_display, display_filename
+from utils.uploads import uploaded_checksum
 
-from .models import Project, Song, Group, Track, Comment
+from .models import Project, Song, Group, Track, Comment, FinalFile
 
 
 ##########
@@ -14,18 +17,36 @@ from .models import Project, Song, Group, Track, Comment
 class FileMetaDataField(serializers.FileField):
     """
     A FileField with a dictionary representation of its metadata.
+    The size is the one stored on the row (see SizedUpload), so storage is
+    never accessed; missing files are found by the scrub_storage command.
     """
     def to_representation(self, value=None):
         try:
+            filename = getattr(value.instance, "filename", "")
             return {
-                "name": value.name.split("/")[-1],
-                "size": value.size,
+                "name": filename or display_filename(value.name),
+                "size": value.instance.size,
                 "url": getattr(value, "url", None),
             }
-        except (OSError, AttributeError, ValueError):
+        except (AttributeError, ValueError):
             return {}
 
 
+class PeaksUrlField(serializers.Field):
+    """
+    The URL of the peaks endpoint, or None if peaks haven't been extracted yet.
+    """
+    def __init__(self, view_name, **kwargs):
+        self.view_name = view_name
+        kwargs.update(source="*", read_only=True)
+        super(PeaksUrlField, self).__init__(**kwargs)
+
+    def to_representation(self, obj):
+        if not obj.peaks:
+            return None
+        return reverse(self.view_name, args=[obj.pk])
+
+
 ###############
 # Serializers #
 ###############
@@ -53,11 +74,30 @@ class GroupSerializer(serializers.ModelSerializer):
 
 class TrackSerializer(serializers.ModelSerializer):
     file = FileMetaDataField()
+    peaks = PeaksUrlField("track-peaks")
+    preview = serializers.FileField(read_only=True)
+    checksum = serializers.RegexField(
+        r"^[0-9a-fA-F]{64}$", required=False,
+        help_text="SHA-256 of the file as sent by the client, verified on upload")
 
     class Meta:
         model = Track
-        fields = ("group", "file", "id")
-        read_only_fields = ("id",)
+        fields = (
+            "group", "file", "id", "sample_rate", "bit_depth", "channels", "duration",
+            "peaks", "preview", "checksum")
+        read_only_fields = ("id", "sample_rate", "bit_depth", "channels", "duration")
+
+    def validate(self, data):
+        """
+        Reject uploads that don't match the checksum computed by the client.
+        The model stores the server side checksum, see remember_checksum().
+        """
+        expected = data.pop("checksum", None)
+        if expected and "file" in data:
+            if uploaded_checksum(data["file"]) != expected.lower():
+                raise serializers.ValidationError(
+                    {"checksum": "The file was corrupted during the upload"})
+        return data
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -71,3 +111,14 @@ class CommentSerializer(serializers.ModelSerializer):
 
     def get_author(self, comment):
         return get_user_display(comment.author)
+
+
+class FinalFileSerializer(serializers.ModelSerializer):
+    attachment = FileMetaDataField()
+    peaks = PeaksUrlField("finalfile-peaks")
+    preview = serializers.FileField(read_only=True)
+
+    class Meta:
+        model = FinalFile
+        fields = ("id", "project", "title", "attachment", "peaks", "preview", "created")
+        read_only_fields = fields
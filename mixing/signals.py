@@ -0,0 +1,9 @@
+from __future__ import unicode_literals, absolute_import
+
+from django.dispatch import Signal
+
+# Sent once for every status change of one or more Projects, by Project.save()
+# and ProjectQuerySet.set_status(). project_ids are the Projects whose status
+# actually changed, all of them to `status`, and previous_statuses maps each
+# of them to the status it had before.
+project_status_changed = Signal(providing_args=["project_ids", "status", "previous_statuses"])
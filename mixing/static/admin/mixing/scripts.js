@@ -5,7 +5,17 @@ $(document).ready(function() {
 	var $togglers = $('.field-track_browser [data-target]');
 	$togglers.on('click', function toggle() {
 		// The selector stored in data-target will have the 'active' class toggled
-		$(this.dataset.target).toggleClass('active');
+		var $target = $(this.dataset.target);
+		$target.toggleClass('active');
+
+		// The Groups and Tracks of a Song are only loaded the first time it's opened
+		var url = $target.data('url');
+		if (url && !$target.data('loaded')) {
+			$target.data('loaded', true);
+			$target.load(url, function onError(response, status) {
+				if (status === 'error') $target.data('loaded', false);
+			});
+		}
 	});
 });
 
@@ -0,0 +1,343 @@
+from __future__ import unicode_literals, absolute_import
+
+import abc
+import io
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import Storage, FileSystemStorage
+from django.core.signals import setting_changed
+from django.core.urlresolvers import reverse
+from django.dispatch import receiver
+from django.utils import six
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import LazyObject, empty
+from django.utils.module_loading import import_string
+
+from private_storage.storage import PrivateStorage
+
+from utils import has_local_path
+
+# Names generated by mixing.permissions.sharded_path()
+UNIQUE_NAME = re.compile(r"(^|/)[0-9a-f]{32}-[^/]*$")
+
+# Salt of the tokens in the URLs created by LocalObjectStorage
+SIGNED_URL_SALT = "mixing.storage.signed_url"
+
+
+@deconstructible
+class UniquePrivateStorage(PrivateStorage):
+    """
+    Private storage that trusts names built around a UUID to be unique.
+    Django's default get_available_name() stats the file system until it
+    finds a free name, which isn't needed for such names.
+    """
+
+    def __init__(self, location=None, **kwargs):
+        # django-private-storage reads PRIVATE_STORAGE_ROOT only once, at import
+        super(UniquePrivateStorage, self).__init__(
+            location=location or settings.PRIVATE_STORAGE_ROOT, **kwargs)
+
+    def get_available_name(self, name, max_length=None):
+        if UNIQUE_NAME.search(name) and (max_length is None or len(name) <= max_length):
+            return name
+        return super(UniquePrivateStorage, self).get_available_name(
+            name, max_length=max_length)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class ObjectStorage(Storage):
+    """
+    Base class for storages without local paths, which serve their files
+    through short-lived signed URLs. Their url() still points to the
+    serve_private_file view, which checks permissions and then redirects
+    to signed_url(), which every subclass implements.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if UNIQUE_NAME.search(name) and (max_length is None or len(name) <= max_length):
+            return name
+        return super(ObjectStorage, self).get_available_name(name, max_length=max_length)
+
+    def url(self, name):
+        return reverse("serve_private_file", kwargs={"path": name})
+
+    @abc.abstractmethod
+    def signed_url(self, name, content_type=None, disposition=None, expire=None):
+        """
+        A URL that gives access to a single file until it expires (in seconds,
+        PRIVATE_URL_EXPIRE by default), without any further permission checks.
+        """
+
+
+@deconstructible
+class LocalObjectStorage(ObjectStorage):
+    """
+    Stand-in for S3PrivateStorage that keeps the files on the local disk.
+    It doesn't expose local paths, so it runs the same code paths as a
+    remote storage and can be used in tests and development.
+    Signed URLs are served by the serve_signed_file view.
+    """
+
+    def __init__(self, location=None):
+        self.files = FileSystemStorage(location=location or settings.PRIVATE_STORAGE_ROOT)
+
+    def _open(self, name, mode="rb"):
+        return self.files.open(name, mode)
+
+    def _save(self, name, content):
+        return self.files.save(name, content)
+
+    def delete(self, name):
+        self.files.delete(name)
+
+    def exists(self, name):
+        return self.files.exists(name)
+
+    def listdir(self, path):
+        return self.files.listdir(path)
+
+    def size(self, name):
+        return self.files.size(name)
+
+    def modified_time(self, name):
+        return self.files.modified_time(name)
+
+    def signed_url(self, name, content_type=None, disposition=None, expire=None):
+        token = signing.dumps({
+            "name": name,
+            "type": content_type or mimetypes.guess_type(name)[0],
+            "disposition": disposition,
+        }, salt=SIGNED_URL_SALT)
+        return reverse("serve_signed_file", kwargs={"token": token})
+
+    def resolve_signed_url(self, token, expire=None):
+        """
+        The (local path, content type, disposition) of a token from signed_url().
+        Raises signing.BadSignature for invalid or expired tokens.
+        """
+        if expire is None:
+            expire = settings.PRIVATE_URL_EXPIRE
+        data = signing.loads(token, salt=SIGNED_URL_SALT, max_age=expire)
+        return self.files.path(data["name"]), data["type"], data["disposition"]
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only file for an S3 object. Each read is a ranged GET,
+    so reading an audio header doesn't download the whole file.
+    Wrapped in a BufferedReader by S3PrivateStorage._open().
+    """
+
+    def __init__(self, client, bucket, key, size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        last = min(self.position + len(buffer), self.size) - 1
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.key,
+            Range="bytes=%d-%d" % (self.position, last))
+        data = response["Body"].read()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+@deconstructible
+class S3PrivateStorage(ObjectStorage):
+    """
+    Private files in an S3 compatible object store (AWS, MinIO, Ceph...),
+    so that any number of app servers can share them.
+    Files above multipart_threshold bytes are uploaded in parts of
+    multipart_chunksize bytes, max_concurrency at a time. Requires boto3.
+    Credentials are found by boto3 itself (environment, instance role...).
+    """
+    read_buffer_size = 1024 * 1024
+
+    def __init__(self, bucket=None, prefix="", endpoint_url=None, region_name=None,
+                 multipart_threshold=16 * 1024 * 1024,
+                 multipart_chunksize=16 * 1024 * 1024, max_concurrency=4):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise ImproperlyConfigured("S3PrivateStorage requires boto3")
+        self.boto3 = boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency)
+        self._client = None
+        self._client_pid = None
+
+    @property
+    def client(self):
+        """
+        One client per process: clients are thread safe, but their connection
+        pools can't be shared with the workers of a process pool.
+        """
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = self.boto3.session.Session().client(
+                "s3", endpoint_url=self.endpoint_url, region_name=self.region_name)
+            self._client_pid = os.getpid()
+        return self._client
+
+    def key(self, name):
+        return self.prefix + name
+
+    def head(self, name):
+        """
+        The metadata of an object, or None if it doesn't exist.
+        """
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def _open(self, name, mode="rb"):
+        if "w" in mode or "a" in mode:
+            raise ValueError("S3 objects can only be opened for reading")
+        head = self.head(name)
+        if head is None:
+            raise IOError("No such object: %s" % name)
+        reader = S3ObjectReader(self.client, self.bucket, self.key(name), head["ContentLength"])
+        return File(io.BufferedReader(reader, self.read_buffer_size), name)
+
+    def _save(self, name, content):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        # upload_fileobj switches to a multipart upload above the threshold
+        self.client.upload_fileobj(
+            content, self.bucket, self.key(name),
+            ExtraArgs={"ContentType": content_type}, Config=self.transfer_config)
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        return self.head(name) is not None
+
+    def listdir(self, path):
+        prefix = self.key(path.rstrip("/") + "/" if path else "")
+        directories, files = [], []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/"):
+            for common in page.get("CommonPrefixes", []):
+                directories.append(common["Prefix"][len(prefix):].rstrip("/"))
+            for item in page.get("Contents", []):
+                files.append(item["Key"][len(prefix):])
+        return directories, files
+
+    def size(self, name):
+        head = self.head(name)
+        if head is None:
+            raise OSError("No such object: %s" % name)
+        return head["ContentLength"]
+
+    def modified_time(self, name):
+        head = self.head(name)
+        if head is None:
+            raise OSError("No such object: %s" % name)
+        return head["LastModified"].replace(tzinfo=None)
+
+    def signed_url(self, name, content_type=None, disposition=None, expire=None):
+        params = {"Bucket": self.bucket, "Key": self.key(name)}
+        if content_type:
+            params["ResponseContentType"] = content_type
+        if disposition:
+            params["ResponseContentDisposition"] = disposition
+        return self.client.generate_presigned_url(
+            "get_object", Params=params,
+            ExpiresIn=expire or settings.PRIVATE_URL_EXPIRE)
+
+
+class ConfiguredPrivateStorage(LazyObject):
+    """
+    The storage class in PRIVATE_FILE_STORAGE, created on first use with
+    PRIVATE_FILE_STORAGE_OPTIONS as keyword arguments.
+    """
+
+    def _setup(self):
+        storage_class = import_string(settings.PRIVATE_FILE_STORAGE)
+        self._wrapped = storage_class(**settings.PRIVATE_FILE_STORAGE_OPTIONS)
+
+    def deconstruct(self):
+        # Migrations don't depend on the configured backend
+        return ("mixing.storage.ConfiguredPrivateStorage", (), {})
+
+
+# Singleton instance, used by all private file fields
+private_storage = ConfiguredPrivateStorage()
+
+
+@receiver(setting_changed)
+def reset_private_storage(sender, setting, **kwargs):
+    if setting in ("PRIVATE_FILE_STORAGE", "PRIVATE_FILE_STORAGE_OPTIONS",
+                   "PRIVATE_STORAGE_ROOT"):
+        private_storage._wrapped = empty
+
+
+@contextmanager
+def local_copy(storage, name):
+    """
+    The path of a file on the local disk, for code that needs one (memory
+    maps, ffmpeg, ZipFile.write...). Files of remote storages are downloaded
+    to a temporary file that is removed afterwards.
+    """
+    if has_local_path(storage):
+        yield storage.path(name)
+        return
+
+    extension = os.path.splitext(name)[1]
+    handle, path = tempfile.mkstemp(suffix=extension)
+    try:
+        with os.fdopen(handle, "wb") as destination:
+            with storage.open(name) as source:
+                shutil.copyfileobj(source, destination, 1024 * 1024)
+        yield path
+    finally:
+        os.remove(path)
+
+
+# Archives of completed Projects, never served directly
+archive_storage = FileSystemStorage(location=settings.ARCHIVE_STORAGE_ROOT)
@@ -1,16 +1,29 @@
 from __future__ import unicode_literals, absolute_import
 
 from collections import Counter
+from importlib import import_module
 from StringIO import StringIO
 from zipfile import ZipFile
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.apps import apps
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from utils import status, get_uid, create_temp_file, add_site_permission
 
-from mixing.models import Project, Track
+from mixing.bulk import delete_objects, move_objects
+from mixing.files import sweep_stale_files
+from mixing.models import Project, Group, Track, SearchDocument
 
 User = get_user_model()
 admin_login_url = reverse("admin:login")
@@ -77,11 +90,11 @@ class AdminTest(TestCase):
 
     def tearDown(self):
         """
-        Manually remove the Tracks, which will cause the files on disk
-        to be removed by django-cleanup.
+        Manually remove the Tracks and sweep the queued files from disk.
         This way running tests won't leave left-over files.
         """
         Track.objects.all().delete()
+        sweep_stale_files()
 
     def test_zip_download(self):
         # Anon user should be redirected to login page
@@ -104,3 +117,271 @@ class AdminTest(TestCase):
         # http://stackoverflow.com/a/7829388/1330003
         z = ZipFile(StringIO(response.content), "r")
         self.assertEqual(Counter(expected_zip_structure), Counter(z.namelist()))
+
+
+class ProjectChangelistTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username=get_uid(30), password="staff")
+        self.staff.is_staff = True
+        self.staff.is_superuser = True
+        self.staff.save()
+        add_site_permission(self.staff)
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.owner.profile.track_credit = 10
+        self.owner.profile.save()
+        self.url = reverse("admin:mixing_project_changelist")
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def create_projects(self, count):
+        for i in range(count):
+            Project.objects.create(title="Project %d" % i, owner=self.owner)
+
+    def test_with_activity(self):
+        project = Project.objects.create(title="Busy", owner=self.owner)
+        group = project.songs.create(title="Song").groups.create(title="Group")
+        group.tracks.create(file=create_temp_file("kick.wav", "audio/x-wav"))
+        last = group.tracks.create(file=create_temp_file("snare.wav", "audio/x-wav"))
+        project.comments.create(author=self.owner, content="Hi")
+        Project.objects.create(title="Empty", owner=self.owner)
+
+        projects = Project.objects.filter(owner=self.owner).with_activity()
+        busy, empty = projects.order_by("-track_count")
+        self.assertEqual((busy.track_count, busy.comment_count), (2, 1))
+        self.assertEqual((empty.track_count, empty.comment_count), (0, 0))
+        self.assertIsNone(empty.last_upload)
+
+        self.client.login(username=self.staff.username, password="staff")
+        response = self.client.get(self.url, {"o": "-6", "q": self.owner.username})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.context["cl"].result_list[0]
+        self.assertEqual(result, busy)
+        self.assertEqual(
+            response.context["cl"].model_admin.last_upload(result), last.created)
+
+    def test_activity_only_in_changelist(self):
+        project = Project.objects.create(title="Busy", owner=self.owner)
+        self.client.login(username=self.staff.username, password="staff")
+        response = self.client.get(reverse("admin:mixing_project_change", args=[project.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(hasattr(response.context["original"], "track_count"))
+
+    def test_backfill_timestamps(self):
+        migration = import_module("mixing.migrations.0013_track_timestamps")
+        project = Project.objects.create(title="Old", owner=self.owner)
+        group = project.songs.create(title="Song").groups.create(title="Group")
+        old = group.tracks.create(file=create_temp_file("kick.wav", "audio/x-wav"))
+        new = group.tracks.create(file=create_temp_file("snare.wav", "audio/x-wav"))
+        Track.objects.filter(pk=old.pk).update(created=None, updated=None)
+
+        migration.backfill_timestamps(apps, None)
+        old.refresh_from_db()
+        self.assertEqual((old.created, old.updated), (project.created, project.created))
+        self.assertEqual(Track.objects.get(pk=new.pk).created, new.created)
+
+    def test_constant_queries(self):
+        self.client.login(username=self.staff.username, password="staff")
+        self.create_projects(5)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        self.create_projects(95)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["cl"].result_list), 100)  # A full page
+        self.assertEqual(len(many), len(few))
+
+    def test_delete_selected(self):
+        self.create_projects(2)
+        self.client.login(username=self.staff.username, password="staff")
+        response = self.client.post(self.url, {
+            "action": "delete_selected", "post": "yes",
+            "_selected_action": Project.objects.values_list("pk", flat=True),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Project.objects.exists())
+
+
+class TrackBrowserTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(username=get_uid(30), password="staff")
+        self.staff.is_staff = True
+        self.staff.is_superuser = True
+        self.staff.save()
+        add_site_permission(self.staff)
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.owner.profile.track_credit = 50
+        self.owner.profile.save()
+        self.project = Project.objects.create(title="Project", owner=self.owner)
+        self.song = self.project.songs.create(title="Song")
+        self.group = self.song.groups.create(title="Group")
+        self.song_url = reverse(
+            "admin:mixing_project_song", args=[self.project.pk, self.song.pk])
+        self.client.login(username=self.staff.username, password="staff")
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def add_tracks(self, count, group=None):
+        for i in range(count):
+            (group or self.group).tracks.create(
+                file=create_temp_file("track%d.wav" % i, "audio/x-wav"))
+
+    def song_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.song_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(context)
+
+    def test_songs_only(self):
+        self.add_tracks(2)
+        url = reverse("admin:mixing_project_change", args=[self.project.pk])
+        response = self.client.get(url)
+        self.assertContains(response, "1 group, 2 tracks")
+        self.assertContains(response, 'data-url="%s"' % self.song_url)
+        self.assertNotContains(response, "track1.wav")
+
+    def test_constant_queries(self):
+        self.add_tracks(2)
+        response, few = self.song_queries()
+        self.assertContains(response, "track1.wav")
+
+        self.add_tracks(20, group=self.song.groups.create(title="Other"))
+        response, many = self.song_queries()
+        self.assertContains(response, "track19.wav")
+        self.assertLessEqual(many, few)
+
+        # Served from the cache until something changes, without the Groups and Tracks queries
+        _, cached = self.song_queries()
+        self.assertEqual(cached, many - 2)
+
+    def test_invalidation(self):
+        self.add_tracks(1)
+        self.song_queries()
+        track = self.group.tracks.create(file=create_temp_file("new.wav", "audio/x-wav"))
+        self.assertContains(self.client.get(self.song_url), "new.wav")
+
+        other = self.song.groups.create(title="Other")
+        move_objects(Track.objects.filter(pk=track.pk), "group", other)
+        response = self.client.get(self.song_url)
+        self.assertContains(response, "Group 2: Other")
+
+        delete_objects(Group.objects.filter(pk=other.pk))
+        self.assertNotContains(self.client.get(self.song_url), "new.wav")
+
+    def test_staff_only(self):
+        self.client.login(username=self.owner.username, password="owner")
+        response = self.client.get(self.song_url)
+        self.assertEqual(response.status_code, 302)
+
+
+class ProjectSearchTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username=get_uid(30), password="staff")
+        self.staff.is_staff = True
+        self.staff.is_superuser = True
+        self.staff.save()
+        add_site_permission(self.staff)
+        self.owner = User.objects.create_user(
+            username=get_uid(30), password="owner", email="Ringo@Example.com")
+        self.owner.profile.track_credit = 10
+        self.owner.profile.save()
+        self.project = Project.objects.create(title="Abbey Sessions", owner=self.owner)
+        self.group = self.project.songs.create(title="Song").groups.create(title="Group")
+        self.url = reverse("admin:mixing_project_changelist")
+        self.client.login(username=self.staff.username, password="staff")
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def search(self, term):
+        response = self.client.get(self.url, {"q": term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return list(response.context["cl"].result_list)
+
+    def test_populate_migration(self):
+        migration = import_module("mixing.migrations.0014_search_document")
+        self.project.comments.create(author=self.owner, content="More Cowbell please")
+        self.group.tracks.create(file=create_temp_file("Tambourine.wav", "audio/x-wav"))
+        expected = dict(SearchDocument.objects.values_list("project", "text"))
+        SearchDocument.objects.all().delete()
+
+        migration.populate_documents(apps, None)
+        self.assertEqual(dict(SearchDocument.objects.values_list("project", "text")), expected)
+        self.assertEqual(self.search("cowbell"), [self.project])
+
+    def test_document(self):
+        self.project.comments.create(author=self.owner, content="More Cowbell please")
+        self.group.tracks.create(file=create_temp_file("Tambourine.wav", "audio/x-wav"))
+        self.assertEqual(self.search("cowbell"), [self.project])
+        self.assertEqual(self.search("TAMBOURINE"), [self.project])
+        self.assertEqual(self.search("ringo@example"), [self.project])
+        self.assertEqual(self.search("abbey cowbell"), [self.project])
+        self.assertEqual(self.search("abbey triangle"), [])
+
+    def test_ranking(self):
+        self.group.tracks.create(file=create_temp_file("glockenspiel.wav", "audio/x-wav"))
+        titled = Project.objects.create(title="Glockenspiel", owner=self.owner)
+        self.assertEqual(self.search("glockenspiel"), [titled, self.project])
+
+        # Sorting by a column wins over the rank
+        response = self.client.get(self.url, {"q": "glockenspiel", "o": "1"})
+        self.assertEqual(
+            list(response.context["cl"].result_list), [self.project, titled])
+
+    def test_updates(self):
+        track = self.group.tracks.create(file=create_temp_file("theremin.wav", "audio/x-wav"))
+        other = Project.objects.create(title="Other", owner=self.owner)
+        other_group = other.songs.create(title="Song").groups.create(title="Group")
+        move_objects(Track.objects.filter(pk=track.pk), "group", other_group)
+        self.assertEqual(self.search("theremin"), [other])
+
+        delete_objects(Track.objects.filter(pk=track.pk))
+        self.assertEqual(self.search("theremin"), [])
+
+        self.owner.email = "starr@example.com"
+        self.owner.save()
+        self.assertEqual(len(self.search("starr@example")), 2)
+        self.assertEqual(self.search("ringo@example"), [])
+
+    def test_unchanged_fields(self):
+        track = self.group.tracks.create(file=create_temp_file("cowbell.wav", "audio/x-wav"))
+        with mock.patch("mixing.search.update_search_index") as update:
+            self.client.login(username=self.owner.username, password="owner")
+            owner = User.objects.get(pk=self.owner.pk)
+            owner.is_active = True
+            owner.save()
+
+            project = Project.objects.get(pk=self.project.pk)
+            project.status = Project.STATUS_IN_PROGRESS
+            project.save()
+
+            track = Track.objects.get(pk=track.pk)
+            track.duration = 1.5
+            track.save()
+
+            self.client.login(username=self.staff.username, password="staff")
+        self.assertFalse(update.called)
+
+        # Moving a Track one by one updates both Projects
+        other = Project.objects.create(title="Other", owner=self.owner)
+        track.group = other.songs.create(title="Song").groups.create(title="Group")
+        track.save()
+        self.assertEqual(self.search("cowbell"), [other])
+
+        project.title = "Abbey Road"
+        project.save()
+        self.assertEqual(self.search("road"), [self.project])
+
+    def test_rebuild(self):
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.search("abbey"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.search("abbey"), [self.project])
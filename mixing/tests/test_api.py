@@ -1,14 +1,18 @@
 from __future__ import unicode_literals
 
+import django
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
 from django.db import transaction
+from django.db.models.signals import post_delete
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from utils import create_temp_file, get_uid
-from mixing.models import Project, Song, Group, Track, Comment
+from mixing.bulk import BULK_RECEIVERS, delete_rows
+from mixing.files import sweep_stale_files
+from mixing.models import Project, Song, Group, Track, Comment, StaleFile
 
 User = get_user_model()
 
@@ -396,11 +400,11 @@ class TrackAPITests(APITestCase):
 
     def tearDown(self):
         """
-        Manually remove the Tracks, which will cause the files on disk
-        to be removed by django-cleanup.
+        Manually remove the Tracks and sweep the queued files from disk.
         This way running tests won't leave left-over files.
         """
         Track.objects.all().delete()
+        sweep_stale_files()
 
     def test_create_track_on_active_group(self):
         url = reverse("track-list")
@@ -590,11 +594,11 @@ class CommentAPITests(APITestCase):
 
     def tearDown(self):
         """
-        Manually remove the Comments, which will cause the files on disk
-        to be removed by django-cleanup.
+        Manually remove the Comments and sweep the queued files from disk.
         This way running tests won't leave left-over files.
         """
         Comment.objects.all().delete()
+        sweep_stale_files()
 
     def test_create_comment_on_active_project(self):
         url = reverse("comment-list")
@@ -782,3 +786,132 @@ class CommentAPITests(APITestCase):
         # Nothing should have changed
         self.assertEqual(Comment.objects.count(), 1)
         self.assertEqual(Comment.objects.get().content, "Existing comment")
+
+
+class BulkAPITests(APITestCase):
+    def setUp(self):
+        create_track_dependencies(self)
+        self.owner.profile.track_credit = 3
+        self.owner.profile.save()
+        self.tracks = [
+            self.active_group.tracks.create(file="file%s.wav" % i) for i in range(3)
+        ]
+
+    def tearDown(self):
+        Track.objects.all().delete()
+        sweep_stale_files()
+
+    def test_bulk_delete_tracks(self):
+        url = reverse("track-bulk-delete")
+        data = {"ids": [t.pk for t in self.tracks[:2]]}
+
+        # User is anon
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # User is not owner
+        self.client.force_authenticate(user=self.non_owner)
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Track.objects.count(), 3)
+
+        # User is owner
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"deleted": 2})
+        self.assertEqual(Track.objects.count(), 1)
+
+        # Credit is refunded and the files are queued for deletion
+        self.owner.profile.refresh_from_db()
+        self.assertEqual(self.owner.profile.track_credit, 2)
+        self.assertEqual(
+            sorted(StaleFile.objects.values_list("name", flat=True)),
+            ["file0.wav", "file1.wav"])
+
+    def test_bulk_delete_song(self):
+        url = reverse("song-bulk-delete")
+        data = {"ids": [self.active_song.pk]}
+
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Song.objects.filter(pk=self.active_song.pk).count(), 0)
+        self.assertEqual(Group.objects.filter(pk=self.active_group.pk).count(), 0)
+        self.assertEqual(Track.objects.count(), 0)
+        self.owner.profile.refresh_from_db()
+        self.assertEqual(self.owner.profile.track_credit, 3)
+
+    def test_bulk_delete_on_inactive_project(self):
+        url = reverse("group-bulk-delete")
+        data = {"ids": [self.active_group.pk, self.inactive_group.pk]}
+
+        # A single object in an inactive project rejects the whole request
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(Group.objects.filter(pk=self.active_group.pk).exists())
+        self.assertTrue(Group.objects.filter(pk=self.inactive_group.pk).exists())
+        self.assertEqual(Track.objects.count(), 3)
+
+    def test_bulk_move_tracks(self):
+        url = reverse("track-bulk-move")
+        other_group = self.active_song.groups.create(title="Other group")
+        data = {"ids": [t.pk for t in self.tracks], "group": other_group.pk}
+
+        # User is not owner
+        self.client.force_authenticate(user=self.non_owner)
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # Target group is on an inactive project
+        self.client.force_authenticate(user=self.owner)
+        data["group"] = self.inactive_group.pk
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(other_group.tracks.count(), 0)
+
+        # User is owner
+        data["group"] = other_group.pk
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"moved": 3})
+        self.assertEqual(other_group.tracks.count(), 3)
+
+        # Moving doesn't touch credits
+        self.owner.profile.refresh_from_db()
+        self.assertEqual(self.owner.profile.track_credit, 0)
+
+
+class BulkDeleteTests(APITestCase):
+    """
+    delete_rows() skips post_delete, so the bulk deletes only stay correct as
+    long as they repeat every receiver of the signal.
+    """
+
+    def test_django_version(self):
+        # QuerySet._raw_delete() is private, check it again when upgrading
+        self.assertEqual(django.VERSION[:2], (1, 8))
+
+    def test_receivers(self):
+        for model, names in BULK_RECEIVERS.items():
+            receivers = post_delete._live_receivers(model)
+            self.assertEqual(
+                sorted("%s.%s" % (r.__module__, r.__name__) for r in receivers),
+                sorted(names))
+
+    def test_no_signals(self):
+        create_track_dependencies(self)
+        self.active_group.tracks.create(file="file.wav")
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance)
+
+        post_delete.connect(receiver, sender=Track)
+        try:
+            delete_rows(Track.objects.all())
+        finally:
+            post_delete.disconnect(receiver, sender=Track)
+        self.assertFalse(Track.objects.exists())
+        self.assertEqual(deleted, [])
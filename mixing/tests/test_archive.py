@@ -0,0 +1,189 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from StringIO import StringIO
+from zipfile import ZipFile
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import DatabaseError, transaction
+from django.test import TestCase
+from django.utils.timezone import now
+
+from utils import add_site_permission, get_uid, status
+
+from mixing.archive import archive_project, projects_to_archive
+from mixing.files import sweep_stale_files
+from mixing.jobs.queue import run_due_jobs
+from mixing.models import Project, Track
+from mixing.storage import archive_storage, private_storage
+
+User = get_user_model()
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.archive_root = tempfile.mkdtemp()
+        patcher = mock.patch.object(archive_storage, "location", self.archive_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.owner.profile.track_credit = 5
+        self.owner.profile.save()
+        self.project = Project.objects.create(
+            title="Project", owner=self.owner, status=Project.STATUS_COMPLETE)
+        song = self.project.songs.create(title="Song")
+        group = song.groups.create(title="Group")
+        self.kick = group.tracks.create(file=ContentFile(b"Kick", name="kick.wav"))
+        self.snare = group.tracks.create(file=ContentFile(b"Snare", name="snare.wav"))
+        self.make_idle(self.project)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+        shutil.rmtree(self.archive_root)
+
+    def make_idle(self, project, days=100):
+        Project.objects.filter(pk=project.pk).update(updated=now() - timedelta(days=days))
+
+    def test_projects_to_archive(self):
+        self.assertIn(self.project, projects_to_archive(days=90))
+        self.assertNotIn(self.project, projects_to_archive(days=120))
+
+        self.project.status = Project.STATUS_IN_PROGRESS
+        self.project.save()
+        self.make_idle(self.project)
+        self.assertNotIn(self.project, projects_to_archive(days=90))
+
+    def test_archive_command(self):
+        out = StringIO()
+        call_command("archive_projects", days=90, stdout=out)
+        self.assertIn("Archived 1 projects (2 files)", out.getvalue())
+
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertIsNotNone(project.archived)
+        self.assertTrue(archive_storage.exists(project.archive))
+        self.assertFalse(private_storage.exists(self.kick.file.name))
+        self.assertFalse(private_storage.exists(self.snare.file.name))
+
+        # The rows are untouched
+        kick = Track.objects.get(pk=self.kick.pk)
+        self.assertEqual(kick.file.name, self.kick.file.name)
+
+        with ZipFile(archive_storage.open(project.archive)) as zip_file:
+            self.assertEqual(zip_file.read(self.kick.file.name), b"Kick")
+
+        # Already archived
+        out = StringIO()
+        call_command("archive_projects", days=90, stdout=out)
+        self.assertIn("Archived 0 projects", out.getvalue())
+
+    def test_reopened_while_archiving(self):
+        """
+        A Project that was reopened in the meantime keeps its files.
+        """
+        Project.objects.filter(pk=self.project.pk).update(
+            status=Project.STATUS_REVISION_FILES_PENDING)
+        self.assertEqual(archive_project(self.project), 0)
+
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertIsNone(project.archived)
+        self.assertEqual(project.archive, "")
+        self.assertTrue(private_storage.exists(self.kick.file.name))
+        self.assertEqual(
+            [files for _, _, files in os.walk(self.archive_root) if files], [])
+
+    def test_restore_on_revision(self):
+        archive_project(self.project)
+        archive = self.project.archive
+        self.kick.delete()
+
+        project = Project.objects.get(pk=self.project.pk)
+        project.status = Project.STATUS_REVISION_FILES_PENDING
+        project.save()
+
+        # Restored by the job worker
+        project.refresh_from_db()
+        self.assertIsNotNone(project.archived)
+        self.assertFalse(private_storage.exists(self.snare.file.name))
+        run_due_jobs()
+
+        project.refresh_from_db()
+        self.assertIsNone(project.archived)
+        self.assertEqual(project.archive, "")
+        self.assertFalse(archive_storage.exists(archive))
+        with private_storage.open(self.snare.file.name) as f:
+            self.assertEqual(f.read(), b"Snare")
+        # Deleted Tracks are not restored
+        self.assertFalse(private_storage.exists(self.kick.file.name))
+
+    def test_restore_rolled_back(self):
+        archive_project(self.project)
+        try:
+            with transaction.atomic():
+                Project.objects.filter(pk=self.project.pk).set_status(
+                    Project.STATUS_REVISION_FILES_PENDING)
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        run_due_jobs()
+
+        # The archive is still where the Project points to
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertEqual(project.status, Project.STATUS_COMPLETE)
+        self.assertTrue(archive_storage.exists(project.archive))
+        self.assertFalse(private_storage.exists(self.kick.file.name))
+
+        Project.objects.filter(pk=self.project.pk).set_status(
+            Project.STATUS_REVISION_FILES_PENDING)
+        run_due_jobs()
+        self.assertFalse(archive_storage.exists(project.archive))
+        self.assertTrue(private_storage.exists(self.kick.file.name))
+
+    def test_download_archived_tracks(self):
+        staff = User.objects.create_user(username=get_uid(30), password="staff")
+        staff.is_staff = True
+        staff.save()
+        add_site_permission(staff)
+        archive_project(self.project)
+
+        self.client.login(username=staff.username, password="staff")
+        url = reverse("admin:mixing_project_download", args=[self.project.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with ZipFile(StringIO(response.content)) as zip_file:
+            self.assertEqual(zip_file.read("Song/Group/kick.wav"), b"Kick")
+            self.assertEqual(zip_file.read("Song/Group/snare.wav"), b"Snare")
+
+        # Tracks added after archiving are read from private storage, and
+        # Tracks without a file are left out
+        group = self.kick.group
+        group.tracks.create(file=ContentFile(b"Hat", name="hat.wav"))
+        lost = group.tracks.create(file=ContentFile(b"Tom", name="tom.wav"))
+        private_storage.delete(lost.file.name)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with ZipFile(StringIO(response.content)) as zip_file:
+            self.assertEqual(zip_file.read("Song/Group/hat.wav"), b"Hat")
+            self.assertNotIn("Song/Group/tom.wav", zip_file.namelist())
+
+    def test_delete_archived_project(self):
+        archive_project(self.project)
+        archive = self.project.archive
+        Project.objects.filter(pk=self.project.pk).delete()
+        # Removed by the job worker
+        self.assertTrue(archive_storage.exists(archive))
+        run_due_jobs()
+        self.assertFalse(archive_storage.exists(archive))
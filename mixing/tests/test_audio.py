@@ -0,0 +1,158 @@
+from __future__ import unicode_literals, absolute_import
+
+import aifc
+import struct
+import wave
+from StringIO import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase
+
+from utils import get_uid
+
+from mixing.audio import read_audio_info, AudioFormatError
+from mixing.files import sweep_stale_files
+from mixing.models import Project, Track
+from mixing.processing import analyze_track
+from mixing.serializers import TrackSerializer
+
+User = get_user_model()
+
+
+def create_wav(frames=44100, rate=44100, channels=2, sample_width=2, samples=None):
+    """
+    An in-memory WAV file. Silent unless a string of samples is provided.
+    """
+    f = StringIO()
+    w = wave.open(f, "wb")
+    w.setnchannels(channels)
+    w.setsampwidth(sample_width)
+    w.setframerate(rate)
+    w.writeframes(samples or b"\0" * frames * channels * sample_width)
+    w.close()
+    return f.getvalue()
+
+
+def create_aiff(frames=48000, rate=48000, channels=1, sample_width=3):
+    f = StringIO()
+    f.close = lambda: None  # aifc closes the file it writes to
+    a = aifc.open(f, "wb")
+    a.setnchannels(channels)
+    a.setsampwidth(sample_width)
+    a.setframerate(rate)
+    a.writeframes(b"\0" * frames * channels * sample_width)
+    a.close()
+    return f.getvalue()
+
+
+def create_flac_header(frames=96000 * 3, rate=96000, channels=2, bit_depth=24):
+    """
+    Only the "fLaC" marker and the STREAMINFO block, which is all we parse.
+    """
+    packed = (rate << 44) | ((channels - 1) << 41) | ((bit_depth - 1) << 36) | frames
+    streaminfo = b"\0" * 10 + struct.pack(">Q", packed) + b"\0" * 16
+    # Block header: "last block" flag + type 0 (STREAMINFO), then a 24 bit length
+    header = b"\x80" + struct.pack(">I", len(streaminfo))[1:]
+    return b"fLaC" + header + streaminfo
+
+
+class AudioInfoTests(TestCase):
+
+    def test_wav(self):
+        info = read_audio_info(StringIO(create_wav(frames=22050)))
+        self.assertEqual(info.format, "wav")
+        self.assertEqual(info.sample_rate, 44100)
+        self.assertEqual(info.bit_depth, 16)
+        self.assertEqual(info.channels, 2)
+        self.assertEqual(info.duration, 0.5)
+        self.assertEqual(info.data_offset, 44)
+
+    def test_aiff(self):
+        info = read_audio_info(StringIO(create_aiff()))
+        self.assertEqual(info.format, "aiff")
+        self.assertEqual(info.sample_rate, 48000)
+        self.assertEqual(info.bit_depth, 24)
+        self.assertEqual(info.channels, 1)
+        self.assertEqual(info.duration, 1)
+        self.assertTrue(info.big_endian)
+
+    def test_flac(self):
+        info = read_audio_info(StringIO(create_flac_header()))
+        self.assertEqual(info.format, "flac")
+        self.assertEqual(info.sample_rate, 96000)
+        self.assertEqual(info.bit_depth, 24)
+        self.assertEqual(info.channels, 2)
+        self.assertEqual(info.duration, 3)
+
+    def test_unsupported(self):
+        with self.assertRaises(AudioFormatError):
+            read_audio_info(StringIO(b"Temporary File"))
+        with self.assertRaises(AudioFormatError):
+            read_audio_info(StringIO(create_wav()[:30]))
+
+
+class AnalyzeTrackTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.owner.profile.track_credit = 2
+        self.owner.profile.save()
+        project = Project.objects.create(title="Project", owner=self.owner)
+        self.group = project.songs.create(title="Song").groups.create(title="Group")
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_analyze_track(self):
+        track = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        self.assertIsNone(track.analyzed)
+
+        self.assertTrue(analyze_track(track.pk))
+        track.refresh_from_db()
+        self.assertEqual(track.sample_rate, 44100)
+        self.assertEqual(track.bit_depth, 16)
+        self.assertEqual(track.channels, 2)
+        self.assertEqual(track.duration, 1)
+        self.assertIsNotNone(track.analyzed)
+        self.assertEqual(track.get_audio_display(), "44.1 kHz / 16 bit / 2 ch / 0:01")
+
+        # Running it again gives the same result
+        self.assertTrue(analyze_track(track.pk))
+        track.refresh_from_db()
+        self.assertEqual(track.sample_rate, 44100)
+
+        # A new upload resets the properties
+        track.file = ContentFile(create_aiff(), name="kick.aif")
+        track.save()
+        self.assertIsNone(track.sample_rate)
+        self.assertIsNone(track.analyzed)
+
+    def test_analyze_command(self):
+        wav = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        text = self.group.tracks.create(file=ContentFile(b"Not audio", name="notes.txt"))
+
+        out = StringIO()
+        call_command("analyze_tracks", workers=1, stdout=out)
+        self.assertIn("Analyzed 2 tracks", out.getvalue())
+        wav.refresh_from_db()
+        text.refresh_from_db()
+        self.assertEqual(wav.channels, 2)
+        self.assertIsNone(text.channels)
+        self.assertIsNotNone(text.analyzed)
+
+        # Only new Tracks are analyzed unless --all is used
+        out = StringIO()
+        call_command("analyze_tracks", workers=1, stdout=out)
+        self.assertIn("Analyzed 0 tracks", out.getvalue())
+
+    def test_serializer_output(self):
+        track = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        analyze_track(track.pk)
+        data = TrackSerializer(Track.objects.get(pk=track.pk)).data
+        self.assertEqual(data["sample_rate"], 44100)
+        self.assertEqual(data["bit_depth"], 16)
+        self.assertEqual(data["channels"], 2)
+        self.assertEqual(data["duration"], 1)
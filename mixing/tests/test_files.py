@@ -1,11 +1,32 @@
 from __future__ import unicode_literals, absolute_import
 
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from StringIO import StringIO
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import DatabaseError, transaction
+from django.test import TestCase, override_settings
 
 from utils import status, create_temp_file, get_uid
+from utils.pool import iter_in_threads
+from utils.throttle import TokenBucket
 
-from mixing.models import Project, Song, Group, Track, Comment, FinalFile
+from mixing.files import original_filename, sweep_stale_files
+from mixing.storage import private_storage
+from mixing.models import (
+    Project, Song, Group, Track, Comment, FinalFile, StaleFile)
 
 User = get_user_model()
 
@@ -39,6 +60,10 @@ class PrivateFieldTests(TestCase):
         when used with Postgres, raising InterfaceError: Connection already closed.
         https://groups.google.com/d/msg/django-users/MDRcg4Fur98/cGYs8cmQLAAJ
         """
+        cls.directory = tempfile.mkdtemp()
+        cls.settings = override_settings(PRIVATE_STORAGE_ROOT=cls.directory)
+        cls.settings.enable()
+
         cls.staff_data = {"username": get_uid(30), "password": "staff"}
         cls.staff = User.objects.create_user(**cls.staff_data)
         cls.staff.is_staff = True
@@ -57,13 +82,16 @@ class PrivateFieldTests(TestCase):
     @classmethod
     def tearDownClass(cls):
         """
-        Manually remove all models that create files, which will cause the
-        files on disk to be removed by django-cleanup.
+        Manually remove all models that create files and sweep the queued
+        files from disk.
         This way running tests won't leave left-over files.
         """
         Track.objects.all().delete()
         Comment.objects.all().delete()
         FinalFile.objects.all().delete()
+        sweep_stale_files()
+        cls.settings.disable()
+        shutil.rmtree(cls.directory)
 
     def test_track_access(self):
         """
@@ -135,3 +163,359 @@ class PrivateFieldTests(TestCase):
         self.client.login(**self.staff_data)
         response = self.client.get(self.final.attachment.url)
         self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+
+class StorageSweepTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(PRIVATE_STORAGE_ROOT=self.directory)
+        self.settings.enable()
+
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.owner.profile.track_credit = 1
+        self.owner.profile.save()
+        self.track, self.comment, self.final = create_private_files(owner=self.owner)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_delete_queues_files(self):
+        """
+        Deleting objects must not remove files inline, only queue them.
+        """
+        storage = self.track.file.storage
+        name = self.track.file.name
+        self.track.delete()
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StaleFile.objects.get().name, name)
+
+        removed, reclaimed = sweep_stale_files()
+        self.assertEqual(removed, 1)
+        self.assertEqual(reclaimed, len("Temporary File"))
+        self.assertFalse(storage.exists(name))
+        # The empty ab/cd shard directories are removed, the owner's is kept
+        shard = os.path.dirname(storage.path(name))
+        self.assertFalse(os.path.exists(os.path.dirname(shard)))
+        self.assertTrue(os.path.isdir(os.path.dirname(os.path.dirname(shard))))
+        self.assertFalse(StaleFile.objects.exists())
+        self.assertIsNone(sweep_stale_files())
+
+    def test_replace_queues_files(self):
+        """
+        Replacing a file queues the old file, peaks and preview once each.
+        """
+        storage = self.track.file.storage
+        self.track.peaks.save("peaks.json", ContentFile(b"[]"))
+        self.track.preview.save("preview.mp3", ContentFile(b"x"))
+        names = [self.track.file.name, self.track.peaks.name,
+                 self.track.preview.name]
+        StaleFile.objects.all().delete()
+
+        self.track.file = create_temp_file("new.wav", "audio/x-wav")
+        self.track.save()
+        self.assertTrue(all(storage.exists(name) for name in names))
+        self.assertEqual(
+            sorted(StaleFile.objects.values_list("name", flat=True)), sorted(names))
+
+    def test_replace_rolled_back(self):
+        """
+        A replaced file stays in place when the save is rolled back.
+        """
+        storage = self.track.file.storage
+        name = self.track.file.name
+        try:
+            with transaction.atomic():
+                self.track.file = create_temp_file("new.wav", "audio/x-wav")
+                self.track.save()
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        self.assertTrue(storage.exists(name))
+        self.assertFalse(StaleFile.objects.exists())
+
+    def test_referenced_files_are_kept(self):
+        """
+        Files that are still referenced by an object must never be removed.
+        """
+        storage = self.comment.attachment.storage
+        name = self.comment.attachment.name
+        StaleFile.objects.create(name=name)
+
+        removed, reclaimed = sweep_stale_files()
+        self.assertEqual((removed, reclaimed), (0, 0))
+        self.assertTrue(storage.exists(name))
+        self.assertFalse(StaleFile.objects.exists())
+
+    def test_project_delete(self):
+        """
+        Deleting a Project queues all its files and refunds the Track credits.
+        """
+        names = [self.track.file.name, self.comment.attachment.name,
+                 self.final.attachment.name]
+        self.track.group.song.project.delete()
+
+        self.assertFalse(Track.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(FinalFile.objects.exists())
+        self.assertEqual(
+            sorted(StaleFile.objects.values_list("name", flat=True)), sorted(names))
+        self.owner.profile.refresh_from_db()
+        self.assertEqual(self.owner.profile.track_credit, 1)
+
+
+class ShardedPathTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(PRIVATE_STORAGE_ROOT=self.directory)
+        self.settings.enable()
+
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.owner.profile.track_credit = 1
+        self.owner.profile.save()
+        self.track, self.comment, self.final = create_private_files(owner=self.owner)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_upload_paths(self):
+        pattern = r"^%s/%s/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}-%s$"
+        owner_id = self.owner.id
+        self.assertRegexpMatches(
+            self.track.file.name, pattern % ("tracks", owner_id, "temp-track.wav"))
+        self.assertRegexpMatches(
+            self.comment.attachment.name, pattern % ("comments", owner_id, "attachment.txt"))
+        self.assertRegexpMatches(
+            self.final.attachment.name, pattern % ("finals", owner_id, "final.wav"))
+        self.assertEqual(str(self.track), "temp-track.wav")
+
+    def test_shard_command(self):
+        """
+        Files in the old flat layout are moved and their rows updated.
+        Running the command again must not change anything.
+        """
+        storage = self.comment.attachment.storage
+        flat_name = storage.save(
+            "comments/%s/legacy.txt" % self.owner.id, ContentFile(b"Legacy"))
+        Comment.objects.filter(pk=self.comment.pk).update(attachment=flat_name)
+
+        call_command("shard_private_files", stdout=StringIO())
+        self.comment.refresh_from_db()
+        sharded_name = self.comment.attachment.name
+        self.assertNotEqual(sharded_name, flat_name)
+        self.assertTrue(sharded_name.endswith("-legacy.txt"))
+        self.assertTrue(storage.exists(sharded_name))
+        self.assertFalse(storage.exists(flat_name))
+
+        call_command("shard_private_files", stdout=StringIO())
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.attachment.name, sharded_name)
+
+
+class OriginalFilenameTests(TestCase):
+
+    def setUp(self):
+        self.owner_data = {"username": get_uid(30), "password": "owner"}
+        self.owner = User.objects.create_user(**self.owner_data)
+        self.project = Project.objects.create(title="Project", owner=self.owner)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def create_comment(self, filename):
+        f = create_temp_file(filename, "text/plain")
+        return Comment.objects.create(
+            project=self.project, attachment=f, author=self.owner, content="Comment")
+
+    def test_no_existence_checks(self):
+        """
+        Uploads with the same name get unique names without probing the storage.
+        """
+        with mock.patch.object(private_storage, "exists") as exists:
+            first = self.create_comment("Kick Drum.txt")
+            second = self.create_comment("Kick Drum.txt")
+        self.assertFalse(exists.called)
+        self.assertNotEqual(first.attachment.name, second.attachment.name)
+        self.assertTrue(first.attachment.name.endswith("-kick-drum.txt"))
+        self.assertEqual(first.filename, "Kick Drum.txt")
+        self.assertEqual(second.filename, "Kick Drum.txt")
+
+    def test_download_name(self):
+        comment = self.create_comment("Kick Drum.txt")
+        self.client.login(**self.owner_data)
+        response = self.client.get(comment.attachment.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response["Content-Disposition"],
+            "attachment; filename=\"Kick Drum.txt\"; filename*=UTF-8''Kick%20Drum.txt")
+
+    def test_lookup_by_section(self):
+        comment = self.create_comment("Kick Drum.txt")
+        group = self.project.songs.create(title="Song").groups.create(title="Group")
+        track = group.tracks.create(file=ContentFile(b"x", name="Kick Drum.wav"))
+        track.preview.save("preview.mp3", ContentFile(b"x"))
+
+        # One query on the field of the section
+        with self.assertNumQueries(1):
+            self.assertEqual(original_filename(comment.attachment.name), "Kick Drum.txt")
+        with self.assertNumQueries(1):
+            self.assertEqual(original_filename(track.preview.name), "Kick Drum-preview.mp3")
+        with self.assertNumQueries(0):
+            self.assertEqual(original_filename("other/1/ab/cd/a.wav"), "a.wav")
+
+
+class ChecksumTests(TestCase):
+
+    def setUp(self):
+        self.owner_data = {"username": get_uid(30), "password": "owner"}
+        self.owner = User.objects.create_user(**self.owner_data)
+        self.owner.profile.track_credit = 5
+        self.owner.profile.save()
+        self.project = Project.objects.create(title="Project", owner=self.owner)
+        self.group = self.project.songs.create(title="Song").groups.create(title="Group")
+        self.sha256 = hashlib.sha256(b"Temporary File").hexdigest()
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def upload(self, **data):
+        self.client.login(**self.owner_data)
+        data.update(group=self.group.pk, file=create_temp_file("kick.wav", "audio/x-wav"))
+        return self.client.post(reverse("track-list"), data)
+
+    def test_upload_checksum(self):
+        response = self.upload(checksum=self.sha256.upper())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Track.objects.get(pk=response.data["id"]).checksum, self.sha256)
+
+        # Computed by the upload handler even if the client doesn't send one
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Track.objects.get(pk=response.data["id"]).checksum, self.sha256)
+
+    def test_upload_checksum_mismatch(self):
+        response = self.upload(checksum="0" * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("checksum", response.data)
+        self.assertFalse(Track.objects.filter(group=self.group).exists())
+
+    def test_verify_storage(self):
+        intact = self.group.tracks.create(file=ContentFile(b"Intact", name="a.wav"))
+        corrupted = self.group.tracks.create(file=ContentFile(b"Intact", name="b.wav"))
+        missing = self.group.tracks.create(file=ContentFile(b"Intact", name="c.wav"))
+        legacy = self.group.tracks.create(file=ContentFile(b"Legacy", name="d.wav"))
+        Track.objects.filter(pk=legacy.pk).update(checksum="")
+
+        with open(corrupted.file.path, "wb") as f:
+            f.write(b"Corrupt")
+        private_storage.delete(missing.file.name)
+
+        out = StringIO()
+        call_command("verify_storage", workers=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn("Track %s: %s is mismatch" % (corrupted.pk, corrupted.file.name), output)
+        self.assertIn("Track %s: %s is missing" % (missing.pk, missing.file.name), output)
+        self.assertIn("1 corrupted, 1 missing, 1 new checksums", output)
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.checksum, hashlib.sha256(b"Legacy").hexdigest())
+        self.assertIsNotNone(legacy.verified)
+        intact.refresh_from_db()
+        self.assertIsNotNone(intact.verified)
+        corrupted.refresh_from_db()
+        self.assertIsNone(corrupted.verified)
+
+        # Recently verified files are skipped
+        out = StringIO()
+        call_command("verify_storage", days=1, stdout=out)
+        self.assertIn("Verified 2 files", out.getvalue())
+
+    def test_token_bucket(self):
+        clock = [0.0]
+        waits = []
+        bucket = TokenBucket(100, clock=lambda: clock[0], sleep=waits.append)
+        bucket.consume(100)  # The full capacity is available at once
+        self.assertEqual(waits, [])
+        bucket.consume(50)
+        self.assertEqual(waits, [0.5])
+        clock[0] = 2.0  # Refilled
+        bucket.consume(100)
+        self.assertEqual(waits, [0.5])
+
+
+class ScrubStorageTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.track, self.comment, self.final = create_private_files(self.owner)
+        self.orphans = [
+            private_storage.save("tracks/%s/ab/cd/orphan.wav" % self.owner.pk, ContentFile(b"x")),
+            private_storage.save("unknown/orphan.txt", ContentFile(b"x")),
+        ]
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        for name in self.orphans:
+            StaleFile.objects.create(name=name)
+        sweep_stale_files()
+
+    def scrub(self, **options):
+        out = StringIO()
+        call_command("scrub_storage", rate=0, workers=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_report(self):
+        private_storage.delete(self.comment.attachment.name)
+
+        output = self.scrub(min_age=0)
+        for name in self.orphans:
+            self.assertIn("Orphan: %s" % name, output)
+        self.assertIn("Missing: %s" % self.comment.attachment.name, output)
+        self.assertNotIn(self.track.file.name, output)
+        self.assertNotIn(self.final.attachment.name, output)
+        self.assertFalse(StaleFile.objects.filter(name__in=self.orphans).exists())
+
+        # Recent files could belong to uploads that are still in progress
+        output = self.scrub()
+        self.assertNotIn("Orphan: %s" % self.orphans[0], output)
+
+    def test_results_are_streamed(self):
+        ready = threading.Event()
+
+        def scan(item):
+            # Only the first result can arrive before the caller has seen it
+            return item == 0 or ready.wait(5)
+
+        results = iter_in_threads(scan, range(6), workers=2)
+        self.assertTrue(next(results))
+        ready.set()
+        self.assertEqual(list(results), [True] * 5)
+
+        # Stopping early waits for the current items and leaves the rest
+        scanned = []
+        results = iter_in_threads(scanned.append, range(100), workers=2)
+        next(results)
+        results.close()
+        self.assertLess(len(scanned), 100)
+
+    def test_repair(self):
+        self.scrub(min_age=0, repair=True)
+        self.assertEqual(StaleFile.objects.filter(name__in=self.orphans).count(), 2)
+
+        # Queued files are not reported again
+        output = self.scrub(min_age=0)
+        self.assertNotIn(self.orphans[0], output)
+
+        sweep_stale_files()
+        for name in self.orphans:
+            self.assertFalse(private_storage.exists(name))
+        self.assertTrue(private_storage.exists(self.track.file.name))
@@ -0,0 +1,201 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import re
+import shutil
+import tempfile
+from StringIO import StringIO
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from utils import get_uid, status
+from utils.metrics import METRIC_DTYPE, file_layout, process_exists, shared_file
+from utils.performance import STATS_DTYPE, PerformanceMiddleware, current_stats, read_stats
+
+from mixing.files import sweep_stale_files
+from mixing.jobs.queue import enqueue
+from mixing.jobs.tasks import mail_admins
+from mixing.metrics import credit_operations, credits
+from mixing.models import Project
+from mixing.purchases.models import Purchase
+
+SAMPLE = re.compile(r'^[a-z_]+(\{([a-z_]+="[^"]*",?)+\})? -?[\d.e+-]+$')
+
+User = get_user_model()
+
+
+def streaming_view(request):
+    cache.get("performance-test-missing")
+    return StreamingHttpResponse([b"ab", b"cde"])
+
+
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(PERF_STATS_DIR=self.directory)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_view_histograms(self):
+        user = User.objects.create_user(username=get_uid(30), password="test")
+        self.client.login(username=user.username, password="test")
+        for _ in range(2):
+            response = self.client.get(reverse("purchases:dashboard"))
+        self.assertRegexpMatches(
+            response["Server-Timing"], r'^db;dur=[\d.]+;desc="[1-9]\d* queries", '
+                                       r'cache;desc="\d+ hits, \d+ misses", total;dur=[\d.]+$')
+
+        stats = read_stats(self.directory)["mixing.purchases.views.PurchaseDashboard"]
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["errors"], 0)
+        self.assertEqual(stats["duration_buckets"].sum(), 2)
+        self.assertGreater(stats["queries_sum"], 0)
+        self.assertGreater(stats["bytes_sum"], 0)
+        self.assertIsNone(current_stats())
+
+    def test_streaming_response(self):
+        middleware = PerformanceMiddleware()
+        request = RequestFactory().get("/stream/")
+        middleware.process_request(request)
+        middleware.process_view(request, streaming_view, (), {})
+        response = middleware.process_response(request, streaming_view(request))
+        self.assertIn('cache;desc="0 hits, 1 misses"', response["Server-Timing"])
+        self.assertEqual(read_stats(self.directory), {})
+
+        self.assertEqual(b"".join(response.streaming_content), b"abcde")
+        response.close()
+        stats = read_stats(self.directory)["%s.streaming_view" % __name__]
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["bytes_sum"], 5)
+        self.assertEqual(stats["cache_misses"], 1)
+
+    def test_stale_files(self):
+        """
+        Files of exited processes are removed by clear_stats, and files with
+        another layout are never read, even for the current PID.
+        """
+        dead_pid = next(pid for pid in range(2 ** 22, 2 ** 23) if not process_exists(pid))
+        dead = os.path.join(self.directory, "stats-%s-%d.dat" % (
+            file_layout(STATS_DTYPE), dead_pid))
+        old_layout = os.path.join(self.directory, "stats-%d.dat" % os.getpid())
+        with open(dead, "wb") as f:
+            f.write(b"\0" * STATS_DTYPE.itemsize)
+        with open(old_layout, "wb") as f:
+            f.write(b"\0" * 10)
+        self.assertEqual(read_stats(self.directory), {})
+
+        out = StringIO()
+        call_command("clear_stats", stdout=out)
+        self.assertIn("Removed 1 stats files", out.getvalue())
+        self.assertFalse(os.path.exists(dead))
+        self.assertTrue(os.path.exists(old_layout))
+
+    def test_record_errors(self):
+        """
+        A broken stats file must never turn a response into an error.
+        """
+        with mock.patch("utils.performance.record_request", side_effect=ValueError):
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with mock.patch("utils.metrics.SharedFile", side_effect=IOError):
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(PERF_STATS_DIR=self.directory, METRICS_TOKEN="token")
+        self.settings.enable()
+        self.user = User.objects.create_user(username=get_uid(30), password="test")
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def scrape(self):
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer token")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        samples = {}
+        for line in response.content.decode("utf-8").splitlines():
+            if not line.startswith("#"):
+                self.assertRegexpMatches(line, SAMPLE)
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_token(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_scrape(self):
+        Purchase.objects.create(user=self.user, credits=5, amount=50)
+        project = Project.objects.create(title="Project", owner=self.user)
+        group = project.songs.create(title="Song").groups.create(title="Group")
+        group.tracks.create(file=ContentFile(b"x" * 10, name="kick.wav"))
+        enqueue(mail_admins, ["Subject", "Message"])
+        self.client.login(username=self.user.username, password="test")
+        self.client.get(reverse("purchases:dashboard"))
+
+        samples = self.scrape()
+        self.assertEqual(samples['mixing_credits_total{operation="purchase"}'], 5)
+        self.assertEqual(samples['mixing_credit_operations_total{operation="spend"}'], 1)
+        self.assertGreaterEqual(samples['mixing_jobs{status="pending"}'], 1)
+        view = 'view="mixing.purchases.views.PurchaseDashboard"'
+        self.assertEqual(samples["http_request_duration_seconds_count{%s}" % view], 1)
+        self.assertEqual(
+            samples['http_request_duration_seconds_bucket{%s,le="+Inf"}' % view], 1)
+        self.assertGreater(samples["http_request_queries_sum{%s}" % view], 0)
+
+    def test_processes_are_added_up(self):
+        credits.inc(2, operation="test")
+        pid = os.fork()
+        if not pid:  # Another worker
+            try:
+                credits.inc(3, operation="test")
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual(self.scrape()['mixing_credits_total{operation="test"}'], 5)
+
+    @mock.patch.multiple("utils.metrics", METRIC_SLOTS=4, METRIC_RESERVED=2)
+    def test_overflow(self):
+        for i in range(5):
+            credits.inc(operation="op%d" % i)
+        credit_operations.inc(operation="op0")
+
+        # Label values without a row of their own are added up as "other",
+        # and each metric gets its own
+        samples = self.scrape()
+        self.assertEqual(samples['mixing_credits_total{operation="op1"}'], 1)
+        self.assertNotIn('mixing_credits_total{operation="op2"}', samples)
+        self.assertEqual(samples['mixing_credits_total{operation="other"}'], 3)
+        self.assertEqual(samples['mixing_credit_operations_total{operation="other"}'], 1)
+
+        metrics_file = shared_file("metrics", METRIC_DTYPE, 4, 2)
+        self.assertEqual(
+            metrics_file.overflowed['mixing_credits_total|operation="op4"'],
+            metrics_file.slots['mixing_credits_total|operation="other"'])
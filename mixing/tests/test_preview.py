@@ -0,0 +1,168 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import tempfile
+import wave
+from StringIO import StringIO
+
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from utils import get_uid
+from utils.views import parse_range
+
+from mixing.encoders import WavEncoder, EncoderError, get_preview_encoder
+from mixing.files import sweep_stale_files
+from mixing.models import Project, StaleFile
+from mixing.processing import encode_preview
+from mixing.serializers import TrackSerializer
+from mixing.tests.test_audio import create_wav, create_aiff
+from mixing.tests.test_waveform import create_project, write_temp
+from mixing.storage import private_storage
+
+User = get_user_model()
+
+
+@override_settings(PREVIEW_ENCODERS=("mixing.encoders.WavEncoder",))
+class WavEncoderTests(TestCase):
+
+    def setUp(self):
+        handle, self.output = tempfile.mkstemp(suffix=".wav")
+        os.close(handle)
+        self.names = []
+
+    def tearDown(self):
+        os.remove(self.output)
+        for name in self.names:
+            private_storage.delete(name)
+
+    def encode(self, content):
+        name, path = write_temp(content)
+        self.names.append(name)
+        WavEncoder().encode(path, self.output)
+        return wave.open(self.output, "rb")
+
+    def test_stereo_to_mono(self):
+        # Left channel at half scale, right channel silent
+        samples = np.zeros((44100, 2), "<i2")
+        samples[:, 0] = 16384
+        preview = self.encode(create_wav(samples=samples.tobytes()))
+
+        self.assertEqual(preview.getnchannels(), 1)
+        self.assertEqual(preview.getsampwidth(), 2)
+        self.assertEqual(preview.getframerate(), 22050)
+        self.assertEqual(preview.getnframes(), 22050)
+        values = np.frombuffer(preview.readframes(10), "<i2")
+        self.assertEqual(values.tolist(), [8192] * 10)
+
+    def test_sample_rates(self):
+        preview = self.encode(create_aiff(frames=48000, rate=48000))
+        self.assertEqual(preview.getframerate(), 24000)
+        self.assertEqual(preview.getnframes(), 24000)
+
+        preview = self.encode(create_wav(frames=8000, rate=8000))
+        self.assertEqual(preview.getframerate(), 8000)
+
+    def test_unsupported(self):
+        with self.assertRaises(EncoderError):
+            self.encode(b"Not audio")
+
+    def test_get_preview_encoder(self):
+        self.assertIsInstance(get_preview_encoder(), WavEncoder)
+        with override_settings(PREVIEW_ENCODERS=()):
+            with self.assertRaises(EncoderError):
+                get_preview_encoder()
+
+
+class RangeTests(TestCase):
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=900-", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=900-5000", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertIsNone(parse_range("", 1000))
+        self.assertIsNone(parse_range("bytes=0-1,5-6", 1000))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=1000-", 1000)
+
+
+@override_settings(PREVIEW_ENCODERS=("mixing.encoders.WavEncoder",))
+class EncodePreviewTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.non_owner = User.objects.create_user(username=get_uid(30), password="other")
+        self.project, self.group = create_project(self.owner)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_encode_preview(self):
+        track = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        self.assertTrue(encode_preview(track))
+        track.refresh_from_db()
+        self.assertEqual(
+            track.preview.name.split("/")[:2], ["previews", str(self.owner.pk)])
+        self.assertTrue(track.preview.name.endswith("kick-preview.wav"))
+        self.assertIsNotNone(track.preview_encoded)
+        self.assertLess(track.preview.size, track.file.size)
+        self.assertEqual(TrackSerializer(track).data["preview"], track.preview.url)
+
+        # A new upload drops the preview
+        preview_name = track.preview.name
+        track.file = ContentFile(create_wav(), name="snare.wav")
+        track.save()
+        self.assertFalse(track.preview)
+        self.assertIsNone(track.preview_encoded)
+        self.assertTrue(StaleFile.objects.filter(name=preview_name).exists())
+
+    def test_encode_command(self):
+        wav = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        text = self.group.tracks.create(file=ContentFile(b"Not audio", name="notes.txt"))
+        final = self.project.final_files.create(
+            attachment=ContentFile(create_wav(), name="mix.wav"))
+
+        out = StringIO()
+        call_command("encode_previews", workers=1, stdout=out)
+        self.assertIn("Encoded previews for 3 files", out.getvalue())
+        wav.refresh_from_db()
+        text.refresh_from_db()
+        final.refresh_from_db()
+        self.assertTrue(wav.preview)
+        self.assertTrue(final.preview)
+        self.assertFalse(text.preview)
+        self.assertIsNotNone(text.preview_encoded)
+
+    def test_serve_preview(self):
+        track = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        encode_preview(track)
+        track.refresh_from_db()
+        url = track.preview.url
+        size = track.preview.size
+
+        # Owners can play the preview, even if the Track itself is staff only
+        self.client.login(username=self.owner.username, password="owner")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(int(response["Content-Length"]), size)
+        self.assertNotIn("Content-Disposition", response)
+        self.assertIn("private", response["Cache-Control"])
+
+        response = self.client.get(url, HTTP_RANGE="bytes=0-43")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 0-43/%d" % size)
+        self.assertEqual(b"".join(response.streaming_content)[:4], b"RIFF")
+
+        response = self.client.get(url, HTTP_RANGE="bytes=%d-" % size)
+        self.assertEqual(response.status_code, 416)
+
+        self.client.login(username=self.non_owner.username, password="other")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
@@ -1,12 +1,16 @@
 from __future__ import unicode_literals, absolute_import
 
+import json
+
 from django.contrib.auth import get_user_model
+from django.core import mail
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 
-from utils import status, get_uid
+from utils import status, get_uid, add_site_permission
 
 from mixing.models import Project
+from mixing.signals import project_status_changed
 
 User = get_user_model()
 login_url = reverse("login")
@@ -238,3 +242,110 @@ class ProjectTest(TestCase):
         project.refresh_from_db()
         self.assertRedirects(response, project.get_absolute_url())
         self.assertEquals(project.status, Project.STATUS_REVISION_COMPLETE)
+
+
+class StatusTransitionTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username=get_uid(30), password="owner", email="owner@example.com")
+        self.staff = User.objects.create_user(username=get_uid(30), password="staff")
+        self.staff.is_staff = True
+        self.staff.is_superuser = True
+        self.staff.save()
+        add_site_permission(self.staff)
+
+    def create_projects(self):
+        """
+        One Project for every combination of status and priority.
+        """
+        return [
+            Project.objects.create(
+                title="Project", owner=self.owner, status=old_status, priority=priority)
+            for old_status, _ in Project.STATUS_CHOICES
+            for priority in (0, 5, 9, 10)
+        ]
+
+    def state(self, projects):
+        return [
+            Project.objects.filter(pk=project.pk).values_list(
+                "status", "active", "priority")[0]
+            for project in projects
+        ]
+
+    def test_same_rules_as_save(self):
+        for new_status, _ in Project.STATUS_CHOICES:
+            one_by_one = self.create_projects()
+            for project in one_by_one:
+                project = Project.objects.get(pk=project.pk)
+                project.status = new_status
+                project.save()
+
+            batch = self.create_projects()
+            updated = Project.objects.filter(pk__in=[p.pk for p in batch]).set_status(new_status)
+            self.assertEqual(updated, len(batch))
+            self.assertEqual(self.state(batch), self.state(one_by_one))
+
+    def test_batched_signal(self):
+        projects = self.create_projects()
+        received = []
+
+        def receiver(sender, project_ids, status, **kwargs):
+            received.append((sorted(project_ids), status))
+        project_status_changed.connect(receiver)
+        self.addCleanup(project_status_changed.disconnect, receiver)
+
+        Project.objects.filter(pk__in=[p.pk for p in projects]).set_status(
+            Project.STATUS_COMPLETE)
+        unchanged = [p.pk for p in projects if p.status == Project.STATUS_COMPLETE]
+        changed = sorted(p.pk for p in projects if p.pk not in unchanged)
+        self.assertEqual(received, [(changed, Project.STATUS_COMPLETE)])
+
+        # The per-object path sends it too, but only for actual changes
+        project = Project.objects.get(pk=projects[0].pk)
+        project.save()
+        project.status = Project.STATUS_REVISION_IN_PROGRESS
+        project.save()
+        self.assertEqual(received[1:], [([project.pk], Project.STATUS_REVISION_IN_PROGRESS)])
+
+    def test_no_emails(self):
+        # Status changes don't email owners, in bulk or one by one
+        projects = [
+            Project.objects.create(title="Project %d" % i, owner=self.owner,
+                                   status=Project.STATUS_IN_PROGRESS)
+            for i in range(2)
+        ]
+        Project.objects.filter(pk=projects[0].pk).set_status(Project.STATUS_COMPLETE)
+        projects[1].status = Project.STATUS_COMPLETE
+        projects[1].save()
+        self.assertEqual(mail.outbox, [])
+
+    def test_admin_action(self):
+        projects = self.create_projects()[:4]
+        self.client.login(username=self.staff.username, password="staff")
+        response = self.client.post(reverse("admin:mixing_project_changelist"), {
+            "action": "set_status_%d" % Project.STATUS_IN_PROGRESS,
+            "_selected_action": [p.pk for p in projects],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            set(s for s, _, _ in self.state(projects)), {Project.STATUS_IN_PROGRESS})
+
+    def test_api(self):
+        projects = self.create_projects()[:4]
+        url = reverse("project-bulk-status")
+        data = {"ids": [p.pk for p in projects], "status": Project.STATUS_COMPLETE}
+
+        self.client.login(username=self.owner.username, password="owner")
+        response = self.client.post(url, json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username=self.staff.username, password="staff")
+        response = self.client.post(
+            url, json.dumps(dict(data, status=99)), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 4)
+        self.assertEqual(
+            set(s for s, _, _ in self.state(projects)), {Project.STATUS_COMPLETE})
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals, absolute_import
+
+import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from utils import add_site_permission, create_temp_file, get_uid
+from utils.performance import time_queries
+from utils.queries import max_queries, normalize_sql
+
+from mixing.files import sweep_stale_files
+from mixing.models import Project
+from mixing.purchases.models import UserProfile
+
+User = get_user_model()
+
+
+class QueryInspectorTests(APITestCase):
+    """
+    The views and signals that used to run a query per object. Their query
+    counts must not grow with the number of objects, so new N+1 patterns
+    fail here.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        UserProfile.objects.filter(user=self.owner).update(track_credit=10)
+        self.project = Project.objects.create(title="Project", owner=self.owner)
+        self.group = self.project.songs.create(title="Song").groups.create(title="Group")
+        self.tracks = [
+            self.group.tracks.create(file=ContentFile(b"x", name="%d.wav" % i))
+            for i in range(3)]
+        for i in range(3):
+            author = User.objects.create_user(username=get_uid(30))
+            self.project.comments.create(author=author, content="Comment %d" % i)
+        self.client.login(username=self.owner.username, password="owner")
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE a = 1 AND b IN (2, 3) AND c = 'x'"),
+            "SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?")
+        self.assertEqual(
+            normalize_sql('SELECT "t"."id" FROM "t" WHERE "t"."id" = 12'),
+            normalize_sql('SELECT "t"."id"  FROM "t" WHERE "t"."id" = 3'))
+
+    def test_n_plus_one_fails(self):
+        with self.assertRaisesRegexp(AssertionError, "repeated more than 2 times"):
+            with max_queries(100):
+                for comment in self.project.comments.all():
+                    comment.author.username
+
+    def test_comments(self):
+        with max_queries(6):
+            response = self.client.get(reverse("comment-list"))
+        self.assertEqual(len(response.data), 3)
+
+    def test_tracks(self):
+        with max_queries(6):
+            response = self.client.get(reverse("track-list"))
+        self.assertEqual(len(response.data), 3)
+
+        # ProjectIsActive walks the Track up to its Project
+        with max_queries(20):
+            response = self.client.patch(
+                reverse("track-detail", args=[self.tracks[0].pk]), {"group": self.group.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_track_credit(self):
+        with max_queries(30):
+            response = self.client.post(reverse("track-list"), {
+                "group": self.group.pk, "file": create_temp_file("kick.wav", "audio/x-wav")})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with max_queries(30):
+            response = self.client.delete(reverse("track-detail", args=[self.tracks[0].pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(UserProfile.objects.get(user=self.owner).track_credit, 7 - 1 + 1)
+
+    def test_project_detail(self):
+        with max_queries(20):
+            response = self.client.get(self.project.get_absolute_url())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_zip_download(self):
+        staff = User.objects.create_user(username=get_uid(30), password="staff")
+        staff.is_staff = True
+        staff.is_superuser = True
+        staff.save()
+        add_site_permission(staff)
+        self.client.login(username=staff.username, password="staff")
+        with max_queries(20):
+            response = self.client.get(
+                reverse("admin:mixing_project_download", args=[self.project.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(PERF_SLOW_QUERY_SECONDS=0)
+    def test_slow_query_log(self):
+        time_queries()
+        with mock.patch("utils.queries.logger") as logger:
+            Project.objects.filter(title="Slow").count()
+        message, duration, sql, stack = logger.warning.call_args[0]
+        self.assertIn("mixing_project", sql)
+        self.assertIn("test_queries.py", stack)
+        self.assertNotIn("/django/", stack)
@@ -0,0 +1,182 @@
+from __future__ import unicode_literals, absolute_import
+
+import io
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from zipfile import ZipFile
+
+import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from utils import add_site_permission, get_uid, has_local_path, status
+
+from mixing.archive import archive_project
+from mixing.files import sweep_stale_files
+from mixing.models import Project
+from mixing.processing import extract_peaks
+from mixing.storage import (
+    LocalObjectStorage, S3ObjectReader, archive_storage, local_copy, private_storage)
+from mixing.tests.test_audio import create_wav
+from mixing.tests.test_waveform import create_project
+
+User = get_user_model()
+
+
+class FakeS3Client(object):
+    """
+    Answers ranged GETs for a single object and counts them.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.requests = 0
+
+    def get_object(self, Bucket, Key, Range):
+        self.requests += 1
+        first, last = [int(n) for n in Range.replace("bytes=", "").split("-")]
+        return {"Body": io.BytesIO(self.content[first:last + 1])}
+
+
+class S3ObjectReaderTests(TestCase):
+
+    def test_ranged_reads(self):
+        content = b"".join(b"%04d" % n for n in range(1000))
+        client = FakeS3Client(content)
+        f = io.BufferedReader(S3ObjectReader(client, "bucket", "key", len(content)), 64)
+
+        self.assertEqual(f.read(4), b"0000")
+        self.assertEqual(client.requests, 1)
+        f.seek(-8, io.SEEK_END)
+        self.assertEqual(f.read(), b"09980999")
+        f.seek(400)
+        self.assertEqual(f.tell(), 400)
+        self.assertEqual(f.read(8), b"01000101")
+        f.seek(0)
+        self.assertEqual(f.read(), content)
+
+
+@override_settings(PRIVATE_FILE_STORAGE="mixing.storage.LocalObjectStorage")
+class ObjectStorageTests(TestCase):
+    """
+    Runs the code paths of remote storages against LocalObjectStorage.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.non_owner = User.objects.create_user(username=get_uid(30), password="other")
+        self.staff = User.objects.create_user(username=get_uid(30), password="staff")
+        self.staff.is_staff = True
+        self.staff.save()
+        add_site_permission(self.staff)
+        self.project, self.group = create_project(self.owner)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_configured_storage(self):
+        self.assertIsInstance(private_storage._wrapped, LocalObjectStorage)
+        self.assertFalse(has_local_path(private_storage))
+        track = self.group.tracks.create(file=ContentFile(b"Kick", name="kick.wav"))
+        self.assertTrue(private_storage.exists(track.file.name))
+        self.assertEqual(
+            track.file.url, reverse("serve_private_file", args=[track.file.name]))
+
+    def test_local_copy(self):
+        name = private_storage.save("tests/%s.txt" % get_uid(10), ContentFile(b"Copy"))
+        self.addCleanup(private_storage.delete, name)
+        with local_copy(private_storage, name) as path:
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"Copy")
+        self.assertFalse(os.path.exists(path))
+
+    def test_download_redirect(self):
+        track = self.group.tracks.create(file=ContentFile(b"Kick", name="kick.wav"))
+        url = track.file.url
+
+        # Tracks are staff only
+        self.client.login(username=self.owner.username, password="owner")
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username=self.staff.username, password="staff")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        signed_url = response["Location"]
+        self.assertIn("/signed/", signed_url)
+
+        # Signed URLs work without a session
+        self.client.logout()
+        response = self.client.get(signed_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"Kick")
+        self.assertIn('filename="kick.wav"', response["Content-Disposition"])
+
+        response = self.client.get(signed_url.replace("/signed/", "/signed/x"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(PRIVATE_URL_EXPIRE=-1):
+            response = self.client.get(signed_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_owner_attachment(self):
+        comment = self.project.comments.create(
+            author=self.owner, content="Notes",
+            attachment=ContentFile(b"Notes", name="notes.txt"))
+        url = comment.attachment.url
+
+        self.client.login(username=self.non_owner.username, password="other")
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username=self.owner.username, password="owner")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(response["Location"], HTTP_RANGE="bytes=0-1")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"No")
+
+        private_storage.delete(comment.attachment.name)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_extract_peaks(self):
+        track = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        self.assertTrue(extract_peaks(track))
+        track.refresh_from_db()
+        self.assertTrue(private_storage.exists(track.peaks.name))
+
+    def test_archive_and_zip_export(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root)
+        patcher = mock.patch.object(archive_storage, "location", archive_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.group.tracks.create(file=ContentFile(b"Kick", name="kick.wav"))
+        snare = self.group.tracks.create(file=ContentFile(b"Snare", name="snare.wav"))
+        self.client.login(username=self.staff.username, password="staff")
+        url = reverse("admin:mixing_project_download", args=[self.project.pk])
+
+        def download():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            with ZipFile(StringIO(response.content)) as zip_file:
+                self.assertEqual(zip_file.read("Song/Group/snare.wav"), b"Snare")
+
+        download()
+        self.project.status = Project.STATUS_COMPLETE
+        self.project.save()
+        self.assertEqual(archive_project(self.project), 2)
+        self.assertFalse(private_storage.exists(snare.file.name))
+        download()
+
+    def test_local_only_commands(self):
+        with self.assertRaises(CommandError):
+            call_command("scrub_storage", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("shard_private_files", stdout=StringIO())
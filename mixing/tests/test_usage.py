@@ -0,0 +1,122 @@
+from __future__ import unicode_literals, absolute_import
+
+from StringIO import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from utils import add_site_permission, get_uid, status
+
+from mixing.bulk import delete_objects, move_objects
+from mixing.files import sweep_stale_files
+from mixing.models import Project, Track
+from mixing.purchases.models import UserProfile
+from mixing.serializers import FileMetaDataField
+from mixing.tests.test_waveform import create_project
+
+User = get_user_model()
+
+
+class StorageUsageTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.project, self.group = create_project(self.owner)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def assertUsage(self, project_bytes, user_bytes=None):
+        project = Project.objects.get(pk=self.project.pk)
+        profile = UserProfile.objects.get(user=self.owner)
+        self.assertEqual(project.storage_bytes, project_bytes)
+        self.assertEqual(
+            profile.storage_bytes, project_bytes if user_bytes is None else user_bytes)
+
+    def test_create_and_delete(self):
+        track = self.group.tracks.create(file=ContentFile(b"x" * 100, name="kick.wav"))
+        self.assertEqual(track.size, 100)
+        self.project.comments.create(
+            author=self.owner, content="Notes", attachment=ContentFile(b"x" * 10, name="a.txt"))
+        self.project.comments.create(author=self.owner, content="No attachment")
+        final = self.project.final_files.create(
+            attachment=ContentFile(b"x" * 1000, name="mix.wav"))
+        self.assertUsage(1110)
+
+        # Replacing a file only counts the difference
+        track.file = ContentFile(b"x" * 40, name="snare.wav")
+        track.save()
+        self.assertUsage(1050)
+
+        final.delete()
+        self.assertUsage(50)
+        delete_objects(Track.objects.filter(pk=track.pk))
+        self.assertUsage(10)
+
+    def test_move_between_projects(self):
+        other, other_group = create_project(self.owner)
+        track = self.group.tracks.create(file=ContentFile(b"x" * 100, name="kick.wav"))
+        move_objects(Track.objects.filter(pk=track.pk), "group", other_group)
+        self.assertUsage(0, user_bytes=100)
+        self.assertEqual(Project.objects.get(pk=other.pk).storage_bytes, 100)
+
+        move_objects(other.songs.all(), "project", self.project)
+        self.assertUsage(100)
+        self.assertEqual(Project.objects.get(pk=other.pk).storage_bytes, 0)
+
+    def test_stale_instance(self):
+        project = Project.objects.get(pk=self.project.pk)
+        self.group.tracks.create(file=ContentFile(b"x" * 100, name="kick.wav"))
+        project.title = "Renamed"
+        project.save()
+        self.assertUsage(100)
+        self.assertEqual(Project.objects.get(pk=self.project.pk).title, "Renamed")
+
+    def test_reconcile(self):
+        track = self.group.tracks.create(file=ContentFile(b"x" * 100, name="kick.wav"))
+        self.group.tracks.create(file=ContentFile(b"x" * 20, name="snare.wav"))
+        # Uploaded before sizes existed
+        Track.objects.filter(pk=track.pk).update(size=None)
+        Project.objects.filter(pk=self.project.pk).update(storage_bytes=0)
+        UserProfile.objects.filter(user=self.owner).update(storage_bytes=5)
+
+        out = StringIO()
+        call_command("reconcile_storage_usage", stdout=out)
+        self.assertIn("Track: measured 1 files", out.getvalue())
+        self.assertIn("Fixed the storage usage of 1 projects and 1 users", out.getvalue())
+        self.assertEqual(Track.objects.get(pk=track.pk).size, 100)
+        self.assertUsage(120)
+
+        out = StringIO()
+        call_command("reconcile_storage_usage", stdout=out)
+        self.assertIn("of 0 projects and 0 users", out.getvalue())
+
+    def test_serialized_size(self):
+        """
+        The API reports the stored size without asking the storage.
+        """
+        track = self.group.tracks.create(file=ContentFile(b"x" * 100, name="kick.wav"))
+        track.file.storage.delete(track.file.name)
+        data = FileMetaDataField().to_representation(track.file)
+        self.assertEqual(data["size"], 100)
+
+    def test_dashboard_and_admin(self):
+        self.group.tracks.create(file=ContentFile(b"x" * 2048, name="kick.wav"))
+        self.client.login(username=self.owner.username, password="owner")
+        response = self.client.get(reverse("purchases:dashboard"))
+        self.assertContains(response, "Your files use 2.0\xa0KB")
+
+        staff = User.objects.create_user(username=get_uid(30), password="staff")
+        staff.is_staff = True
+        staff.is_superuser = True
+        staff.save()
+        add_site_permission(staff)
+        self.client.login(username=staff.username, password="staff")
+        response = self.client.get(reverse("admin:mixing_project_changelist"), {"o": "-7"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(response.context["cl"].queryset.query.order_by)[0], "-storage_bytes")
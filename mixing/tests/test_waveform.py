@@ -0,0 +1,233 @@
+from __future__ import unicode_literals, absolute_import
+
+from StringIO import StringIO
+
+import mock
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from utils import get_uid
+
+from mixing.audio import AudioFormatError
+from mixing.files import sweep_stale_files
+from mixing.models import Project, Track, StaleFile
+from mixing.processing import extract_peaks
+from mixing.serializers import TrackSerializer
+from mixing.storage import private_storage
+from mixing.tests.test_audio import create_wav, create_aiff
+from mixing.waveform import compute_peaks, read_peaks, SAMPLES_PER_PEAK
+
+User = get_user_model()
+
+
+def write_temp(content):
+    name = private_storage.save("tests/%s.audio" % get_uid(10), ContentFile(content))
+    return name, private_storage.path(name)
+
+
+def create_project(owner):
+    owner.profile.track_credit = 5
+    owner.profile.save()
+    project = Project.objects.create(title="Project", owner=owner)
+    group = project.songs.create(title="Song").groups.create(title="Group")
+    return project, group
+
+
+class ComputePeaksTests(TestCase):
+
+    def setUp(self):
+        self.names = []
+
+    def tearDown(self):
+        for name in self.names:
+            private_storage.delete(name)
+
+    def peaks(self, content, level=0):
+        name, path = write_temp(content)
+        self.names.append(name)
+        return read_peaks(compute_peaks(path), level)
+
+    def test_16_bit_stereo(self):
+        # Left channel at half scale, right channel at minus quarter scale
+        frames = SAMPLES_PER_PEAK * 3
+        samples = np.zeros((frames, 2), "<i2")
+        samples[:, 0] = 16384
+        samples[:, 1] = -8192
+        header, values = self.peaks(create_wav(channels=2, samples=samples.tobytes()))
+
+        self.assertEqual(header["sample_rate"], 44100)
+        self.assertEqual(header["frames"], frames)
+        self.assertEqual(header["length"], 3)
+        self.assertEqual(values.tolist(), [-32, 64] * 3)
+
+    def test_streamed_in_blocks(self):
+        # The peaks of a ramp must match whatever the block size is
+        samples = np.arange(-32768, 32768, 16, dtype="<i2")
+        content = create_wav(channels=1, samples=samples.tobytes())
+        header, expected = self.peaks(content)
+        with mock.patch("mixing.waveform.BLOCK_FRAMES", SAMPLES_PER_PEAK * 2):
+            _, values = self.peaks(content)
+        self.assertEqual(values.tolist(), expected.tolist())
+        self.assertEqual(header["length"], len(samples) // SAMPLES_PER_PEAK)
+
+    def test_zoom_levels(self):
+        frames = SAMPLES_PER_PEAK * 20 + 10
+        header, _ = self.peaks(create_wav(frames=frames, channels=1))
+        lengths = [level["length"] for level in header["levels"]]
+        self.assertEqual(lengths, [21, 6, 2, 1])
+
+        header, values = self.peaks(create_wav(frames=frames, channels=1), level=2)
+        self.assertEqual(header["samples_per_peak"], SAMPLES_PER_PEAK * 16)
+        self.assertEqual(len(values), 4)
+
+    def test_8_and_24_bit(self):
+        samples = np.full(SAMPLES_PER_PEAK, 255, "u1")  # Unsigned, almost full scale
+        content = create_wav(channels=1, sample_width=1, samples=samples.tobytes())
+        _, values = self.peaks(content)
+        self.assertEqual(values.tolist(), [126, 126])
+
+        _, values = self.peaks(create_aiff(frames=SAMPLES_PER_PEAK))
+        self.assertEqual(values.tolist(), [0, 0])
+
+        # -0.5 as little endian 24 bit integers
+        samples = b"\x00\x00\xc0" * SAMPLES_PER_PEAK
+        _, values = self.peaks(create_wav(channels=1, sample_width=3, samples=samples))
+        self.assertEqual(values.tolist(), [-64, -64])
+
+    def test_unsupported(self):
+        with self.assertRaises(AudioFormatError):
+            self.peaks(b"Not audio")
+
+
+class ExtractPeaksTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.project, self.group = create_project(self.owner)
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_extract_peaks(self):
+        track = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        self.assertTrue(extract_peaks(track))
+        track.refresh_from_db()
+        self.assertTrue(track.peaks.name.startswith("tracks/%s/" % self.owner.pk))
+        self.assertTrue(track.peaks.name.endswith("kick.wav.peaks"))
+        self.assertIsNotNone(track.peaks_extracted)
+
+        # Extracting again replaces the peak file
+        old_name = track.peaks.name
+        self.assertTrue(extract_peaks(track))
+        track.refresh_from_db()
+        self.assertNotEqual(track.peaks.name, old_name)
+        self.assertTrue(StaleFile.objects.filter(name=old_name).exists())
+
+        # A new upload drops the peaks
+        peaks_name = track.peaks.name
+        track.file = ContentFile(create_wav(), name="snare.wav")
+        track.save()
+        self.assertFalse(track.peaks)
+        self.assertIsNone(track.peaks_extracted)
+        self.assertTrue(StaleFile.objects.filter(name=peaks_name).exists())
+
+    def test_extract_command(self):
+        wav = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        text = self.group.tracks.create(file=ContentFile(b"Not audio", name="notes.txt"))
+        final = self.project.final_files.create(
+            attachment=ContentFile(create_wav(), name="mix.wav"))
+
+        out = StringIO()
+        call_command("extract_peaks", workers=2, stdout=out)
+        self.assertIn("Extracted peaks for 3 files", out.getvalue())
+        wav.refresh_from_db()
+        text.refresh_from_db()
+        final.refresh_from_db()
+        self.assertTrue(wav.peaks)
+        self.assertTrue(final.peaks)
+        self.assertFalse(text.peaks)
+        self.assertIsNotNone(text.peaks_extracted)
+
+        # Only new files are processed unless --all is used
+        out = StringIO()
+        call_command("extract_peaks", workers=1, stdout=out)
+        self.assertIn("Extracted peaks for 0 files", out.getvalue())
+
+    def test_peaks_are_deleted_with_tracks(self):
+        track = self.group.tracks.create(file=ContentFile(create_wav(), name="kick.wav"))
+        extract_peaks(track)
+        track.refresh_from_db()
+        Track.objects.filter(pk=track.pk).delete()
+        self.assertTrue(StaleFile.objects.filter(name=track.peaks.name).exists())
+
+
+class PeaksAPITests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username=get_uid(30), password="owner")
+        self.non_owner = User.objects.create_user(username=get_uid(30), password="other")
+        self.project, self.group = create_project(self.owner)
+        self.track = self.group.tracks.create(
+            file=ContentFile(create_wav(frames=SAMPLES_PER_PEAK * 64), name="kick.wav"))
+        self.url = reverse("track-peaks", args=[self.track.pk])
+
+    def tearDown(self):
+        Project.objects.all().delete()
+        sweep_stale_files()
+
+    def test_track_peaks(self):
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        extract_peaks(self.track)
+        response = self.client.get(self.url, {"level": 0})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["length"], 64)
+        self.assertEqual(len(response.data["data"]), 128)
+        self.assertIn("private", response["Cache-Control"])
+
+        # The browser can revalidate with the ETag
+        response = self.client.get(
+            self.url, {"level": 0}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # The coarsest level with enough peaks for the width
+        response = self.client.get(self.url, {"width": 10})
+        self.assertEqual(response.data["length"], 16)
+
+        self.client.force_authenticate(user=self.non_owner)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_final_file_peaks(self):
+        final = self.project.final_files.create(
+            attachment=ContentFile(create_wav(), name="mix.wav"))
+        extract_peaks(final)
+        url = reverse("finalfile-peaks", args=[final.pk])
+
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["sample_rate"], 44100)
+
+        self.client.force_authenticate(user=self.non_owner)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serializer_url(self):
+        self.assertIsNone(TrackSerializer(self.track).data["peaks"])
+        extract_peaks(self.track)
+        track = Track.objects.get(pk=self.track.pk)
+        self.assertEqual(TrackSerializer(track).data["peaks"], self.url)
@@ -0,0 +1,76 @@
+from __future__ import unicode_literals, absolute_import
+
+import time
+
+from django.core.cache import cache
+from django.db.models import Count, Prefetch
+from django.template import loader
+
+from .models import Group, Track
+
+# Fragments are cached for a day, a new version makes them unreachable sooner
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+VERSION_KEY = "track_browser:version:%s"
+FRAGMENT_KEY = "track_browser:song:%s:%s:%s"
+
+
+def browser_version(project_id):
+    """
+    The current version of the Tracks of a Project, part of the fragment keys.
+    Versions start at the current time in microseconds, so a version key that
+    was evicted never brings back fragments of an earlier version.
+    """
+    key = VERSION_KEY % project_id
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000000)
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate_track_browser(project_ids):
+    """
+    Called whenever Songs, Groups or Tracks of the Projects change.
+    """
+    for project_id in set(project_ids):
+        try:
+            cache.incr(VERSION_KEY % project_id)
+        except ValueError:  # No version yet, so nothing is cached either
+            pass
+
+
+def invalidate_tracks(tracks):
+    """
+    invalidate_track_browser() for the Projects of a queryset of Tracks.
+    """
+    project_ids = tracks.order_by().values_list("group__song__project", flat=True).distinct()
+    invalidate_track_browser(project_ids)
+
+
+def browser_songs(project):
+    """
+    The Songs of a Project with their number of Groups and Tracks, in one query.
+    The Groups and Tracks themselves are loaded by render_song() when a Song is opened.
+    """
+    return project.songs.annotate(
+        group_count=Count("groups", distinct=True),
+        track_count=Count("groups__tracks", distinct=True),
+    ).order_by("pk")
+
+
+def render_song(song):
+    """
+    The HTML of the Groups and Tracks of a Song, cached until the Project changes.
+    Uses two queries on a cache miss, whatever the size of the Song.
+    """
+    key = FRAGMENT_KEY % (song.project_id, browser_version(song.project_id), song.pk)
+    html = cache.get(key)
+    if html is None:
+        groups = Group.objects.filter(song=song).order_by("pk").prefetch_related(
+            Prefetch("tracks", queryset=Track.objects.order_by("pk")))
+        html = loader.render_to_string(
+            "admin/mixing/includes/track_browser_song.html",
+            {"song": song, "groups": groups})
+        cache.set(key, html, FRAGMENT_TIMEOUT)
+    return html
@@ -9,6 +9,8 @@ router.register(r"songs", views.SongViewSet)
 router.register(r"groups", views.GroupViewSet)
 router.register(r"tracks", views.TrackViewSet)
 router.register(r"comments", views.CommentViewSet)
+router.register(r"final-files", views.FinalFileViewSet)
+router.register(r"staff/projects", views.StaffProjectViewSet)
 
 urlpatterns = [
     url(
@@ -0,0 +1,149 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import Project, Track, Comment, FinalFile
+from .purchases.models import UserProfile, add_storage_bytes
+
+logger = logging.getLogger(__name__)
+
+# Models with a size, see mixing.models.SizedUpload
+SIZED_MODELS = (Track, Comment, FinalFile)
+
+
+def add_storage_usage(project_bytes):
+    """
+    Apply a {project ID: bytes} dict of changes to the storage_bytes of the
+    Projects and their owners, with one UPDATE per row.
+    """
+    project_bytes = dict((pk, amount) for pk, amount in project_bytes.items() if amount)
+    if not project_bytes:
+        return
+
+    owner_bytes = defaultdict(int)
+    owners = Project.objects.filter(pk__in=project_bytes).values_list("pk", "owner_id")
+    for pk, owner_id in owners:
+        owner_bytes[owner_id] += project_bytes[pk]
+
+    with transaction.atomic():
+        for pk, amount in project_bytes.items():
+            Project.objects.filter(pk=pk).update(storage_bytes=F("storage_bytes") + amount)
+        for owner_id, amount in owner_bytes.items():
+            if amount:
+                add_storage_bytes(owner_id, amount)
+
+
+def project_usage(queryset):
+    """
+    The {project ID: bytes} total of a queryset of Tracks, Comments or FinalFiles.
+    """
+    lookup = queryset.model.PROJECT_LOOKUP
+    totals = queryset.order_by().values_list(lookup).annotate(total=Sum("size"))
+    return dict((pk, total or 0) for pk, total in totals)
+
+
+def expected_project_usage():
+    """
+    The {project ID: bytes} totals computed from the sizes of all files.
+    """
+    usage = defaultdict(int)
+    for model in SIZED_MODELS:
+        for pk, total in project_usage(model.objects.all()).items():
+            usage[pk] += total
+    return usage
+
+
+def fix_project_usage(pk):
+    """
+    Recompute the counter of one Project while its row is locked, so
+    concurrent uploads wait for it. Returns True if it was changed.
+    """
+    with transaction.atomic():
+        project = Project.objects.select_for_update().filter(pk=pk).first()
+        if project is None:
+            return False
+        total = sum(
+            project_usage(model.objects.filter(**{model.PROJECT_LOOKUP: pk})).get(pk, 0)
+            for model in SIZED_MODELS)
+        if total == project.storage_bytes:
+            return False
+        Project.objects.filter(pk=pk).update(storage_bytes=total)
+        return True
+
+
+def fix_owner_usage(user_id):
+    """
+    Recompute the counter of one UserProfile from the counters of its Projects.
+    Returns True if it was changed.
+    """
+    with transaction.atomic():
+        profile = UserProfile.objects.select_for_update().filter(user_id=user_id).first()
+        if profile is None:
+            profile = UserProfile.objects.create(user_id=user_id)
+        total = Project.objects.filter(owner_id=user_id).aggregate(
+            total=Sum("storage_bytes"))["total"] or 0
+        if total == profile.storage_bytes:
+            return False
+        UserProfile.objects.filter(pk=profile.pk).update(storage_bytes=total)
+        return True
+
+
+def reconcile_usage():
+    """
+    Compare all counters with the file sizes and fix the ones that drifted.
+    Totals are compared without locks first, and only mismatched rows are
+    recomputed under a lock. Returns (fixed projects, fixed profiles).
+    """
+    expected = expected_project_usage()
+    projects = Project.objects.values_list("pk", "owner_id", "storage_bytes")
+    fixed_projects = 0
+    for pk, owner_id, storage_bytes in projects.iterator():
+        if storage_bytes != expected.get(pk, 0) and fix_project_usage(pk):
+            fixed_projects += 1
+
+    owner_usage = dict(Project.objects.order_by().values_list("owner_id").annotate(
+        total=Sum("storage_bytes")))
+    owners = set(owner_usage)
+    fixed_profiles = 0
+    for user_id, storage_bytes in UserProfile.objects.values_list("user_id", "storage_bytes"):
+        owners.discard(user_id)
+        if storage_bytes != (owner_usage.get(user_id) or 0) and fix_owner_usage(user_id):
+            fixed_profiles += 1
+    for user_id in owners:  # Owners without a profile
+        if owner_usage[user_id] and fix_owner_usage(user_id):
+            fixed_profiles += 1
+    return fixed_projects, fixed_profiles
+
+
+def measure_missing_sizes(model, batch_size=500):
+    """
+    Store the size of files uploaded before sizes were recorded.
+    Files that can't be found keep a null size and are logged.
+    Tracks of archived Projects are skipped, since their files are in the archive.
+    Returns the number of measured files.
+    """
+    source = model.SIZE_SOURCE
+    queryset = model.objects.filter(size__isnull=True).exclude(**{source: ""}).order_by("pk")
+    if model is Track:
+        queryset = queryset.filter(group__song__project__archived__isnull=True)
+    storage = model._meta.get_field(source).storage
+
+    measured = last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).values_list("pk", source)[:batch_size])
+        if not rows:
+            return measured
+        last_pk = rows[-1][0]
+        for pk, name in rows:
+            try:
+                size = storage.size(name)
+            except (IOError, OSError):
+                logger.warning("Missing file: %s", name)
+                continue
+            # Skip the update if the file was replaced in the meantime
+            measured += model.objects.filter(
+                pk=pk, size__isnull=True, **{source: name}).update(size=size)
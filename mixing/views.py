@@ -1,27 +1,43 @@
 from __future__ import unicode_literals, absolute_import
 
+import hashlib
 import json
+import os
 
 from django.db import IntegrityError
 from django.contrib.auth.decorators import login_required
 from django.contrib.messages import info
+from django.core import signing
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from django.views import generic
 
-from rest_framework import viewsets
-from rest_framework.exceptions import PermissionDenied
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import status, viewsets
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+
+from mezzanine.conf import settings
 
 from utils import get_user_display
+from utils.metrics import CONTENT_TYPE, render_metrics
+from utils.views import PrivateAttachment, PrivateStream, serve_ranged_file
 
-from .models import Project, Song, Group, Track, Comment
+from .bulk import delete_objects, move_objects
+from .files import original_filename
+from .models import Project, Song, Group, Track, Comment, FinalFile
 from .permissions import ProjectIsActive
 from .serializers import (
     ProjectSerializer, SongSerializer, GroupSerializer, TrackSerializer,
-    CommentSerializer)
+    CommentSerializer, FinalFileSerializer)
+from .storage import private_storage
+from .waveform import read_peaks, level_for_width, PeakFormatError
 
 from .purchases.models import UserProfile
 
@@ -57,7 +73,7 @@ class ProjectDetail(generic.TemplateView):
         Create the JSON tree to prime Redux's state.
         """
         songs = project.songs.all()
-        comments = project.comments.all()
+        comments = project.comments.select_related("author")
         groups = Group.objects.filter(song=songs)
         tracks = Track.objects.filter(group=groups)
         profile, _ = UserProfile.objects.get_or_create(user=self.request.user)
@@ -122,6 +138,65 @@ class ProjectSubmit(ProjectDetail):
         return HttpResponseRedirect(project.get_absolute_url())
 
 
+class PrivateFileDownload(PrivateAttachment):
+    """
+    Serves private files with the name they were originally uploaded with.
+    """
+    storage = private_storage
+
+    def get_filename(self, private_file):
+        return original_filename(private_file.relative_name)
+
+
+class PrivatePreview(PrivateStream):
+    """
+    Serves the previews of Tracks and FinalFiles for in-browser playback.
+    """
+    storage = private_storage
+
+
+class SignedFileDownload(generic.View):
+    """
+    Serves the signed URLs of LocalObjectStorage, the local stand-in for S3.
+    Permissions were checked when the URL was signed.
+    """
+
+    def get(self, request, token):
+        if not hasattr(private_storage, "resolve_signed_url"):
+            raise Http404("Signed URLs are not enabled")
+        try:
+            path, content_type, disposition = private_storage.resolve_signed_url(token)
+        except signing.BadSignature:  # Expired too
+            return HttpResponseForbidden("Invalid or expired URL")
+        if not os.path.isfile(path):
+            raise Http404("File not found")
+
+        response = serve_ranged_file(
+            request, path, content_type or "application/octet-stream")
+        if disposition:
+            response["Content-Disposition"] = disposition
+        return response
+
+
+class Metrics(generic.View):
+    """
+    The metrics of all processes in the Prometheus text exposition format,
+    see utils.metrics. Scrapers authenticate with the METRICS_TOKEN as a
+    bearer token, staff members can read it with their session.
+    """
+
+    def get(self, request):
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        token = settings.METRICS_TOKEN
+        authorized = request.user.is_staff or (
+            token and constant_time_compare(header, "Bearer %s" % token))
+        if not authorized:
+            return HttpResponseForbidden("Invalid metrics token")
+        response = HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
 #############
 # API Views #
 #############
@@ -143,9 +218,122 @@ class ProjectRelatedViewSet(viewsets.ModelViewSet):
         return self.queryset.filter(**kwargs)
 
 
-class SongViewSet(ProjectRelatedViewSet):
-    queryset = Song.objects.all()
+class BulkProjectRelatedViewSet(ProjectRelatedViewSet):
+    """
+    Adds endpoints to delete or move several objects in a single request.
+    Subclasses must define parent_field (the FK that bulk_move reassigns) and
+    parent_lookup (the path from Project to the parent object).
+    """
+
+    def get_bulk_queryset(self):
+        """
+        The objects listed in request.data["ids"].
+        All of them must belong to active Projects owned by the user.
+        """
+        try:
+            ids = set(int(pk) for pk in self.request.data["ids"])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({"ids": "A list of IDs is required"})
+
+        active_lookup = self.owner_lookup.replace("owner", "active")
+        queryset = self.get_queryset().filter(pk__in=ids, **{active_lookup: True})
+        if not ids or queryset.count() != len(ids):
+            raise PermissionDenied
+        return queryset
+
+    @list_route(methods=["post"])
+    def bulk_delete(self, request):
+        """
+        Delete several objects (and their Tracks) in one transaction.
+        """
+        deleted = delete_objects(self.get_bulk_queryset())
+        return Response({"deleted": deleted})
+
+    @list_route(methods=["post"])
+    def bulk_move(self, request):
+        """
+        Move several objects to a new parent in an active Project owned by the user.
+        """
+        queryset = self.get_bulk_queryset()
+        parent_model = self.queryset.model._meta.get_field(self.parent_field).rel.to
+        try:
+            target = parent_model.objects.get(pk=request.data[self.parent_field])
+            Project.objects.get(
+                owner=request.user,
+                active=True,
+                **{self.parent_lookup: target.pk}
+            )
+        except (KeyError, TypeError, ValueError,
+                parent_model.DoesNotExist, Project.DoesNotExist):
+            raise PermissionDenied
+        moved = move_objects(queryset, self.parent_field, target)
+        return Response({"moved": moved})
+
+
+class PeaksMixin(object):
+    """
+    Serves the waveform peaks of a Track or FinalFile as JSON.
+    Peak files get a new name whenever they change, so responses are cached
+    by name and can be revalidated by the browser with an ETag.
+    """
+    peaks_cache_timeout = 60 * 60 * 24
+
+    def get_peaks_level(self, request, data):
+        try:
+            if "level" in request.query_params:
+                return int(request.query_params["level"])
+            return level_for_width(data, int(request.query_params.get("width", 1000)))
+        except ValueError:
+            raise ValidationError({"level": "Must be an integer"})
+
+    def read_peaks_file(self, name, storage):
+        """
+        The contents of a peak file, from the cache if possible.
+        """
+        key = "peaks:%s" % hashlib.md5(name.encode("utf-8")).hexdigest()
+        data = cache.get(key)
+        if data is None:
+            with storage.open(name) as f:
+                data = f.read()
+            cache.set(key, data, self.peaks_cache_timeout)
+        return data
+
+    @detail_route(methods=["get"])
+    def peaks(self, request, pk=None):
+        """
+        Min/max pairs of one zoom level. Use ?level=N to pick a level, or
+        ?width=N for the coarsest level that has at least N peaks.
+        """
+        obj = self.get_object()
+        if not obj.peaks:
+            raise NotFound("Peaks have not been extracted yet")
+
+        # Unique for the peak file and the requested level
+        etag = '"%s"' % hashlib.md5(
+            ("%s?%s" % (obj.peaks.name, request.query_params.urlencode())).encode("utf-8")
+        ).hexdigest()
+
+        if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            try:
+                data = self.read_peaks_file(obj.peaks.name, obj.peaks.storage)
+                header, values = read_peaks(data, self.get_peaks_level(request, data))
+            except (IOError, OSError, PeakFormatError):
+                raise NotFound("Peaks are not available")
+            header["data"] = values.tolist()
+            response = Response(header)
+
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, max_age=self.peaks_cache_timeout)
+        return response
+
+
+class SongViewSet(BulkProjectRelatedViewSet):
+    queryset = Song.objects.select_related("project")
     owner_lookup = "project__owner"
+    parent_field = "project"
+    parent_lookup = "pk"
     serializer_class = SongSerializer
 
     def perform_create(self, serializer):
@@ -163,9 +351,11 @@ class SongViewSet(ProjectRelatedViewSet):
         serializer.save()
 
 
-class GroupViewSet(ProjectRelatedViewSet):
-    queryset = Group.objects.all()
+class GroupViewSet(BulkProjectRelatedViewSet):
+    queryset = Group.objects.select_related("song__project")
     owner_lookup = "song__project__owner"
+    parent_field = "song"
+    parent_lookup = "songs"
     serializer_class = GroupSerializer
 
     def perform_create(self, serializer):
@@ -183,9 +373,11 @@ class GroupViewSet(ProjectRelatedViewSet):
         serializer.save()
 
 
-class TrackViewSet(ProjectRelatedViewSet):
-    queryset = Track.objects.all()
+class TrackViewSet(PeaksMixin, BulkProjectRelatedViewSet):
+    queryset = Track.objects.select_related("group__song__project")
     owner_lookup = "group__song__project__owner"
+    parent_field = "group"
+    parent_lookup = "songs__groups"
     serializer_class = TrackSerializer
 
     def perform_create(self, serializer):
@@ -213,7 +405,7 @@ class TrackViewSet(ProjectRelatedViewSet):
 
 
 class CommentViewSet(ProjectRelatedViewSet):
-    queryset = Comment.objects.all()
+    queryset = Comment.objects.select_related("author")
     owner_lookup = "project__owner"
     serializer_class = CommentSerializer
 
@@ -230,3 +422,42 @@ class CommentViewSet(ProjectRelatedViewSet):
         except (KeyError, Project.DoesNotExist):
             raise PermissionDenied
         serializer.save(author=self.request.user)
+
+
+class FinalFileViewSet(PeaksMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Read only, FinalFiles are uploaded by staff members in the admin.
+    """
+    queryset = FinalFile.objects.all()
+    permission_classes = (IsAuthenticated,)
+    serializer_class = FinalFileSerializer
+
+    def get_queryset(self):
+        return self.queryset.filter(project__owner=self.request.user)
+
+
+class StaffProjectViewSet(viewsets.GenericViewSet):
+    """
+    Endpoints for staff members to manage many Projects at once.
+    """
+    queryset = Project.objects.all()
+    permission_classes = (IsAdminUser,)
+
+    @list_route(methods=["post"])
+    def bulk_status(self, request):
+        """
+        Move the Projects in request.data["ids"] to request.data["status"],
+        with the same rules as saving each one. See ProjectQuerySet.set_status().
+        """
+        try:
+            ids = set(int(pk) for pk in request.data["ids"])
+            new_status = int(request.data["status"])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({"ids": "A list of IDs and a status are required"})
+        if new_status not in dict(Project.STATUS_CHOICES):
+            raise ValidationError({"status": "Unknown status"})
+
+        queryset = self.get_queryset().filter(pk__in=ids)
+        if not ids or queryset.count() != len(ids):
+            raise NotFound("Some of the projects don't exist")
+        return Response({"updated": queryset.set_status(new_status)})
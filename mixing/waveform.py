@@ -0,0 +1,179 @@
+from __future__ import unicode_literals, absolute_import, division
+
+import struct
+
+import numpy as np
+
+from .audio import read_audio_info
+
+# Peak file layout (all little endian):
+#   header: magic, version, number of levels, sample rate, frames
+#   one (samples per peak, number of peaks) pair per level
+#   the int8 (min, max) pairs of every level, finest level first
+MAGIC = b"PEAK"
+VERSION = 1
+HEADER = struct.Struct("<4sBBII")
+LEVEL = struct.Struct("<II")
+
+# The finest level has one (min, max) pair per 256 frames.
+# Every following level is 4 times coarser.
+SAMPLES_PER_PEAK = 256
+LEVEL_FACTOR = 4
+MAX_LEVELS = 8
+
+# Frames read from the memory map at a time (a multiple of SAMPLES_PER_PEAK)
+BLOCK_FRAMES = SAMPLES_PER_PEAK * 4096
+
+
+class PeakFormatError(ValueError):
+    pass
+
+
+def sample_view(path, info):
+    """
+    Memory map the PCM data of a WAV or AIFF file as a (frames, channels) array.
+    Nothing is read until the array is sliced, so files larger than RAM work.
+    Returns (array, scale), where array / scale is in the -1.0 to 1.0 range.
+    """
+    if info.data_offset is None:
+        raise PeakFormatError("Can't read samples from %s files" % info.format)
+
+    width = (info.bit_depth + 7) // 8
+    endian = ">" if info.big_endian else "<"
+    if info.float_samples:
+        dtype, scale = np.dtype(endian + "f%d" % width), 1.0
+    elif width == 1:
+        # 8 bit WAV samples are unsigned, AIFF ones are signed
+        dtype, scale = np.dtype("i1" if info.format == "aiff" else "u1"), 128.0
+    elif width in (2, 4):
+        dtype, scale = np.dtype(endian + "i%d" % width), float(2 ** (8 * width - 1))
+    elif width == 3:
+        dtype, scale = np.dtype("u1"), float(2 ** 23)
+    else:
+        raise PeakFormatError("Unsupported sample width: %d bytes" % width)
+
+    shape = (info.frames, info.channels, 3) if width == 3 else (info.frames, info.channels)
+    if not info.frames:
+        return np.zeros((0, info.channels), np.float32), 1.0
+    return np.memmap(path, dtype=dtype, mode="r", offset=info.data_offset, shape=shape), scale
+
+
+def to_float(block, info, scale):
+    """
+    Convert a block of raw samples to float32 in the -1.0 to 1.0 range.
+    """
+    if block.ndim == 3:  # 24 bit samples, combine the bytes
+        block = block.astype(np.int32)
+        if info.big_endian:
+            block = block[..., 0] << 16 | block[..., 1] << 8 | block[..., 2]
+        else:
+            block = block[..., 2] << 16 | block[..., 1] << 8 | block[..., 0]
+        block = (block << 8) >> 8  # Sign extend
+    elif block.dtype == np.uint8:
+        block = block.astype(np.int16) - 128
+    return block.astype(np.float32) / scale
+
+
+def block_peaks(samples, samples_per_peak):
+    """
+    Min and max of every samples_per_peak frames of a (frames, channels) array,
+    across all channels. A partial group at the end gets its own peak.
+    """
+    frames = len(samples)
+    full = frames - frames % samples_per_peak
+    grouped = samples[:full].reshape(-1, samples_per_peak * samples.shape[1])
+    mins, maxs = grouped.min(axis=1), grouped.max(axis=1)
+    if full < frames:
+        mins = np.append(mins, samples[full:].min())
+        maxs = np.append(maxs, samples[full:].max())
+    return mins, maxs
+
+
+def reduce_peaks(mins, maxs, factor):
+    """
+    Combine every `factor` peaks into one, for the next zoom level.
+    """
+    padding = -len(mins) % factor
+    if padding:
+        mins = np.append(mins, np.repeat(mins[-1], padding))
+        maxs = np.append(maxs, np.repeat(maxs[-1], padding))
+    return mins.reshape(-1, factor).min(axis=1), maxs.reshape(-1, factor).max(axis=1)
+
+
+def quantize(values):
+    return np.clip(np.round(values * 127), -127, 127).astype(np.int8)
+
+
+def compute_peaks(path):
+    """
+    Build the peak file contents for the audio file at path.
+    The file is streamed in blocks of BLOCK_FRAMES from a memory map.
+    Raises AudioFormatError or PeakFormatError for unsupported files.
+    """
+    with open(path, "rb") as f:
+        info = read_audio_info(f)
+    samples, scale = sample_view(path, info)
+
+    mins, maxs = [], []
+    for start in range(0, len(samples), BLOCK_FRAMES):
+        block = to_float(samples[start:start + BLOCK_FRAMES], info, scale)
+        block_mins, block_maxs = block_peaks(block, SAMPLES_PER_PEAK)
+        mins.append(block_mins)
+        maxs.append(block_maxs)
+    del samples  # Release the memory map
+
+    mins = quantize(np.concatenate(mins)) if mins else np.zeros(0, np.int8)
+    maxs = quantize(np.concatenate(maxs)) if maxs else np.zeros(0, np.int8)
+
+    levels = [(SAMPLES_PER_PEAK, mins, maxs)]
+    while len(levels) < MAX_LEVELS and len(levels[-1][1]) > 1:
+        samples_per_peak, mins, maxs = levels[-1]
+        mins, maxs = reduce_peaks(mins, maxs, LEVEL_FACTOR)
+        levels.append((samples_per_peak * LEVEL_FACTOR, mins, maxs))
+
+    parts = [HEADER.pack(MAGIC, VERSION, len(levels), info.sample_rate, info.frames)]
+    parts.extend(LEVEL.pack(spp, len(mins)) for spp, mins, _ in levels)
+    for _, mins, maxs in levels:
+        parts.append(np.column_stack((mins, maxs)).tobytes())
+    return b"".join(parts)
+
+
+def read_peaks(data, level=0):
+    """
+    Parse the contents of a peak file.
+    Returns (header dict, int8 array of interleaved min/max values for level).
+    """
+    try:
+        magic, version, count, sample_rate, frames = HEADER.unpack_from(data)
+    except struct.error:
+        raise PeakFormatError("Truncated peak file")
+    if magic != MAGIC or version != VERSION:
+        raise PeakFormatError("Unknown peak file format")
+
+    levels = [LEVEL.unpack_from(data, HEADER.size + i * LEVEL.size) for i in range(count)]
+    level = max(0, min(level, count - 1))
+    offset = HEADER.size + count * LEVEL.size + sum(2 * n for _, n in levels[:level])
+    samples_per_peak, length = levels[level]
+    values = np.frombuffer(data, np.int8, 2 * length, offset)
+
+    header = {
+        "sample_rate": sample_rate,
+        "frames": frames,
+        "level": level,
+        "levels": [{"samples_per_peak": spp, "length": n} for spp, n in levels],
+        "samples_per_peak": samples_per_peak,
+        "length": length,
+    }
+    return header, values
+
+
+def level_for_width(data, width):
+    """
+    The coarsest level that still has at least `width` peaks.
+    """
+    header, _ = read_peaks(data)
+    level = 0
+    for i, info in enumerate(header["levels"]):
+        if info["length"] >= width:
+            level = i
+    return level
@@ -9,7 +9,6 @@ import unicodedata
 from StringIO import StringIO
 
 from django.contrib.sites.models import Site
-from django.core import mail
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.utils.safestring import mark_safe
 from django.utils.text import force_text
@@ -61,10 +60,31 @@ def slugify_filename(value):
     return mark_safe(re.sub(r"[-\s]+", "-", value))
 
 
+def display_filename(name):
+    """
+    The filename part of a private storage path, without the unique prefix
+    added by mixing.permissions.sharded_path().
+    """
+    filename = name.split("/")[-1]
+    return re.sub(r"^[0-9a-f]{32}-", "", filename)
+
+
+def has_local_path(storage):
+    """
+    True if the files of a storage are on the local file system.
+    Remote storages (e.g. S3) don't implement path().
+    """
+    try:
+        storage.path("")
+    except NotImplementedError:
+        return False
+    return True
+
+
 def notify_exception(request, e):
     """
     Emulates Django's email Exception reporter.
-    Will produce and send traceback and request info.
+    Will produce traceback and request info and queue them to be sent.
     http://stackoverflow.com/a/29878519/1330003
     """
     exc_info = sys.exc_info()
@@ -74,10 +94,9 @@ def notify_exception(request, e):
         '\n'.join(traceback.format_exception(*exc_info)),
         reporter.filter.get_request_repr(request)
     )
-    mail.mail_admins(
-        subject, message, fail_silently=True,
-        html_message=reporter.get_traceback_html()
-    )
+    # Sent by the job worker, so the request doesn't wait for the SMTP server
+    from mixing.jobs.tasks import mail_admins
+    mail_admins.delay(subject, message, html_message=reporter.get_traceback_html())
 
 
 def create_temp_file(name="temp.txt", filetype="text"):
@@ -98,6 +117,7 @@ class StatusCodes(object):
     A subset of rest_framework.status.
     """
     HTTP_200_OK = 200
+    HTTP_201_CREATED = 201
     HTTP_301_MOVED_PERMANENTLY = 301
     HTTP_307_TEMPORARY_REDIRECT = 307
     HTTP_400_BAD_REQUEST = 400
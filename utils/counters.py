@@ -0,0 +1,19 @@
+from __future__ import unicode_literals, absolute_import
+
+
+class CounterFieldsMixin(object):
+    """
+    Model mixin for fields that are only changed with F() expressions
+    (e.g. byte counters). save() on an existing row leaves them out, so an
+    instance loaded before a concurrent update can't write an old value back.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (self.pk is not None and kwargs.get("update_fields") is None
+                and not kwargs.get("force_insert")):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        return super(CounterFieldsMixin, self).save(*args, **kwargs)
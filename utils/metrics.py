@@ -0,0 +1,357 @@
+from __future__ import unicode_literals, absolute_import, division
+
+import errno
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Most buckets a Histogram can have, the one without a bound included
+MAX_BUCKETS = 16
+# Counter and Histogram samples per process, one for each set of label values.
+# The reserved ones are for the samples of each metric whose label values
+# didn't get a row of their own, rendered with all labels set to "other".
+METRIC_SLOTS = 1024
+METRIC_RESERVED = 64
+OTHER_LABEL = "other"
+METRIC_DTYPE = np.dtype([
+    (str("key"), "S192"), (str("value"), "f8"), (str("sum"), "f8"),
+    (str("buckets"), "i8", MAX_BUCKETS)])
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# The metrics rendered by render_metrics(), in order
+REGISTRY = []
+
+
+class SharedFile(object):
+    """
+    Rows of a NumPy dtype in a memory mapped file of PERF_STATS_DIR, one file
+    per process, prefix and layout of the dtype, so a new layout never opens
+    the file of an older one. The first field of the dtype is the key of a row.
+    Only its own process writes to a file, so processes never wait on each
+    other; read_shared_files() adds up the files of all of them. Once all
+    rows but the `reserved` ones are taken, new keys share the row of their
+    overflow key, which can take the reserved rows.
+    """
+
+    def __init__(self, directory, prefix, dtype, slots, reserved=0):
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # Created by another process
+                pass
+        self.pid = os.getpid()
+        self.path = os.path.join(
+            directory, "%s-%s-%d.dat" % (prefix, file_layout(dtype), self.pid))
+        # An existing file was left by an earlier process with the same PID
+        size = dtype.itemsize * slots
+        mode = "r+" if os.path.exists(self.path) and os.path.getsize(self.path) == size else "w+"
+        self.rows = np.memmap(self.path, dtype=dtype, mode=mode, shape=(slots,))
+        self.key_field = dtype.names[0]
+        self.key_size = dtype[self.key_field].itemsize
+        self.reserved = reserved
+        self.slots = dict(
+            (key.decode("utf-8"), i) for i, key in enumerate(self.rows[self.key_field]) if key)
+        # The rows of keys that didn't get their own, at most as many as rows
+        # so labels with unbounded values can't grow it
+        self.overflowed = {}
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        index = len(self.slots)
+        self.rows[self.key_field][index] = key.encode("utf-8")[:self.key_size]
+        self.slots[key] = index
+        return index
+
+    def slot(self, key, overflow):
+        index = self.slots.get(key)
+        if index is None:
+            index = self.overflowed.get(key)
+        if index is not None:
+            return index
+        if len(self.slots) < len(self.rows) - self.reserved:
+            return self.add(key)
+
+        index = self.slots.get(overflow)
+        if index is None:
+            # Only once the reserved rows are gone too, overflow keys share the last one
+            index = self.add(overflow) if len(self.slots) < len(self.rows) else len(self.rows) - 1
+        if len(self.overflowed) < len(self.rows):
+            self.overflowed[key] = index
+        return index
+
+    @contextmanager
+    def row(self, key, overflow):
+        """
+        Lock the file and yield the row of a key, to update it in place.
+        """
+        with self.lock:
+            yield self.rows[self.slot(key, overflow)]
+
+
+_files = {}
+
+
+def file_layout(dtype):
+    """
+    A short hash of a dtype, part of the names of its SharedFiles.
+    """
+    return hashlib.md5(str(dtype.descr).encode("utf-8")).hexdigest()[:8]
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM  # Running as another user
+    return True
+
+
+def remove_stale_files(directory=None):
+    """
+    Remove the SharedFiles of processes that have exited, whatever their
+    layout. Their samples stop counting, so this runs when the app server
+    starts (see the clear_stats command), where counters restart anyway.
+    Returns the number of removed files.
+    """
+    directory = directory or getattr(settings, "PERF_STATS_DIR", None)
+    removed = 0
+    if not directory:
+        return removed
+    for path in glob.glob(os.path.join(directory, "*.dat")):
+        try:
+            pid = int(os.path.basename(path)[:-len(".dat")].rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            continue
+        if process_exists(pid):
+            continue
+        try:
+            os.remove(path)
+        except OSError:  # Removed by another process
+            continue
+        removed += 1
+    return removed
+
+
+def bucket(bounds, value):
+    """
+    The index of the histogram bucket of a value.
+    """
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            return i
+    return len(bounds)
+
+
+def shared_file(prefix, dtype, slots, reserved=0):
+    """
+    The SharedFile of the current process, opened again after a fork.
+    None if PERF_STATS_DIR is empty or the file can't be opened, so metrics
+    never break the code that records them.
+    """
+    directory = getattr(settings, "PERF_STATS_DIR", None)
+    if not directory:
+        return None
+    name = (directory, prefix)
+    f = _files.get(name)
+    if f is None or f.pid != os.getpid():
+        try:
+            f = _files[name] = SharedFile(directory, prefix, dtype, slots, reserved)
+        except (EnvironmentError, ValueError):
+            logger.exception("Can't open the %s stats file in %s", prefix, directory)
+            return None
+    return f
+
+
+def read_shared_files(prefix, dtype, directory=None):
+    """
+    The rows of all processes that wrote to files with a prefix, added up by
+    key, as {key: {field: value}}.
+    """
+    directory = directory or getattr(settings, "PERF_STATS_DIR", None)
+    key_field, fields = dtype.names[0], dtype.names[1:]
+    totals = {}
+    if not directory:
+        return totals
+    pattern = "%s-%s-*.dat" % (prefix, file_layout(dtype))
+    for path in glob.glob(os.path.join(directory, pattern)):
+        rows = np.fromfile(path, dtype=dtype)
+        for row in rows[rows[key_field] != b""]:
+            key = row[key_field].decode("utf-8")
+            if key in totals:
+                for name in fields:
+                    totals[key][name] = totals[key][name] + row[name]
+            else:
+                totals[key] = dict((name, row[name]) for name in fields)
+    return totals
+
+
+def format_labels(labels):
+    """
+    Label values in the text exposition format, without the braces.
+    """
+    def escape(value):
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join('%s="%s"' % (name, escape("%s" % value))
+                    for name, value in sorted(labels.items()))
+
+
+def format_value(value):
+    value = float(value)
+    return "%d" % value if value.is_integer() else repr(value)
+
+
+def format_sample(name, labels, value):
+    if labels:
+        name = "%s{%s}" % (name, labels)
+    return "%s %s" % (name, format_value(value))
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class Metric(object):
+    """
+    A metric of the text exposition format. Counters and Histograms keep
+    their samples in the metrics SharedFile of each process.
+    """
+    type = None
+    prefix = "metrics"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(sorted(labelnames))
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        if tuple(sorted(labels)) != self.labelnames:
+            raise ValueError("%s takes the labels %s" % (self.name, ", ".join(self.labelnames)))
+        return "%s|%s" % (self.name, format_labels(labels))
+
+    def row(self, labels):
+        f = shared_file(self.prefix, METRIC_DTYPE, METRIC_SLOTS, METRIC_RESERVED)
+        if f is None:
+            return nothing()
+        overflow = dict((name, OTHER_LABEL) for name in self.labelnames)
+        return f.row(self.key(labels), self.key(overflow))
+
+    def samples(self, values):
+        """
+        The (labels, value) of the metric in the added up shared files.
+        """
+        prefix = "%s|" % self.name
+        for key in sorted(values):
+            if key.startswith(prefix):
+                yield key[len(prefix):], values[key]
+
+    def render(self, values):
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.type),
+        ]
+        return lines + list(self.render_samples(values))
+
+
+@contextmanager
+def nothing():
+    yield None
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        with self.row(labels) as row:
+            if row is not None:
+                row["value"] += amount
+
+    def render_samples(self, values):
+        for labels, value in self.samples(values):
+            yield format_sample(self.name, labels, value["value"])
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        if len(buckets) >= MAX_BUCKETS:
+            raise ValueError("Histograms have at most %d buckets" % (MAX_BUCKETS - 1))
+        self.bounds = tuple(buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        with self.row(labels) as row:
+            if row is not None:
+                row["value"] += 1
+                row["sum"] += value
+                row["buckets"][bucket(self.bounds, value)] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a block in seconds, also if it raises.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def render_samples(self, values):
+        for labels, value in self.samples(values):
+            for samples in histogram_samples(
+                    self.name, labels, self.bounds, value["buckets"], value["sum"]):
+                yield samples
+
+
+def histogram_samples(name, labels, bounds, buckets, total):
+    """
+    The _bucket, _sum and _count samples of a histogram, from the number of
+    values in each bucket.
+    """
+    counts = np.cumsum(buckets[:len(bounds) + 1])
+    separator = "," if labels else ""
+    for bound, count in zip(tuple(bounds) + (float("inf"),), counts):
+        yield format_sample(
+            "%s_bucket" % name, '%s%sle="%s"' % (labels, separator, format_bound(bound)), count)
+    yield format_sample("%s_sum" % name, labels, total)
+    yield format_sample("%s_count" % name, labels, counts[-1])
+
+
+class Gauge(Metric):
+    """
+    A value measured when the metrics are rendered, e.g. a queue length.
+    The function returns a list of ({label: value}, value).
+    """
+    type = "gauge"
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        self.function = function
+        super(Gauge, self).__init__(name, documentation, labelnames)
+
+    def render_samples(self, values):
+        for labels, value in self.function():
+            yield format_sample(self.name, format_labels(labels), value)
+
+
+def render_metrics(registry=None):
+    """
+    All metrics in the text exposition format.
+    """
+    values = read_shared_files(Metric.prefix, METRIC_DTYPE)
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        lines.extend(metric.render(values))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,274 @@
+from __future__ import unicode_literals, absolute_import, division
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache as BaseLocMemCache
+from django.core.cache.backends.memcached import MemcachedCache as BaseMemcachedCache
+from django.db.backends.utils import CursorWrapper
+
+from .metrics import (
+    Metric, bucket, format_labels, format_sample, histogram_samples, read_shared_files,
+    shared_file)
+from .queries import log_slow_query
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, the last bucket has no bound
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTE_BUCKETS = (1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20, 100 << 20, 1 << 30)
+
+# Histograms of each view, as (name, bucket bounds) of the `<name>_buckets` and
+# `<name>_sum` fields of STATS_DTYPE
+HISTOGRAMS = (
+    ("duration", TIME_BUCKETS),
+    ("db_duration", TIME_BUCKETS),
+    ("queries", QUERY_BUCKETS),
+    ("bytes", BYTE_BUCKETS),
+)
+STATS_DTYPE = np.dtype(
+    [(str("view"), "S96"), (str("requests"), "i8"), (str("errors"), "i8"),
+     (str("cache_hits"), "i8"), (str("cache_misses"), "i8")] +
+    [field for name, bounds in HISTOGRAMS for field in (
+        (str("%s_buckets" % name), "i8", len(bounds) + 1), (str("%s_sum" % name), "f8"))])
+
+# Views per stats file. Once they are all taken, the rest share the row of
+# OTHER_VIEWS, which is reserved.
+STATS_SLOTS = 256
+STATS_PREFIX = "stats"
+OTHER_VIEWS = "other"
+
+_local = threading.local()
+
+
+class RequestStats(object):
+    """
+    What a request has used so far. Collected for the current thread between
+    start_request() and finish_request().
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.queries = 0
+        self.db_duration = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add_query(self, duration):
+        self.queries += 1
+        self.db_duration += duration
+
+    def add_cache_lookups(self, hits, misses):
+        self.cache_hits += hits
+        self.cache_misses += misses
+
+
+def start_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def finish_request():
+    stats, _local.stats = getattr(_local, "stats", None), None
+    return stats
+
+
+def current_stats():
+    return getattr(_local, "stats", None)
+
+
+def _timed(method):
+    def wrapper(self, sql, *args, **kwargs):
+        start = time.time()
+        try:
+            return method(self, sql, *args, **kwargs)
+        finally:
+            duration = time.time() - start
+            stats = getattr(_local, "stats", None)
+            if stats is not None:
+                stats.add_query(duration)
+            log_slow_query(sql, duration)
+    wrapper.__name__ = method.__name__
+    wrapper.timed = True
+    return wrapper
+
+
+def time_queries():
+    """
+    Time the queries of all database connections, for the current request
+    and the slow query log. Django has no hook for it before 2.0, so
+    CursorWrapper is patched; the debug cursor calls the same methods.
+    """
+    for name in ("execute", "executemany"):
+        method = getattr(CursorWrapper, name)
+        if not getattr(method, "timed", False):
+            setattr(CursorWrapper, name, _timed(method))
+
+
+class CacheStatsMixin(object):
+    """
+    Cache backend mixin that counts the hits and misses of the current request.
+    """
+
+    def get(self, key, default=None, version=None, **kwargs):
+        missing = object()
+        value = super(CacheStatsMixin, self).get(key, missing, version=version, **kwargs)
+        stats = getattr(_local, "stats", None)
+        if stats is not None:
+            stats.add_cache_lookups(*((0, 1) if value is missing else (1, 0)))
+        return default if value is missing else value
+
+    def get_many(self, keys, version=None):
+        values = super(CacheStatsMixin, self).get_many(keys, version=version)
+        stats = getattr(_local, "stats", None)
+        if stats is not None:
+            stats.add_cache_lookups(len(values), len(keys) - len(values))
+        return values
+
+
+class LocMemCache(CacheStatsMixin, BaseLocMemCache):
+    pass
+
+
+class MemcachedCache(CacheStatsMixin, BaseMemcachedCache):
+    pass
+
+
+def record_request(view, duration, stats, size, error=False):
+    """
+    Add a request to the histograms of its view in the stats SharedFile of
+    the current process.
+    """
+    stats_file = shared_file(STATS_PREFIX, STATS_DTYPE, STATS_SLOTS, reserved=1)
+    if stats_file is None:
+        return
+    values = {
+        "duration": duration, "db_duration": stats.db_duration,
+        "queries": stats.queries, "bytes": size}
+    with stats_file.row(view, OTHER_VIEWS) as row:
+        row["requests"] += 1
+        row["errors"] += int(error)
+        row["cache_hits"] += stats.cache_hits
+        row["cache_misses"] += stats.cache_misses
+        for name, bounds in HISTOGRAMS:
+            row["%s_buckets" % name][bucket(bounds, values[name])] += 1
+            row["%s_sum" % name] += values[name]
+
+
+def read_stats(directory=None):
+    """
+    The histograms of all processes that wrote to the stats directory, as
+    {view: stats} where stats has the fields of STATS_DTYPE.
+    """
+    return read_shared_files(STATS_PREFIX, STATS_DTYPE, directory)
+
+
+def server_timing(duration, stats):
+    """
+    The Server-Timing header value of a request, durations in milliseconds.
+    """
+    return ", ".join([
+        'db;dur=%.1f;desc="%d queries"' % (stats.db_duration * 1000, stats.queries),
+        'cache;desc="%d hits, %d misses"' % (stats.cache_hits, stats.cache_misses),
+        "total;dur=%.1f" % (duration * 1000),
+    ])
+
+
+def count_bytes(content, done):
+    """
+    Yield the chunks of streaming content and call done(size) at the end,
+    also when the client goes away before it.
+    """
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        done(size)
+
+
+class PerformanceMiddleware(object):
+    """
+    Records the wall time, number and time of queries, cache hits and misses
+    and response size of every request. Adds them as a Server-Timing header
+    (if PERF_SERVER_TIMING) and to the per-view histograms, see record_request().
+    Streaming responses are recorded once their content has been sent.
+    Should be the first middleware, so it sees all the others' work.
+    """
+
+    def __init__(self):
+        time_queries()
+
+    def process_request(self, request):
+        request._performance = start_request()
+        request._performance_view = OTHER_VIEWS
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._performance_view = "%s.%s" % (
+            view_func.__module__, getattr(view_func, "__name__", view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        stats = getattr(request, "_performance", None)
+        if stats is None:
+            return response
+        finish_request()
+        duration = time.time() - stats.started
+        if getattr(settings, "PERF_SERVER_TIMING", False):
+            response["Server-Timing"] = server_timing(duration, stats)
+
+        view = request._performance_view
+        error = response.status_code >= 500
+
+        def record(size):
+            try:
+                record_request(view, time.time() - stats.started, stats, size, error)
+            except Exception:  # Never fail a response because of its stats
+                logger.exception("Can't record the stats of %s", view)
+
+        if response.streaming:
+            response.streaming_content = count_bytes(response.streaming_content, record)
+        else:
+            record(len(response.content))
+        return response
+
+
+class RequestMetric(Metric):
+    """
+    A metric of the request stats by view, see record_request().
+    Histograms are the fields of HISTOGRAMS, counters other fields of STATS_DTYPE.
+    """
+
+    def __init__(self, name, documentation, field):
+        self.field = field
+        self.bounds = dict(HISTOGRAMS).get(field)
+        self.type = "counter" if self.bounds is None else "histogram"
+        super(RequestMetric, self).__init__(name, documentation, ["view"])
+
+    def render_samples(self, values):
+        for view, stats in sorted(read_stats().items()):
+            labels = format_labels({"view": view})
+            if self.bounds is None:
+                yield format_sample(self.name, labels, stats[self.field])
+                continue
+            for sample in histogram_samples(
+                    self.name, labels, self.bounds,
+                    stats["%s_buckets" % self.field], stats["%s_sum" % self.field]):
+                yield sample
+
+
+RequestMetric("http_requests_total", "Requests by view.", "requests")
+RequestMetric("http_request_errors_total", "Requests answered with a 5xx status.", "errors")
+RequestMetric("http_request_duration_seconds", "Time to the last byte of a response.", "duration")
+RequestMetric("http_request_db_duration_seconds", "Time spent in queries.", "db_duration")
+RequestMetric("http_request_queries", "Queries per request.", "queries")
+RequestMetric("http_response_bytes", "Size of the responses.", "bytes")
+RequestMetric("http_request_cache_hits_total", "Cache lookups that found a value.", "cache_hits")
+RequestMetric(
+    "http_request_cache_misses_total", "Cache lookups that didn't find a value.",
+    "cache_misses")
@@ -0,0 +1,84 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+import threading
+
+from django.db import connection
+from django.utils.six.moves.queue import Queue
+
+logger = logging.getLogger(__name__)
+
+# Put on the result queue by a thread that has no items left
+_DONE = object()
+
+
+def iter_in_threads(func, items, workers=4):
+    """
+    Call func(item) for every item using at most `workers` threads and yield
+    the results as soon as they are ready (in no particular order), so the
+    caller handles each one while the others are still running.
+    Items are taken from the iterable when a thread is free and at most
+    `workers` results wait for the caller, so memory doesn't grow with the
+    number of items.
+    Exceptions are logged and don't stop the remaining items.
+    Each thread closes its own database connection when it's done.
+    With workers <= 1 everything runs in the current thread.
+    """
+    def call(item):
+        try:
+            return True, func(item)
+        except Exception:
+            logger.exception("Error processing %r", item)
+            return False, None
+
+    if workers <= 1:
+        for item in items:
+            ok, result = call(item)
+            if ok:
+                yield result
+        return
+
+    items = iter(items)
+    lock = threading.Lock()
+    stop = threading.Event()
+    results = Queue(maxsize=workers)
+
+    def work():
+        try:
+            while not stop.is_set():
+                with lock:
+                    item = next(items, _DONE)
+                if item is _DONE:
+                    return
+                ok, result = call(item)
+                if ok:
+                    results.put(result)
+        finally:
+            connection.close()
+            results.put(_DONE)
+
+    for _ in range(workers):
+        threading.Thread(target=work).start()
+
+    running = workers
+    try:
+        while running:
+            result = results.get()
+            if result is _DONE:
+                running -= 1
+            else:
+                yield result
+    finally:
+        # The caller stopped early: let the threads finish their current item
+        stop.set()
+        while running:
+            if results.get() is _DONE:
+                running -= 1
+
+
+def run_in_threads(func, items, workers=4):
+    """
+    Call func(item) for every item like iter_in_threads().
+    Returns the list of results (in no particular order).
+    """
+    return list(iter_in_threads(func, items, workers))
@@ -0,0 +1,136 @@
+from __future__ import unicode_literals, absolute_import
+
+import logging
+import re
+import traceback
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+logger = logging.getLogger(__name__)
+
+# The SQLite backend of Django 1.8 captures queries as the repr of the SQL
+# with placeholders and the parameters
+SQLITE_QUERY = re.compile(r"^QUERY = u?(['\"])(.*)\1 - PARAMS = .*$", re.DOTALL)
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """
+    A query without its values, so the queries of an N+1 pattern are equal:
+    literals become ? and lists of them (...).
+    """
+    match = SQLITE_QUERY.match(sql)
+    if match:
+        sql = match.group(2).replace("%s", "?")
+    sql = STRINGS.sub("?", sql)
+    sql = NUMBERS.sub("?", sql)
+    sql = LISTS.sub("(...)", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+def group_queries(queries):
+    """
+    The captured queries ({"sql": ..., "time": ...}) grouped by normalized SQL,
+    as [(sql, count, seconds)] in order of first execution.
+    """
+    groups = OrderedDict()
+    for query in queries:
+        sql = normalize_sql(query["sql"])
+        count, seconds = groups.get(sql, (0, 0.0))
+        groups[sql] = (count + 1, seconds + float(query.get("time") or 0))
+    return [(sql, count, seconds) for sql, (count, seconds) in groups.items()]
+
+
+def repeated_queries(queries, repeats):
+    """
+    The groups of group_queries() that ran more than `repeats` times.
+    """
+    return [group for group in group_queries(queries) if group[1] > repeats]
+
+
+def format_groups(groups):
+    return "\n".join("%4dx %.3fs  %s" % (count, seconds, sql) for sql, count, seconds in groups)
+
+
+class max_queries(object):
+    """
+    Fail a test that runs more than `count` queries, or the same query more
+    than `repeats` times with different values, which is an N+1 pattern.
+    Used as a decorator of test methods or as a context manager.
+    """
+
+    def __init__(self, count, repeats=2, using=DEFAULT_DB_ALIAS):
+        self.count = count
+        self.repeats = repeats
+        self.using = using
+
+    def __enter__(self):
+        from django.test.utils import CaptureQueriesContext
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.context.__exit__(exc_type, exc_value, tb)
+        if exc_type is not None:
+            return
+        queries = self.context.captured_queries
+        if len(queries) > self.count:
+            raise AssertionError("%d queries, expected at most %d:\n%s" % (
+                len(queries), self.count, format_groups(group_queries(queries))))
+        repeated = repeated_queries(queries, self.repeats)
+        if repeated:
+            raise AssertionError("Queries repeated more than %d times:\n%s" % (
+                self.repeats, format_groups(repeated)))
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with max_queries(self.count, self.repeats, self.using):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def log_slow_query(sql, duration):
+    """
+    Log a query that took longer than PERF_SLOW_QUERY_SECONDS, with the stack
+    of the code that ran it (Django's frames left out).
+    """
+    threshold = getattr(settings, "PERF_SLOW_QUERY_SECONDS", None)
+    if threshold is None or duration < threshold:
+        return
+    stack = [
+        frame for frame in traceback.format_stack()[:-2]
+        if "/django/" not in frame and "/utils/performance.py" not in frame]
+    logger.warning(
+        "Slow query (%.3fs): %s\n%s", duration, sql, "".join(stack),
+        extra={"duration": duration, "sql": sql})
+
+
+class QueryInspectorMiddleware(object):
+    """
+    Logs the queries that a request repeats more than PERF_REPEATED_QUERIES
+    times, in development only: queries are only recorded with DEBUG.
+    """
+
+    def process_request(self, request):
+        if settings.DEBUG:
+            request._queries_start = len(connection.queries_log)
+
+    def process_response(self, request, response):
+        start = getattr(request, "_queries_start", None)
+        if start is None:
+            return response
+        queries = list(connection.queries_log)[start:]
+        repeated = repeated_queries(queries, getattr(settings, "PERF_REPEATED_QUERIES", 2))
+        if repeated:
+            logger.warning(
+                "%s %s repeats queries, probably N+1:\n%s",
+                request.method, request.path, format_groups(repeated))
+        return response
@@ -0,0 +1,35 @@
+from __future__ import unicode_literals, absolute_import, division
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Limits the rate of an operation (e.g. bytes read per second) across threads.
+    Up to `capacity` tokens can be used in a burst, then consume() blocks
+    until enough tokens have been refilled at `rate` per second.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Take `amount` tokens, waiting as long as needed.
+        Amounts larger than the capacity are allowed and simply wait longer.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
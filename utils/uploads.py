@@ -0,0 +1,78 @@
+from __future__ import unicode_literals, absolute_import
+
+import hashlib
+import time
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler, TemporaryFileUploadHandler)
+
+from .metrics import Histogram
+
+upload_bytes = Histogram(
+    "upload_bytes", "Size of the uploaded files.",
+    (1 << 20, 10 << 20, 50 << 20, 100 << 20, 250 << 20, 500 << 20, 1 << 30))
+upload_duration = Histogram(
+    "upload_duration_seconds", "Time from the first to the last chunk of an uploaded file.",
+    (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800))
+
+
+def file_checksum(f, chunk_size=64 * 1024, throttle=None):
+    """
+    SHA-256 hex digest of a file object, read from the start in chunks.
+    An optional utils.throttle.TokenBucket limits the read rate.
+    """
+    sha256 = hashlib.sha256()
+    f.seek(0)
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        if throttle is not None:
+            throttle.consume(len(data))
+        sha256.update(data)
+    f.seek(0)
+    return sha256.hexdigest()
+
+
+def uploaded_checksum(f):
+    """
+    The digest computed while the file was uploaded, see ChecksumMixin.
+    Files that didn't go through the upload handlers are read once.
+    """
+    checksum = getattr(f, "sha256", None)
+    if checksum is None:
+        checksum = file_checksum(f)
+    return checksum
+
+
+class ChecksumMixin(object):
+    """
+    Computes the SHA-256 digest of uploaded files while they are received,
+    so they don't have to be read again. It's stored in the `sha256` attribute
+    of the uploaded file. Also measures the size and duration of uploads.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        self.started = time.time()
+        return super(ChecksumMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super(ChecksumMixin, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super(ChecksumMixin, self).file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.sha256.hexdigest()
+            upload_bytes.observe(file_size)
+            upload_duration.observe(time.time() - self.started)
+        return uploaded_file
+
+
+class ChecksumMemoryFileUploadHandler(ChecksumMixin, MemoryFileUploadHandler):
+    pass
+
+
+class ChecksumTemporaryFileUploadHandler(ChecksumMixin, TemporaryFileUploadHandler):
+    pass
@@ -1,17 +1,178 @@
 from __future__ import unicode_literals, absolute_import
 
+import mimetypes
 import os
+import re
 
+from django.http import (
+    Http404, HttpResponse, HttpResponseForbidden, HttpResponseNotModified,
+    HttpResponseRedirect, StreamingHttpResponse)
+from django.utils.cache import patch_cache_control
+from django.utils.functional import cached_property
+from django.utils.http import http_date, urlquote
+from django.views.static import was_modified_since
+
+from private_storage.models import PrivateFile
 from private_storage.views import PrivateStorageView
 
+from . import display_filename, has_local_path
+
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def content_disposition(filename):
+    """
+    Header value to download a file with its original name.
+    Includes an ASCII fallback for clients that don't support RFC 5987.
+    """
+    fallback = filename.encode("ascii", "ignore").decode("ascii").replace('"', "")
+    return "attachment; filename=\"%s\"; filename*=UTF-8''%s" % (
+        fallback, urlquote(filename))
+
+
+class StoredFile(PrivateFile):
+    """
+    A PrivateFile that asks its storage instead of the local file system,
+    so it also works with storages that don't have local paths.
+    """
+
+    def exists(self):
+        return self.storage.exists(self.relative_name)
+
+    @cached_property
+    def content_type(self):
+        mimetype, encoding = mimetypes.guess_type(self.relative_name)
+        return mimetype or "application/octet-stream"
 
-class PrivateAttachment(PrivateStorageView):
+
+class StoredFileView(PrivateStorageView):
+    """
+    PrivateStorageView for any storage. Files in local storages are served
+    by the configured server, files in remote storages (see
+    mixing.storage.ObjectStorage) by redirecting to a signed URL once the
+    access rules have been checked.
+    """
+
+    def get(self, request, *args, **kwargs):
+        private_file = StoredFile(
+            request=request, storage=self.storage, relative_name=self.kwargs["path"])
+
+        if not self.can_access_file(private_file):
+            return HttpResponseForbidden("Private storage access denied")
+
+        if not private_file.exists():
+            raise Http404("File not found")
+
+        if has_local_path(private_file.storage):
+            return self.serve_file(private_file)
+        return self.redirect_to_file(private_file)
+
+    def get_disposition(self, private_file):
+        return None
+
+    def redirect_to_file(self, private_file):
+        url = private_file.storage.signed_url(
+            private_file.relative_name, content_type=private_file.content_type,
+            disposition=self.get_disposition(private_file))
+        return HttpResponseRedirect(url)
+
+
+class PrivateAttachment(StoredFileView):
     """
     Modifies the PrivateStorageView to return the response as an attachment.
     """
 
+    def get_filename(self, private_file):
+        """
+        The name the file will be downloaded as.
+        """
+        return display_filename(private_file.relative_name)
+
+    def get_disposition(self, private_file):
+        return content_disposition(self.get_filename(private_file))
+
     def serve_file(self, private_file):
-        filename = os.path.basename(private_file.full_path)
         response = super(PrivateAttachment, self).serve_file(private_file)
-        response["Content-Disposition"] = "attachment; filename=\"%s\"" % filename
+        response["Content-Disposition"] = self.get_disposition(private_file)
+        return response
+
+
+def parse_range(header, size):
+    """
+    The (first, last) byte positions of a single "bytes=first-last" range.
+    Returns None to serve the whole file (missing or unsupported header, e.g.
+    multiple ranges) and raises ValueError if the range can't be satisfied.
+    """
+    match = RANGE_HEADER.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        first, last = int(first), min(int(last or size - 1), size - 1)
+    else:  # Suffix range, e.g. the last 500 bytes
+        first, last = max(0, size - int(last)), size - 1
+    if first > last:
+        raise ValueError("Unsatisfiable range")
+    return first, last
+
+
+def read_chunks(f, length, chunk_size=64 * 1024):
+    """
+    Yield `length` bytes from the current position of f and close it.
+    """
+    try:
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def serve_ranged_file(request, path, content_type):
+    """
+    Serve a local file with support for Range requests, which audio and video
+    players use to seek. Also answers If-Modified-Since with 304 responses.
+    """
+    stat = os.stat(path)
+    if not was_modified_since(
+            request.META.get("HTTP_IF_MODIFIED_SINCE"), stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+
+    size = stat.st_size
+    try:
+        byte_range = parse_range(request.META.get("HTTP_RANGE", ""), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */%d" % size
+        return response
+
+    first, last = byte_range or (0, size - 1)
+    f = open(path, "rb")
+    f.seek(first)
+    response = StreamingHttpResponse(
+        read_chunks(f, last - first + 1), content_type=content_type,
+        status=206 if byte_range else 200)
+    if byte_range:
+        response["Content-Range"] = "bytes %d-%d/%d" % (first, last, size)
+    response["Content-Length"] = last - first + 1
+    response["Accept-Ranges"] = "bytes"
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    return response
+
+
+class PrivateStream(StoredFileView):
+    """
+    Serves private files inline (e.g. for <audio> elements) with Range support.
+    Files are expected to never change under the same name, so browsers may
+    cache them for as long as max_age.
+    """
+    max_age = 60 * 60 * 24 * 30
+
+    def serve_file(self, private_file):
+        response = serve_ranged_file(
+            private_file.request, private_file.full_path, private_file.content_type)
+        patch_cache_control(response, private=True, max_age=self.max_age)
         return response